@@ -0,0 +1,86 @@
+import argparse
+import random
+import time
+from datetime import datetime
+import pandas as pd
+from itc_transform import map_unique, header_year, year_period
+
+
+def make_frame(rows: int, years: int = 12, partners: int = 230) -> pd.DataFrame:
+    """
+    Синтетический датафрейм в том виде, в каком он получается после melt файлов Trade Map
+
+    :param rows: количество строк
+
+    :param years: количество лет (столбцов Value и Unit) в файле
+
+    :param partners: количество партнеров
+
+    :return: датафрейм со столбцами variable, reporter_country, partner_country
+    """
+    random.seed(0)
+    headers = [f'Slovenia imports from partner-Value in {2024 - years + i}' for i in range(years)] + \
+              ['x-Unit'] + [f'x-Unit.{i}' for i in range(1, years)]
+    return pd.DataFrame({'variable': [random.choice(headers) for _ in range(rows)],
+                         'reporter_country': 'Slovenia',
+                         'partner_country': [f'Partner {random.randrange(partners)}' for _ in range(rows)]})
+
+
+def steps_apply(df: pd.DataFrame, dict_partner_code: dict) -> pd.DataFrame:
+    """
+    Обогащение построчным apply, как было в ноутбуках
+    """
+    result = pd.DataFrame(index=df.index)
+    result['bool_unit'] = df.variable.apply(lambda x: True if '-Unit' in x else False)
+    values = df.variable[~result.bool_unit]
+    result['year_transaction'] = values.apply(lambda x: x.split(' in ')[1])
+    result['period'] = result.year_transaction.dropna().apply(lambda x: datetime.strptime('01-01-' + x, '%d-%m-%Y'))
+    result['test_name'] = df.partner_country.apply(lambda x: x)
+    result['reporter_code'] = df.reporter_country.apply(lambda x: dict_partner_code[x])
+    return result
+
+
+def steps_unique(df: pd.DataFrame, dict_partner_code: dict) -> pd.DataFrame:
+    """
+    То же обогащение через map_unique (как в itc_transform)
+    """
+    result = pd.DataFrame(index=df.index)
+    result['bool_unit'] = map_unique(df.variable, lambda x: '-Unit' in x)
+    values = df.variable[~result.bool_unit]
+    result['year_transaction'] = map_unique(values, header_year)
+    result['period'] = map_unique(result.year_transaction.dropna(), year_period)
+    result['test_name'] = df.partner_country
+    result['reporter_code'] = map_unique(df.reporter_country, lambda x: dict_partner_code[x])
+    return result
+
+
+def measure(func, df: pd.DataFrame, dict_partner_code: dict, repeat: int) -> tuple:
+    """
+    :return: (лучшее время в секундах, результат)
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = func(df, dict_partner_code)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Сравнение построчного apply и map_unique на этапе обогащения')
+    arg_parser.add_argument('--rows', type=int, default=2_000_000, help='количество строк')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='количество повторов, берется лучшее время')
+    args = arg_parser.parse_args()
+
+    df = make_frame(args.rows)
+    dict_partner_code = {'Slovenia': 705}
+    time_apply, result_apply = measure(steps_apply, df, dict_partner_code, args.repeat)
+    time_unique, result_unique = measure(steps_unique, df, dict_partner_code, args.repeat)
+    # Результат должен совпадать полностью, иначе сравнение скорости не имеет смысла
+    pd.testing.assert_frame_equal(result_apply, result_unique)
+
+    print(f'строк: {args.rows}')
+    print(f'apply:      {time_apply:.2f} с, {args.rows / time_apply:,.0f} строк/с')
+    print(f'map_unique: {time_unique:.2f} с, {args.rows / time_unique:,.0f} строк/с')
+    print(f'ускорение:  {time_apply / time_unique:.1f}x')
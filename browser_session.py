@@ -0,0 +1,276 @@
+import fnmatch
+import json
+import logging
+import typing
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+
+class ITC_browser_session:
+
+    # Ресурсы, которые не нужны для парсинга: шрифты, статичные картинки и счетчики.
+    # Капча отдается не статичным файлом, а обработчиком страницы, поэтому под шаблоны не попадает
+    lean_blocked_fonts = ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot']
+    lean_blocked_images = ['*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.webp', '*.bmp']
+    lean_blocked_trackers = ['*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+                             '*facebook.net*', '*hotjar.com*', '*clarity.ms*', '*addthis.com*']
+
+    def __init__(self, proxy: str, castom_logger: logging.Logger, flag_lean: typing.Optional[bool] = False,
+                 profile_dir: typing.Optional[str] = None):
+        """
+        Долгоживущая сессия браузера. Один запущенный Chrome с пройденными логином и капчей
+        используется всеми вызовами ITC_parser.main, папка загрузки меняется без перезапуска браузера
+
+        :param proxy: прокси для запуска браузера
+
+        :param castom_logger: экзепляр класса logging для записи логов в файл
+
+        :param flag_lean: облегченный режим - браузер без окна, шрифты, картинки и счетчики не загружаются
+
+        :param profile_dir: постоянный профиль Chrome (user-data-dir), куки и localStorage переживают перезапуск.
+                            None - каждый запуск с чистым временным профилем
+        """
+        self.proxy = proxy
+        self.castom_logger = castom_logger
+        self.flag_lean = flag_lean
+        self.profile_dir = profile_dir
+        # False - картинки разблокированы (например, если с блокировкой не загрузилась капча)
+        self.flag_block_images = True
+        # Адрес -> байт, сколько весят блокируемые ресурсы страницы без блокировки (замер measure_blocked_sizes)
+        self.blocked_sizes: typing.Optional[dict] = None
+        self.browser: typing.Optional[webdriver.Chrome] = None
+        # True - логин и капча в этой сессии уже пройдены
+        self.flag_authorized = False
+        self.download_dir: typing.Optional[str] = None
+
+    def _build_options(self, full_path_download: typing.Optional[str] = None) -> webdriver.ChromeOptions:
+        """
+        Настройки браузера
+
+        :param full_path_download: папка загрузки при старте браузера (None - задается позже через set_download_dir)
+
+        :return: экземпляр ChromeOptions
+        """
+        options = webdriver.ChromeOptions()
+
+        # Для отключения визуального интерфейса (окна браузера)
+        if self.flag_lean:
+            options.add_argument("--headless=new")
+            options.add_argument("--disable-gpu")
+            # Размер окна задаем явно, иначе в режиме без окна верстка (и скриншот капчи) может съехать
+            options.add_argument("--window-size=1920,1080")
+            # Журнал сетевых событий для подсчета запросов и трафика по страницам
+            options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+
+        # Отключаем настройку, которая сообщает, что брауезр управляется автоматически
+        options.add_experimental_option("excludeSwitches", ["enable-automation"])
+        # Отключает использование расширений автоматизации, чтобы скрыть, что брауезр управляется автоматически
+        options.add_experimental_option("useAutomationExtension", False)
+        # Для того чтобы сайт думал, что перед ним реальный браузер
+        options.add_argument("--disable-blink-features=AutomationControlled")
+        # Свой user-agent, чтобы сделать браузе похожий на свой
+        options.add_argument(
+            "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36")
+        options.add_argument('--proxy-server=%s' % self.proxy)
+        if self.profile_dir is not None:
+            options.add_argument(f'--user-data-dir={self.profile_dir}')
+
+        # Настройки для указания папки загрузки файлов и отключение окна запроса на сохранение логина и пароля
+        prefs = {
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+            "credentials_enable_service": False,
+            "profile.password_manager_enabled": False
+        }
+        if full_path_download is not None:
+            prefs["download.default_directory"] = full_path_download
+        options.add_experimental_option("prefs", prefs)
+        return options
+
+    def is_alive(self) -> bool:
+        """
+        :return: True если браузер запущен и отвечает
+        """
+        if self.browser is None:
+            return False
+        try:
+            _ = self.browser.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    def start(self, full_path_download: typing.Optional[str] = None) -> webdriver.Chrome:
+        """
+        Запускает браузер, если он еще не запущен или упал, иначе только меняет папку загрузки
+
+        :param full_path_download: полный путь, куда будут скачиваться файлы
+                                   (None - папка задается перед каждой загрузкой через set_download_dir)
+
+        :return: экземпляр webdriver
+        """
+        if not self.is_alive():
+            self.close()
+            self.browser = webdriver.Chrome(options=self._build_options(full_path_download))
+            self.flag_authorized = False
+            self.download_dir = full_path_download
+            if self.flag_lean:
+                self.apply_blocking()
+            self.castom_logger.info(f'ЗАПУЩЕН НОВЫЙ БРАУЗЕР{" (ОБЛЕГЧЕННЫЙ РЕЖИМ)" if self.flag_lean else ""}')
+        elif full_path_download is not None:
+            self.set_download_dir(full_path_download)
+        return self.browser
+
+    def set_download_dir(self, full_path_download: str):
+        """
+        Меняет папку загрузки в уже запущенном браузере через DevTools
+
+        :param full_path_download: полный путь, куда будут скачиваться файлы
+
+        :return:
+        """
+        if self.download_dir == full_path_download:
+            return
+        self.browser.execute_cdp_cmd('Browser.setDownloadBehavior', {'behavior': 'allow',
+                                                                     'downloadPath': full_path_download})
+        self.download_dir = full_path_download
+        self.castom_logger.info(f'ПАПКА ЗАГРУЗКИ {full_path_download}')
+
+    def apply_blocking(self):
+        """
+        Передает в DevTools список блокируемых адресов
+
+        :return:
+        """
+        self.browser.execute_cdp_cmd('Network.enable', {})
+        self.browser.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.blocked_urls()})
+
+    def blocked_urls(self) -> list:
+        """
+        :return: шаблоны адресов, которые сейчас блокируются
+        """
+        blocked_urls = self.lean_blocked_fonts + self.lean_blocked_trackers
+        if self.flag_block_images:
+            blocked_urls += self.lean_blocked_images
+        return blocked_urls
+
+    def ensure_image_loaded(self, class_name: str) -> bool:
+        """
+        Проверяет, что картинка внутри элемента загрузилась. Если нет и картинки блокируются,
+        блокировка картинок снимается до конца сессии и страница перезагружается
+
+        :param class_name: класс элемента с картинкой (например, div_captchaImg)
+
+        :return: True если картинка загружена, False если страница была перезагружена
+        """
+        if not self.flag_lean or not self.flag_block_images:
+            return True
+        loaded = self.browser.execute_script(
+            """var element = document.getElementsByClassName(arguments[0])[0];
+               if (!element) { return true; }
+               var images = element.tagName === 'IMG' ? [element] : element.getElementsByTagName('img');
+               return Array.prototype.every.call(images, function (img) {
+                   return img.complete && img.naturalWidth > 0;
+               });""",
+            class_name)
+        if loaded:
+            return True
+        self.castom_logger.info(f'КАРТИНКА {class_name} НЕ ЗАГРУЗИЛАСЬ, СНИМАЕМ БЛОКИРОВКУ КАРТИНОК')
+        self.flag_block_images = False
+        self.apply_blocking()
+        self.browser.refresh()
+        return False
+
+    def _network_log(self) -> list:
+        """
+        :return: сетевые события DevTools, накопленные с прошлого чтения (журнал при этом очищается)
+        """
+        return [json.loads(entry['message'])['message'] for entry in self.browser.get_log('performance')]
+
+    def measure_blocked_sizes(self):
+        """
+        Один раз за сессию открывает текущую страницу в отдельной вкладке, где блокировки нет (она задается
+        для вкладки), и запоминает размер ресурсов, попадающих под шаблоны блокировки.
+        Заблокированный запрос не скачивается, поэтому экономию в page_stats оцениваем по этому замеру
+
+        :return:
+        """
+        original_window = self.browser.current_window_handle
+        url = self.browser.current_url
+        blocked_urls = self.blocked_urls()
+        self.blocked_sizes = {}
+        try:
+            self.browser.switch_to.new_window('tab')
+            self.browser.get(url)
+            request_urls = {}
+            for message in self._network_log():
+                params = message['params']
+                if message['method'] == 'Network.responseReceived':
+                    request_urls[params['requestId']] = params['response']['url']
+                elif message['method'] == 'Network.loadingFinished' and params['requestId'] in request_urls:
+                    resource_url = request_urls[params['requestId']]
+                    if any(fnmatch.fnmatchcase(resource_url, pattern) for pattern in blocked_urls):
+                        self.blocked_sizes[resource_url] = int(params.get('encodedDataLength', 0))
+            self.castom_logger.info(f'ЗАМЕР БЕЗ БЛОКИРОВКИ: {len(self.blocked_sizes)} РЕСУРСОВ, '
+                                    f'{sum(self.blocked_sizes.values()) / 1024:.1f} КБ')
+        except WebDriverException as e:
+            self.castom_logger.info(f'ЗАМЕР БЕЗ БЛОКИРОВКИ НЕ УДАЛСЯ {e}')
+        finally:
+            try:
+                if self.browser.current_window_handle != original_window:
+                    self.browser.close()
+                self.browser.switch_to.window(original_window)
+            except WebDriverException as e:
+                self.castom_logger.info(f'НЕ УДАЛОСЬ ВЕРНУТЬСЯ НА ОСНОВНУЮ ВКЛАДКУ {e}')
+
+    def page_stats(self) -> typing.Optional[dict]:
+        """
+        Разбирает накопленный журнал сетевых событий (журнал при этом очищается). Размер заблокированного
+        ресурса берется из замера measure_blocked_sizes (он делается при первой блокировке), для ресурсов,
+        которых не было в замере, - средний размер по замеру
+
+        :return: словарь с ключами requests (выполненные запросы), bytes (получено байт с учетом сжатия),
+                 saved_requests (заблокированные запросы), saved_bytes (оценка нескачанных байт)
+                 или None, если облегченный режим выключен
+        """
+        if not self.flag_lean:
+            return None
+        stats = {'requests': 0, 'bytes': 0, 'saved_requests': 0, 'saved_bytes': 0}
+        request_urls, saved_urls = {}, []
+        for message in self._network_log():
+            params = message['params']
+            if message['method'] == 'Network.requestWillBeSent':
+                request_urls[params['requestId']] = params['request']['url']
+            elif message['method'] == 'Network.loadingFinished':
+                stats['requests'] += 1
+                stats['bytes'] += int(params.get('encodedDataLength', 0))
+            elif message['method'] == 'Network.loadingFailed' and params.get('blockedReason'):
+                stats['saved_requests'] += 1
+                saved_urls.append(request_urls.get(params['requestId']))
+        if saved_urls and self.blocked_sizes is None:
+            self.measure_blocked_sizes()
+        if self.blocked_sizes:
+            average_size = sum(self.blocked_sizes.values()) / len(self.blocked_sizes)
+            stats['saved_bytes'] = int(sum(self.blocked_sizes.get(url, average_size) for url in saved_urls))
+        return stats
+
+    def close(self):
+        """
+        Закрывает браузер
+
+        :return:
+        """
+        if self.browser is not None:
+            try:
+                self.browser.quit()
+            except WebDriverException as e:
+                self.castom_logger.info(f'ОШИБКА ПРИ ЗАКРЫТИИ БРАУЗЕРА {e}')
+        self.browser = None
+        self.flag_authorized = False
+        self.download_dir = None
+        self.flag_block_images = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,8 +1,9 @@
+import collections
 import logging
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import os
 import time
 import typing
-import json
 from selenium import webdriver
 from selenium.common.exceptions import TimeoutException
 from selenium.common.exceptions import NoSuchElementException as no_element
@@ -10,15 +11,43 @@ from selenium.common.exceptions import StaleElementReferenceException, ElementCl
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.ui import WebDriverWait
-import psycopg2
-import telebot
+from browser_session import ITC_browser_session
+from download_watcher import Download_watcher, CHROME_TEMP_SUFFIX
+from download_index import Download_index
+from file_check import ITC_file_check
+from http_export import ITC_http_exporter
+from grid_parser import ITC_grid_parser
+from partner_catalogue import Partner_catalogue
+from state_store import ITC_state_store
+from db_pool import ITC_db
+from nvpm_url import ITC_url_builder
+from notify_queue import ITC_notify_queue
+from session_store import ITC_session_store
 
 
 class ITC_parser:
 
+    # Канал NOTIFY триггера на ce и максимальное время ожидания уведомления перед проверкой флага капчи
+    captcha_channel = 'ce_captcha'
+    captcha_wait_timeout = 30
+    # Сколько ждать отправки картинки капчи в Telegram (недоступный Telegram или долгий 429)
+    captcha_send_timeout = 120
+    # Сколько раз партнер возвращается в конец очереди после неудачной загрузки
+    max_download_attempts = 3
+    # Подпапка папки задачи, куда Chrome пишет файлы до проверки (та же файловая система, поэтому перенос атомарный)
+    staging_folder_name = '.staging'
+    # Поле nvpm_conf -> ключ dict_html_elements выпадающего списка, который это поле выбирает
+    nvpm_select_keys = {'reporter': 'country_reporter', 'partner': 'country_partner',
+                        'product_cluster_level': 'product_cluster_level', 'trade_type': 'trade_type',
+                        'ts_indicator': 'ts_indicator', 'ts_currency': 'ts_currency'}
+
     def __init__(self, dict_html_elements: dict, url_trade_map: str, castom_logger: logging.Logger,
                  chat_id_user: str, bot_token: str, dict_postgres_cred: dict, patern_file: str,
-                 proxy: str):
+                 proxy: str, worker_id: typing.Optional[int] = 0,
+                 flag_http_export: typing.Optional[bool] = False,
+                 flag_lean: typing.Optional[bool] = False, nvpm_conf: typing.Optional[dict] = None,
+                 max_pending_downloads: typing.Optional[int] = 1, session_dir: typing.Optional[str] = None,
+                 http_max_workers: typing.Optional[int] = 1):
         """
         :param dict_html_elements: словарь с тэгами для навигации по сайту
 
@@ -35,19 +64,64 @@ class ITC_parser:
         :param patern_file: патерн названия файла для проверки, скачен он или нет
 
         :param proxy: прокси для запуска парсера, чтобы не забанили основной ip
+
+        :param worker_id: номер воркера в пуле, у каждого воркера своя строка в таблице ce
+
+        :param flag_http_export: скачивать файлы напрямую по HTTP (браузер только для логина и капчи),
+                                 партнеры, которые не удалось скачать по HTTP, докачиваются через браузер
+
+        :param flag_lean: облегченный режим браузера - без окна, без шрифтов, картинок и счетчиков
+
+        :param nvpm_conf: описание полей nvpm для сборки ссылок на нужную таблицу (nvpm_conf из config.py),
+                          без него всегда открывается url_trade_map и опции выставляются выпадающими списками.
+                          Если страница по ссылке открылась не с теми опциями, сборка ссылок отключается (check_job_url)
+
+        :param max_pending_downloads: сколько загрузок может идти одновременно. 1 - ждать каждый файл,
+                                      больше 1 - переходить к следующему партнеру сразу после начала загрузки
+
+        :param session_dir: папка для сохраненных профиля Chrome и куки учетной записи. Если задана, после перезапуска
+                            сначала пробуется сохраненная сессия, логин и капча - только если сервер ее не принял
+
+        :param http_max_workers: сколько партнеров выгружать по HTTP одновременно (только при flag_http_export)
         """
         self.dict_html_elements = dict_html_elements
+        self.grid_parser = ITC_grid_parser(dict_html_elements)
+        self.partner_catalogue = Partner_catalogue()
+        # Партнеры с данными и года с зеркальными данными (выгружаются в {type_flow}_res.json и json_mirror_data.json)
+        self.state_store = ITC_state_store()
         self.url_trade_map = url_trade_map
+        self.url_builder = ITC_url_builder(url_trade_map, nvpm_conf) if nvpm_conf else None
         self.castom_logger = castom_logger
         self.chat_id_user = chat_id_user
-        self.bot = telebot.TeleBot(bot_token)
-        self.postgres_conn = psycopg2.connect(user=dict_postgres_cred['user'],
-                                              password=dict_postgres_cred['password'],
-                                              host=dict_postgres_cred['host'],
-                                              port=dict_postgres_cred['port'],
-                                              database=dict_postgres_cred['database'])
+        # Уведомления отправляются фоновым потоком, чтобы недоступный Telegram не останавливал парсинг
+        self.notify = ITC_notify_queue(bot_token, castom_logger)
+        # Пул подключений к БД, чекпоинты в ce пишутся в фоне
+        self.db = ITC_db(dict_postgres_cred, castom_logger)
+        # Строка ce выбирается по chat_id и worker_id, без столбца worker_id работать нельзя
+        self.db.check_worker_column()
+        # Ответ на капчу приходит через NOTIFY триггера на ce
+        self.db.create_captcha_trigger(self.captcha_channel)
         self.patern_file = patern_file
         self.proxy = proxy
+        self.worker_id = worker_id
+        self.flag_http_export = flag_http_export
+        self.http_max_workers = max(1, http_max_workers)
+        self.flag_lean = flag_lean
+        # Браузер с пройденными логином и капчей, общий для всех вызовов main
+        self.browser_session: typing.Optional[ITC_browser_session] = None
+        # Наблюдатели за промежуточными папками загрузки, по одному на папку
+        self.download_watchers = {}
+        # Индексы скачанных файлов, по одному на папку, строятся в начале каждой задачи
+        self.download_indexes = {}
+        # Проверка заголовка скачанных файлов (измерение, направление, уровень кластера)
+        self.file_check = ITC_file_check()
+        self.max_pending_downloads = max(1, max_pending_downloads)
+        # Незавершенные загрузки (папка, файл, партнер, действие после загрузки) и партнеры с неудачной загрузкой
+        self.pending_downloads = []
+        self.failed_partners = []
+        # Сохраненная авторизованная сессия (профиль Chrome и куки), None - логин в каждом новом браузере
+        self.session_store = ITC_session_store(session_dir, dict_html_elements['mail_user'], worker_id, castom_logger) \
+            if session_dir else None
 
     def insert_user_in_db(self):
         """
@@ -55,10 +129,8 @@ class ITC_parser:
 
         :return:
         """
-        with self.postgres_conn.cursor() as cur:
-            cur.execute("""INSERT INTO ce (chat_id)
-                           VALUES (%s)""", (self.chat_id_user,))
-        self.postgres_conn.commit()
+        self.db.execute("""INSERT INTO ce (chat_id, worker_id)
+                           VALUES (%s, %s)""", (self.chat_id_user, self.worker_id))
 
     def login(self, browser: webdriver, flag_insert_user: bool):
         """
@@ -102,19 +174,17 @@ class ITC_parser:
 
         :return: флаг отвечающий за актуальность капчи
         """
-        with self.postgres_conn.cursor() as cur:
-            cur.execute('SELECT captcha_flag FROM ce WHERE chat_id = %s',
-                        (self.chat_id_user,))
-            return cur.fetchone()[0]
+        self.db.flush()
+        return self.db.execute('SELECT captcha_flag FROM ce WHERE chat_id = %s AND worker_id = %s',
+                               (self.chat_id_user, self.worker_id), fetch=True)[0]
 
     def get_captcha_text(self) -> str:
         """
         :return: текст введенной капчи
         """
-        with self.postgres_conn.cursor() as cur:
-            cur.execute('SELECT captcha_text FROM ce WHERE chat_id = %s',
-                        (self.chat_id_user,))
-            return cur.fetchone()[0]
+        self.db.flush()
+        return self.db.execute('SELECT captcha_text FROM ce WHERE chat_id = %s AND worker_id = %s',
+                               (self.chat_id_user, self.worker_id), fetch=True)[0]
 
     def update_captcha_flag(self):
         """
@@ -122,10 +192,8 @@ class ITC_parser:
 
         :return:
         """
-        with self.postgres_conn.cursor() as cur:
-            cur.execute('UPDATE ce SET captcha_flag = False WHERE chat_id = %s',
-                        (self.chat_id_user,))
-        self.postgres_conn.commit()
+        self.db.write_later('captcha_flag', 'UPDATE ce SET captcha_flag = False WHERE chat_id = %s AND worker_id = %s',
+                            (self.chat_id_user, self.worker_id))
 
     def update_partner_flag(self):
         """
@@ -133,10 +201,8 @@ class ITC_parser:
 
         :return:
         """
-        with self.postgres_conn.cursor() as cur:
-            cur.execute('UPDATE ce SET partner_flag = False WHERE chat_id = %s',
-                        (self.chat_id_user,))
-        self.postgres_conn.commit()
+        self.db.write_later('partner_flag', 'UPDATE ce SET partner_flag = False WHERE chat_id = %s AND worker_id = %s',
+                            (self.chat_id_user, self.worker_id))
 
     def update_current_partner(self, partner: str):
         """
@@ -146,10 +212,10 @@ class ITC_parser:
 
         :return:
         """
-        with self.postgres_conn.cursor() as cur:
-            cur.execute("""UPDATE ce SET current_partner = %s WHERE chat_id = %s""",
-                        (partner, self.chat_id_user))
-        self.postgres_conn.commit()
+        # Пишется в фоне, в базу попадает только последний партнер за интервал записи
+        self.db.write_later('current_partner',
+                            """UPDATE ce SET current_partner = %s WHERE chat_id = %s AND worker_id = %s""",
+                            (partner, self.chat_id_user, self.worker_id))
 
     def get_partner_save_point(self) -> tuple:
         """
@@ -157,10 +223,9 @@ class ITC_parser:
                  Флаг - задает поведение сборки списка партнеров, если True, то список будет собран начиная с
                         возвращенного партнера, если false, то список будет собран полностью
         """
-        with self.postgres_conn.cursor() as cur:
-            cur.execute("""SELECT current_partner, partner_flag FROM ce WHERE chat_id = %s""",
-                        (self.chat_id_user,))
-            return cur.fetchone()
+        self.db.flush()
+        return self.db.execute("""SELECT current_partner, partner_flag FROM ce WHERE chat_id = %s AND worker_id = %s""",
+                               (self.chat_id_user, self.worker_id), fetch=True)
 
     def update_captha_message_id(self, message_id: str):
         """
@@ -170,10 +235,9 @@ class ITC_parser:
 
         :return:
         """
-        with self.postgres_conn.cursor() as cur:
-            cur.execute("""UPDATE ce SET captha_message_id = %s WHERE chat_id = %s""",
-                        (message_id, self.chat_id_user))
-        self.postgres_conn.commit()
+        self.db.write_later('captha_message_id',
+                            """UPDATE ce SET captha_message_id = %s WHERE chat_id = %s AND worker_id = %s""",
+                            (message_id, self.chat_id_user, self.worker_id))
 
     def click_button_yearly_time_series(self, browser: webdriver, type_flow: str, reporter_name: str = None) -> bool:
         """
@@ -258,11 +322,29 @@ class ITC_parser:
         """
         try:
             captch = WebDriverWait(browser, 10).until(EC.presence_of_element_located((By.CLASS_NAME, 'div_captchaImg')))
-            captch.screenshot('captcha_picture.png')
-            with open('captcha_picture.png', 'rb') as captha:
-                message = self.bot.send_photo(self.chat_id_user, captha, caption='‼️ Введите текст капчи!')
-                self.update_captha_message_id(message.photo[-1].file_id)
-                time.sleep(45)
+            # В облегченном режиме капча могла не загрузиться, тогда картинки разблокируются и страница перезагружается
+            if self.browser_session is not None and not self.browser_session.ensure_image_loaded('div_captchaImg'):
+                captch = WebDriverWait(browser, 10).until(
+                    EC.presence_of_element_located((By.CLASS_NAME, 'div_captchaImg')))
+            # Подписываемся до отправки картинки, чтобы не пропустить ответ, пришедший сразу
+            self.db.listen(self.captcha_channel)
+            # У каждого воркера свой файл картинки, чтобы воркеры не перезаписывали капчу друг друга
+            captcha_picture = f'captcha_picture_{self.worker_id}.png'
+            captch.screenshot(captcha_picture)
+            with open(captcha_picture, 'rb') as captha:
+                # Капча уходит вне очереди, ждем только ее отправку, чтобы получить file_id
+                photo_future = self.notify.send_photo(self.chat_id_user, captha.read(),
+                                                      caption=f'‼️ Введите текст капчи! (воркер {self.worker_id})')
+            try:
+                message = photo_future.result(timeout=self.captcha_send_timeout)
+            except FutureTimeoutError:
+                # Неотправленная картинка устарела, вызывающий код отправит новую
+                photo_future.cancel()
+                self.castom_logger.info(f'КАПЧА НЕ ОТПРАВЛЕНА ЗА {self.captcha_send_timeout} секунд')
+                return False
+            self.update_captha_message_id(message.photo[-1].file_id)
+            # id сообщения нужен боту сразу, чтобы сопоставить ответ пользователя со строкой ce
+            self.db.flush()
             while True:
                 if self.get_captcha_flag():
                     captcha_text = self.get_captcha_text()
@@ -273,179 +355,170 @@ class ITC_parser:
 
                     # Проверяем, пройдена капча или нет и проходим на страницу с даными
                     return self.click_button_yearly_time_series(browser, type_flow, reporter_name)
-                else:
-                    self.castom_logger.info('ОЖИДАЕМ ВВОД КАПЧИ 30 секунд')
-                    time.sleep(30)
+                # Ответ приходит через NOTIFY от триггера на ce, по таймауту флаг проверяется напрямую
+                if not self.db.wait_notify(f'{self.chat_id_user}:{self.worker_id}', self.captcha_wait_timeout):
+                    self.castom_logger.info(f'ОЖИДАЕМ ВВОД КАПЧИ {self.captcha_wait_timeout} секунд')
+                    self.db.listen(self.captcha_channel)
         except TimeoutException as e:
             self.castom_logger.info(f'ОШИБКА {e}. Вход без капчи')
             return True
 
-    def option_check(self, browser: webdriver, type_flow: str, product_cluster_level_text: str, measure_type: str,
-                     reporter_name: str):
+    def get_select_values(self, browser: webdriver, keys: list) -> dict:
         """
-        Проверка опций перед скачиванием
+        Снимок значений выпадающих списков страницы одним вызовом execute_script
 
         :param browser: экземпляр класса webdriver запущенный в текущей сессии
 
-        :param type_flow: направление торговли
+        :param keys: ключи dict_html_elements с id выпадающих списков
 
-        :param product_cluster_level_text: на каком знаке выбираем продукты (или тарифной линии)
+        :return: словарь ключ -> текущее значение (None, если элемента на странице нет)
+        """
+        values = browser.execute_script(
+            """return arguments[0].map(function (id) {
+                   var element = document.getElementById(id);
+                   return element ? element.value : null;
+               });""",
+            [self.dict_html_elements[key] for key in keys])
+        return dict(zip(keys, values))
+
+    def get_select_options(self, browser: webdriver, key: str) -> list:
+        """
+        Все опции выпадающего списка одним вызовом execute_script
 
-        :param measure_type: проверяем деньги или вес
+        :param browser: экземпляр класса webdriver запущенный в текущей сессии
 
-        :param reporter_name: имя репортера, для проверки
+        :param key: ключ dict_html_elements с id выпадающего списка
 
-        :return:
+        :return: список пар [текст опции, value опции]
         """
-        # Проверяем репортера
-        try:
-            reporter_params = WebDriverWait(browser, 3).until(
-                EC.presence_of_element_located((By.ID, self.dict_html_elements['country_reporter'])))
-            if reporter_params.get_attribute('value') == reporter_name:
-                self.castom_logger.info('* Reporter')
-            else:
-                raise TimeoutException
-        except TimeoutException:
-            browser.find_element(
-                By.XPATH,
-                f"""//select[@id='{self.dict_html_elements['country_reporter']}']/option[text()="{reporter_name}"]""").click()
-            self.castom_logger.info('ПОПРАВЛЯЕМ Reporter')
+        return browser.execute_script(
+            """var element = document.getElementById(arguments[0]);
+               if (!element) { return null; }
+               return Array.prototype.map.call(element.options, function (option) {
+                   return [option.text.trim(), option.value];
+               });""",
+            self.dict_html_elements[key])
+
+    def get_partner_list(self, browser: webdriver, reporter_name: str) -> list:
+        """
+        Список партнеров репортера. Берется из каталога, если там есть актуальная версия,
+        иначе снимается со страницы одним запросом и сохраняется в каталог
 
-        # Проверка trade_type (импорт или экспорт)
-        try:
-            WebDriverWait(browser, 3).until(
-                EC.text_to_be_present_in_element_value((By.ID, self.dict_html_elements['trade_type']),
-                                                       type_flow[0]))
-            self.castom_logger.info(f'** Trade_type')
-        except TimeoutException:
-            browser.find_element(
-                By.XPATH,
-                f"""//select[@id='{self.dict_html_elements['trade_type']}']/option[text()="{type_flow}"]""").click()
-            self.castom_logger.info(f'ПОПРАВЛЯЕМ Trade_type')
+        :param browser: экземпляр класса webdriver с выбранным репортером
 
-        # Проверка блока с Yearly time series
-        try:
-            WebDriverWait(browser, 3).until(
-                EC.text_to_be_present_in_element_value((By.ID, self.dict_html_elements['output_type']),
-                                                       'TSY'))
-            self.castom_logger.info(f'*** Yearly time series')
-        except TimeoutException:
-            browser.find_element(
-                By.XPATH,
-                f"""//select[@id='{self.dict_html_elements['output_type']}']/option[text()='Yearly time series']""").click()
-            self.castom_logger.info(f'ПОПРАВЛЯЕМ Yearly time series')
+        :param reporter_name: имя репортера
 
-        # Проверка блока с by product
-        try:
-            WebDriverWait(browser, 3).until(EC.text_to_be_present_in_element_value((By.ID,
-                                                                                    self.dict_html_elements[
-                                                                                        "output_option"]),
-                                                                                   'ByProduct'))
-            self.castom_logger.info(f'**** By product')
-        except TimeoutException:
-            browser.find_element(
-                By.XPATH,
-                f"//select[@id='{self.dict_html_elements['output_option']}']/option[text()='by product']").click()
-            self.castom_logger.info(f'ПОПРАВЛЯЕМ By product')
+        :return: список названий партнеров (без All)
+        """
+        partners = self.partner_catalogue.get(reporter_name)
+        if partners is None:
+            partners = self.get_select_options(browser, 'country_partner')
+            if partners is None:
+                raise no_element(f"Список {self.dict_html_elements['country_partner']} отсутствует на странице")
+            partners = [partner for partner in partners if partner[0] != 'All']
+            self.partner_catalogue.save(reporter_name, partners)
+            self.castom_logger.info(f"""СПИСОК ПАРТНЕРОВ {reporter_name} СНЯТ СО СТРАНИЦЫ: {len(partners)}""")
+        else:
+            self.castom_logger.info(f"""СПИСОК ПАРТНЕРОВ {reporter_name} ИЗ КАТАЛОГА: {len(partners)}""")
+        return [partner for partner, _ in partners]
 
-        # Проверка на количество выбранных занков (6 значный код или выбрана тарифная линия)
-        try:
-            WebDriverWait(browser, 3).until(EC.text_to_be_present_in_element_value((By.ID,
-                                                                                    self.dict_html_elements[
-                                                                                        'product_cluster_level']),
-                                                                                   '6' if product_cluster_level_text == 'Product cluster at 6 digits' else '8'))
-            self.castom_logger.info(f'***** Product cluster')
-        except TimeoutException:
-            browser.find_element(
-                By.XPATH,
-                f"""//select[@id='{self.dict_html_elements['product_cluster_level']}']/option[text()="{product_cluster_level_text}"]""").click()
-            self.castom_logger.info(f'ПОПРАВЛЯЕМ Product cluster')
+    @staticmethod
+    def desired_options(type_flow: str, product_cluster_level_text: str, measure_type: str,
+                        reporter_name: str) -> list:
+        """
+        :param type_flow: направление торговли
 
-        # Проверка блока Выбор валюта или вес
-        try:
-            WebDriverWait(browser, 3).until(EC.text_to_be_present_in_element_value((By.ID,
-                                                                                    self.dict_html_elements[
-                                                                                        'ts_indicator']),
-                                                                                   measure_type[0]))
-            self.castom_logger.info(f'****** Value_or_Qty')
-        except TimeoutException:
-            browser.find_element(
-                By.XPATH,
-                f"""//select[@id='{self.dict_html_elements['ts_indicator']}']/option[text()="{measure_type}"]""").click()
-            self.castom_logger.info(f'ПОПРАВЛЯЕМ Value_or_Qty')
+        :param product_cluster_level_text: на каком знаке выбираем продукты (или тарифной линии)
 
+        :param measure_type: проверяем деньги или вес
+
+        :param reporter_name: имя репортера
+
+        :return: нужные опции страницы - кортежи (ключ dict_html_elements, ожидаемое значение, точное совпадение
+                 или вхождение, текст нужной опции, название для лога)
+        """
+        # Порядок важен: репортер и направление меняют остальные списки, поэтому правятся первыми
+        desired_options = [
+            ('country_reporter', reporter_name, True, reporter_name, 'Reporter'),
+            ('trade_type', type_flow[0], False, type_flow, 'Trade_type'),
+            ('output_type', 'TSY', False, 'Yearly time series', 'Yearly time series'),
+            ('output_option', 'ByProduct', False, 'by product', 'By product'),
+            ('product_cluster_level', '6' if product_cluster_level_text == 'Product cluster at 6 digits' else '8',
+             False, product_cluster_level_text, 'Product cluster'),
+            ('ts_indicator', measure_type[0], False, measure_type, 'Value_or_Qty'),
+            ('num_time_period', '12', False, '12 per page', 'Per page')
+        ]
         # Проверка типа валюты
         if measure_type == 'Values':
-            try:
-                WebDriverWait(browser, 3).until(EC.text_to_be_present_in_element_value((By.ID,
-                                                                                        self.dict_html_elements[
-                                                                                            'ts_currency']),
-                                                                                       'USD'))
-                self.castom_logger.info(f'+ USD')
-            except TimeoutException:
-                browser.find_element(
-                    By.XPATH,
-                    f"//select[@id='{self.dict_html_elements['ts_currency']}']/option[text()='US Dollar']").click()
-                self.castom_logger.info(f'ПОПРАВЛЯЕМ USD')
+            desired_options.insert(-1, ('ts_currency', 'USD', False, 'US Dollar', 'USD'))
+        return desired_options
 
-        # Выбираем кол-во лет
-        try:
-            WebDriverWait(browser, 3).until(EC.text_to_be_present_in_element_value((By.ID,
-                                                                                    self.dict_html_elements[
-                                                                                        'num_time_period']),
-                                                                                   '12'))
-            self.castom_logger.info(f'******* Per page')
-        except TimeoutException:
-            browser.find_element(
-                By.XPATH,
-                f"//select[@id='{self.dict_html_elements['num_time_period']}']/option[text()='12 per page']").click()
-            self.castom_logger.info(f'ПОПРАВЛЯЕМ Per page')
+    def wrong_options(self, browser: webdriver, desired_options: list) -> list:
+        """
+        Снимок всех списков одним запросом к браузеру
 
-    @staticmethod
-    def _json_work_file(flag_type_work: str, file: str, reporter_country: str, value: str = '') -> list:
+        :param browser: экземпляр класса webdriver запущенный в текущей сессии
+
+        :param desired_options: нужные опции (см. desired_options)
+
+        :return: опции, которые отличаются от нужных - кортежи (ключ, текст нужной опции, название для лога,
+                 текущее значение) в порядке desired_options
+        """
+        select_values = self.get_select_values(browser, [option[0] for option in desired_options])
+        return [(key, option_text, log_name, select_values[key])
+                for key, expected_value, flag_exact, option_text, log_name in desired_options
+                if select_values[key] is None
+                or not (select_values[key] == expected_value if flag_exact
+                        else expected_value in select_values[key])]
+
+    def option_check(self, browser: webdriver, type_flow: str, product_cluster_level_text: str, measure_type: str,
+                     reporter_name: str):
         """
-        Записываем данные в json файлы или редактируем их
+        Проверка опций перед скачиванием. Все значения считываются одним запросом к браузеру,
+        меняются только те списки, которые отличаются от нужных
+
+        :param browser: экземпляр класса webdriver запущенный в текущей сессии
 
-        :param flag_type_work: флаг, от него зависит какой тип операции мы будем делать
+        :param type_flow: направление торговли
 
-        :param file: название файла
+        :param product_cluster_level_text: на каком знаке выбираем продукты (или тарифной линии)
 
-        :param reporter_country: название репортера
+        :param measure_type: проверяем деньги или вес
 
-        :param value: ззачастую название партнера
+        :param reporter_name: имя репортера, для проверки
 
-        :return: при флаге return_save_point список стран партнеров для переданного репортера
+        :return: TimeoutException, если опции не удалось выставить: вызывающий код перезагружает страницу
         """
-        if flag_type_work == 'other':
-            if os.path.isfile(file):
-                with open(file, encoding='utf-8') as fl:
-                    js_dict = json.load(fl)
-                if reporter_country in js_dict:
-                    if value not in js_dict[reporter_country]:
-                        js_dict[reporter_country].append(value)
-                else:
-                    js_dict[reporter_country] = [value]
-                with open(file, 'w', encoding='utf-8') as fl:
-                    json.dump(js_dict, fl, indent=4, ensure_ascii=False)
-            else:
-                dct = {reporter_country: [value]}
-                with open(file, 'w', encoding='utf-8') as fl:
-                    json.dump(dct, fl, indent=4, ensure_ascii=False)
-        elif flag_type_work == 'del_value':
-            if os.path.isfile(file):
-                with open(file, encoding='utf-8') as fl:
-                    js_dict = json.load(fl)
-                if reporter_country in js_dict:
-                    try:
-                        js_dict[reporter_country].remove(value)
-                        with open(file, 'w', encoding='utf-8') as fl:
-                            json.dump(js_dict, fl, indent=4, ensure_ascii=False)
-                    except ValueError:
-                        pass
-        elif flag_type_work == 'return_save_point':
-            with open(file, encoding='utf-8') as fl:
-                js_dict = json.load(fl)
-            return js_dict[reporter_country]
+        desired_options = self.desired_options(type_flow, product_cluster_level_text, measure_type, reporter_name)
+
+        # Постбэк одного списка может сбросить другие, поэтому после каждой правки снимок делается заново.
+        # Если все совпадает, на всю проверку уходит один запрос к браузеру
+        fixed_options = set()
+        for _ in range(len(desired_options) + 1):
+            options_to_fix = self.wrong_options(browser, desired_options)
+            if not options_to_fix:
+                self.castom_logger.info(f"""ОПЦИИ В ПОРЯДКЕ, ПОПРАВЛЕНО: {', '.join(fixed_options) or 'нет'}""")
+                return
+
+            key, option_text, log_name, _ = options_to_fix[0]
+            select_element = browser.find_element(By.ID, self.dict_html_elements[key])
+            select_element.find_element(By.XPATH, f"""./option[text()="{option_text}"]""").click()
+            # Каждый список делает постбэк, ждем перезагрузки страницы перед следующей правкой
+            try:
+                WebDriverWait(browser, 10).until(EC.staleness_of(select_element))
+            except TimeoutException:
+                self.castom_logger.info(f'{log_name} БЕЗ ПЕРЕЗАГРУЗКИ СТРАНИЦЫ')
+            fixed_options.add(log_name)
+            self.castom_logger.info(f'ПОПРАВЛЯЕМ {log_name}')
+        else:
+            # Правка на последнем проходе еще не проверена, проверяем итог
+            options_to_fix = self.wrong_options(browser, desired_options)
+            if options_to_fix:
+                # Скачивать с неверными опциями нельзя: файл будет не с той валютой, величиной или кластером
+                wrong_text = ', '.join(f'{log_name}={value}' for _, _, log_name, value in options_to_fix)
+                self.castom_logger.info(f"""ОПЦИИ НЕ ВЫСТАВЛЕНЫ: {wrong_text}""")
+                raise TimeoutException(f"""Опции не выставлены: {wrong_text}""")
+            self.castom_logger.info(f"""ОПЦИИ В ПОРЯДКЕ, ПОПРАВЛЕНО: {', '.join(fixed_options)}""")
 
     def processing_log_out_exception(self, browser: webdriver, type_flow: str, reporter_name: str):
 
@@ -459,7 +532,7 @@ class ITC_parser:
                 self.castom_logger.info('ЗАКРЫЛИ НОВОСТНОЕ ОКНО')
             except (TimeoutException, StaleElementReferenceException) as e:
                 if isinstance(e, StaleElementReferenceException):
-                    self.bot.send_message(self.chat_id_user, 'ОШБИКА С НОВОСТНЫМ ОКНОМ')
+                    self.notify.send_message(self.chat_id_user, 'ОШБИКА С НОВОСТНЫМ ОКНОМ', key='news_window')
                     time.sleep(60)
                 else:
                     self.castom_logger.info('НОВОСТНОЕ ОКНО  ОТСУТСТВУЕТ')
@@ -479,21 +552,138 @@ class ITC_parser:
             WebDriverWait(browser, 7).until(EC.presence_of_element_located((By.CLASS_NAME, 'div_captchaImg')))
             while True:
                 if self.check_captcha(browser, type_flow, reporter_name):
-                    self.bot.send_message(self.chat_id_user, f"""✅ Капча для <b>{reporter_name} {type_flow}</b> успешно пройдена""",
-                                          parse_mode='html')
+                    self.notify.send_message(self.chat_id_user, f"""✅ Капча для <b>{reporter_name} {type_flow}</b> успешно пройдена""",
+                                             parse_mode='html')
                     break
                 else:
-                    self.bot.send_message(self.chat_id_user,
-                                          f"""❌ Капча для <b>{reporter_name} {type_flow} не пройдена</b>. Введите ее повторно после получения обновленной картинки""",
-                                          parse_mode='html')
+                    self.notify.send_message(self.chat_id_user,
+                                             f"""❌ Капча для <b>{reporter_name} {type_flow} не пройдена</b>. Введите ее повторно после получения обновленной картинки""",
+                                             parse_mode='html')
+            if self.session_store is not None:
+                self.session_store.save_cookies(browser, flag_new_session=True)
         except TimeoutException:
             rez_click_button = self.click_button_yearly_time_series(browser, type_flow, reporter_name)
             self.castom_logger.info(f'{"ОБРАБОТКА ОШИБКИ ЧЕРЕЗ yearly_time_series" if rez_click_button else "ТОЛЬКО ЛОГИН"}')
 
-    def downloading_trade_value(self, browser: webdriver, type_flow: str, reporter_name: str, full_path_download: str,
-                                flag_insert_user: typing.Optional[bool] = False):
+    def job_url(self, reporter_name: str, type_flow: str, measure_type: str, product_cluster_level_text: str,
+                partner: typing.Optional[str] = None) -> str:
         """
-        Скачиваем данные для Value
+        Ссылка, по которой страница сразу открывается с нужными репортером, партнером и опциями.
+        Коды репортера и партнера берутся из каталога (value опций выпадающих списков)
+
+        :param reporter_name: имя репортера
+
+        :param type_flow: направление торговли
+
+        :param measure_type: 'Values' или 'Quantities'
+
+        :param product_cluster_level_text: на каком знаке выбираем продукты (или тарифной линии)
+
+        :param partner: имя партнера (опционально)
+
+        :return: ссылка на страницу или url_trade_map, если сборка ссылок не настроена или код репортера неизвестен
+        """
+        if self.url_builder is None:
+            return self.url_trade_map
+        reporter_code = dict(self.partner_catalogue.get(self.partner_catalogue.reporters_key) or []).get(reporter_name)
+        if reporter_code is None:
+            return self.url_trade_map
+        partner_code = dict(self.partner_catalogue.get(reporter_name) or []).get(partner) if partner else None
+        return self.url_builder.build(reporter_code, partner_code, type_flow, measure_type, product_cluster_level_text)
+
+    def check_job_url(self, browser: webdriver, url: str, reporter_name: str, type_flow: str, measure_type: str,
+                      product_cluster_level_text: str) -> str:
+        """
+        Сверяет выбранные на странице опции с теми, что задавала ссылка job_url. Позиции полей nvpm подобраны
+        по ссылкам сайта, поэтому если сайт выбрал не то, сборка ссылок отключается до конца сессии
+        и дальше опции выставляются выпадающими списками (select_reporter и option_check)
+
+        :param browser: экземпляр класса webdriver с открытой по url страницей
+
+        :param url: ссылка, по которой открыта страница
+
+        :param reporter_name: имя репортера
+
+        :param type_flow: направление торговли
+
+        :param measure_type: 'Values' или 'Quantities'
+
+        :param product_cluster_level_text: на каком знаке выбираем продукты (или тарифной линии)
+
+        :return: ссылка на страницу задачи для восстановления после ошибки (url_trade_map, если сборка отключена)
+        """
+        if self.url_builder is None or url == self.url_trade_map:
+            return url
+        reporter_code = dict(self.partner_catalogue.get(self.partner_catalogue.reporters_key) or []).get(reporter_name)
+        # Ссылка задает value опции репортера, остальные опции сверяются так же, как в option_check
+        url_keys = {self.nvpm_select_keys[option] for option in self.url_builder.positions}
+        desired_options = [('country_reporter', reporter_code, True, reporter_name, 'Reporter')] + \
+            [option for option in self.desired_options(type_flow, product_cluster_level_text, measure_type, reporter_name)
+             if option[0] in url_keys and option[0] != 'country_reporter']
+        wrong_url_options = self.wrong_options(browser, desired_options)
+        if wrong_url_options and wrong_url_options[0][0] == 'country_reporter' and wrong_url_options[0][3] is None:
+            self.castom_logger.info('ССЫЛКА nvpm НЕ ПРОВЕРЕНА: НА СТРАНИЦЕ НЕТ СПИСКА РЕПОРТЕРОВ')
+            return url
+        if wrong_url_options:
+            wrong_text = ', '.join(f'{log_name}={value}' for _, _, log_name, value in wrong_url_options)
+            self.castom_logger.info(f"""ССЫЛКА nvpm НЕ ВЫСТАВИЛА ОПЦИИ: {wrong_text}. ДАЛЬШЕ ВЫПАДАЮЩИЕ СПИСКИ""")
+            self.url_builder = None
+            return self.url_trade_map
+        self.castom_logger.info('ССЫЛКА nvpm ВЫСТАВИЛА ОПЦИИ')
+        return url
+
+    def select_reporter(self, browser: webdriver, type_flow: str, reporter_name: str, url: str):
+        """
+        Выбирает репортера, если страница открылась не на нем. При открытии по job_url репортер уже выбран
+        и постбэк не нужен. Заодно в каталог сохраняются коды репортеров для следующих ссылок
+
+        :param browser: экземпляр класса webdriver
+
+        :param type_flow: направление торговли
+
+        :param reporter_name: имя репортера
+
+        :param url: ссылка на страницу задачи для восстановления после ошибки
+
+        :return:
+        """
+        if self.partner_catalogue.get(self.partner_catalogue.reporters_key) is None:
+            reporters = self.get_select_options(browser, 'country_reporter')
+            if reporters:
+                self.partner_catalogue.save(self.partner_catalogue.reporters_key, reporters)
+
+        selected_reporter = browser.execute_script(
+            """var element = document.getElementById(arguments[0]);
+               return element && element.selectedIndex >= 0 ? element.options[element.selectedIndex].text.trim() : null;""",
+            self.dict_html_elements['country_reporter'])
+        if selected_reporter == reporter_name:
+            self.castom_logger.info(f"""РЕПОРТЕР {reporter_name} УЖЕ ВЫБРАН""")
+            return
+
+        try:
+            # Выбираем нужного репортера
+            country_reporter = browser.find_element(
+                By.XPATH,
+                f"""//select[@id='{self.dict_html_elements['country_reporter']}']/option[text()="{reporter_name}"]""")
+            country_reporter.click()
+            self.castom_logger.info(f"""РЕПОРТЕР {reporter_name}""")
+        except no_element as e:
+            self.castom_logger.info(f"""ОШИБКА ПРИ ВЫБОРЕ РЕПОРТЕРА {reporter_name} {e}""")
+            browser.get(url)
+            self.processing_log_out_exception(browser, type_flow, reporter_name)
+            # Выбираем нужного репортера
+            country_reporter = browser.find_element(
+                By.XPATH,
+                f"""//select[@id='{self.dict_html_elements['country_reporter']}']/option[text()="{reporter_name}"]""")
+            country_reporter.click()
+            self.castom_logger.info(f"""РЕПОРТЕР {reporter_name}""")
+
+    def open_trade_map(self, browser: webdriver, type_flow: str, reporter_name: str, measure_text: str,
+                       flag_insert_user: typing.Optional[bool] = False,
+                       flag_news_window: typing.Optional[bool] = True, url: typing.Optional[str] = None):
+        """
+        Открывает страницу с данными. Логин и капча проходятся только один раз за сессию браузера,
+        при повторных вызовах страница просто перезагружается
 
         :param browser: экземпляр класса webdriver
 
@@ -501,22 +691,26 @@ class ITC_parser:
 
         :param reporter_name: имя репортера
 
-        :param full_path_download: полный путь, куда будет скачиваться файл
+        :param measure_text: название скачиваемой величины для уведомлений
 
         :param flag_insert_user: флаг отвчающий, будет пользователь запускающий скрипт записан в базу или нет
-                                 (нужно при первом запуске скрипта пользователем)
 
-        :return:
-        """
+        :param flag_news_window: проверять наличие новостного окна или нет
 
-        reporter_name_for_check = reporter_name.replace(',', ' ').replace(' ', '_')
-        # Меняем в зависимости от нужной длины кода
-        product_cluster_level_text = 'Product cluster at 6 digits'
+        :param url: ссылка на страницу задачи (job_url), по умолчанию url_trade_map
 
-        browser.get(self.url_trade_map)
+        :return:
+        """
+        browser.get(url or self.url_trade_map)
+        if self.browser_session is not None and self.browser_session.flag_authorized:
+            self.castom_logger.info('СЕССИЯ УЖЕ АВТОРИЗОВАНА')
+            return
+        if self.restore_session(browser, url or self.url_trade_map):
+            self.browser_session.flag_authorized = True
+            return
 
         # Если появляется новостное окно
-        while True:
+        while flag_news_window:
             try:
                 WebDriverWait(browser, 7).until(EC.element_to_be_clickable((By.ID,
                                                                             'ctl00_MenuControl_CheckBox_DoNotShowAgain'))).click()
@@ -533,119 +727,545 @@ class ITC_parser:
             self.castom_logger.info(f'АВТОРИЗАЦИЯ БЕЗ ВВОДА Л.П. {e}')
         while True:
             if self.check_captcha(browser, type_flow):
-                self.bot.send_message(self.chat_id_user, f'✅ Капча для <b>{reporter_name} Values {type_flow}</b> успешно пройдена',
-                                      parse_mode='html')
+                self.notify.send_message(self.chat_id_user, f"""✅ Капча для <b>{reporter_name} {measure_text} {type_flow}</b> успешно пройдена""",
+                                         parse_mode='html')
                 break
             else:
-                self.bot.send_message(self.chat_id_user,
-                                      f'❌ Капча для <b>{reporter_name} Values {type_flow}</b> не пройдена. Введите ее повторно после получения обновленной картинки',
-                                      parse_mode='html')
+                self.notify.send_message(self.chat_id_user,
+                                         f"""❌ Капча для <b>{reporter_name} {measure_text} {type_flow}</b> не пройдена. Введите ее повторно после получения обновленной картинки""",
+                                         parse_mode='html')
+        if self.browser_session is not None:
+            self.browser_session.flag_authorized = True
+        if self.session_store is not None:
+            self.session_store.save_cookies(browser, flag_new_session=True)
+
+    def is_logged_in(self, browser: webdriver) -> bool:
+        """
+        Проверяет, что сервер считает браузер авторизованным: в шапке указана учетная запись и нет капчи
+
+        :param browser: экземпляр класса webdriver с открытой страницей сайта
+
+        :return: True если сессия авторизована
+        """
         try:
-            # Выбираем нужного репортера
-            country_reporter = browser.find_element(
-                By.XPATH,
-                f"""//select[@id='{self.dict_html_elements['country_reporter']}']/option[text()="{reporter_name}"]""")
-            country_reporter.click()
-            self.castom_logger.info(f"""РЕПОРТЕР {reporter_name}""")
-        except no_element as e:
-            self.castom_logger.info(f"""ОШИБКА ПРИ ВЫБОРЕ РЕПОРТЕРА {reporter_name} {e}""")
-            browser.get(self.url_trade_map)
-            self.processing_log_out_exception(browser, type_flow, reporter_name)
-            # Выбираем нужного репортера
-            country_reporter = browser.find_element(
-                By.XPATH,
-                f"""//select[@id='{self.dict_html_elements['country_reporter']}']/option[text()="{reporter_name}"]""")
-            country_reporter.click()
-            self.castom_logger.info(f"""РЕПОРТЕР {reporter_name}""")
+            label_login = WebDriverWait(browser, 7).until(
+                EC.presence_of_element_located((By.ID, self.dict_html_elements['label_login'])))
+        except TimeoutException:
+            return False
+        if browser.find_elements(By.CLASS_NAME, 'div_captchaImg'):
+            return False
+        label_text = label_login.text.strip().lower()
+        return bool(label_text) and (self.dict_html_elements['mail_user'] or '').lower() in label_text
+
+    def restore_session(self, browser: webdriver, url: str) -> bool:
+        """
+        Пробует сохраненную сессию (профиль Chrome и куки) вместо логина и капчи
+
+        :param browser: экземпляр класса webdriver
+
+        :param url: страница, которую нужно открыть
+
+        :return: True если сервер принял сохраненную сессию
+        """
+        if self.session_store is None or self.browser_session is None:
+            return False
+        if self.session_store.restore_cookies(browser):
+            browser.get(url)
+        flag_hit = self.is_logged_in(browser)
+        self.session_store.record_reuse(flag_hit)
+        if flag_hit:
+            # Сервер мог продлить куки, сохраняем свежие
+            self.session_store.save_cookies(browser)
+        return flag_hit
+
+    def log_page_stats(self, partner: str):
+        """
+        Пишет в лог сетевую статистику страниц партнера (только в облегченном режиме)
+
+        :param partner: партнер, по которому загружались страницы
+
+        :return:
+        """
+        if self.browser_session is None:
+            return
+        stats = self.browser_session.page_stats()
+        if stats is not None:
+            self.castom_logger.info(f"""СЕТЬ ПО {partner}: ЗАПРОСОВ {stats['requests']}, """
+                                    f"""ПОЛУЧЕНО {stats['bytes'] / 1024:.1f} КБ, """
+                                    f"""СЭКОНОМЛЕНО ЗАПРОСОВ {stats['saved_requests']}, """
+                                    f"""~{stats['saved_bytes'] / 1024:.1f} КБ""")
+
+    def wait_download(self, full_path_download: str, file_name: str, expected: typing.Optional[dict] = None,
+                      baseline: typing.Optional[dict] = None) -> bool:
+        """
+        Ждет окончания загрузки файла по событиям в папке загрузки, проверенный файл добавляется в индекс папки
+
+        :param full_path_download: полный путь, куда скачивается файл
+
+        :param file_name: название ожидаемого файла
+
+        :param expected: что запрашивали (measure_type, type_flow, product_cluster_level_text), см. accept_download
+
+        :param baseline: снимок промежуточной папки до клика по кнопке загрузки
+
+        :return: True если файл полностью скачан, False если загрузка зависла или скачан не тот файл
+        """
+        staging_dir = self.staging_dir(full_path_download)
+        if self.download_watcher(staging_dir).wait_for(file_name, baseline=baseline):
+            return self.accept_download(full_path_download, file_name, expected, staging_dir)
+        return False
+
+    def accept_download(self, full_path_download: str, file_name: str, expected: typing.Optional[dict],
+                        source_dir: typing.Optional[str] = None) -> bool:
+        """
+        Удаляет копии файла "(1)" и сверяет заголовок скачанного файла с запросом.
+        Подходящий файл переносится из промежуточной папки в папку задачи и добавляется в индекс,
+        неподходящий удаляется, чтобы партнер скачался заново
+
+        :param full_path_download: полный путь папки задачи
+
+        :param file_name: название скачанного файла
+
+        :param expected: словарь с ключами measure_type, type_flow, product_cluster_level_text
+                         (None - без проверки заголовка)
+
+        :param source_dir: промежуточная папка, где лежит файл (None - файл уже в папке задачи)
+
+        :return: True если файл принят
+        """
+        download_index = self.download_index(full_path_download)
+        # Копии от прежних запусков без промежуточной папки
+        for duplicate in self.file_check.duplicates(full_path_download, file_name):
+            self.castom_logger.info(f"""УДАЛЯЕМ ДУБЛИКАТ {os.path.basename(duplicate)}""")
+            download_index.remove(os.path.basename(duplicate))
+        full_path_file = os.path.join(source_dir or full_path_download, file_name)
+        if expected is not None:
+            error = self.file_check.check(full_path_file, **expected)
+            if error is not None:
+                self.castom_logger.info(f"""ФАЙЛ {file_name} НЕ СООТВЕТСТВУЕТ ЗАПРОСУ: {error}, СКАЧИВАЕМ ЗАНОВО""")
+                if source_dir is None:
+                    download_index.remove(file_name)
+                else:
+                    os.remove(full_path_file)
+                return False
+        if source_dir is not None:
+            os.replace(full_path_file, os.path.join(full_path_download, file_name))
+        download_index.add(file_name)
+        return True
+
+    def staging_dir(self, full_path_download: str) -> str:
+        """
+        :param full_path_download: полный путь папки задачи
+
+        :return: промежуточная папка загрузки задачи (создается при первом обращении)
+        """
+        staging_dir = os.path.join(full_path_download, self.staging_folder_name)
+        os.makedirs(staging_dir, exist_ok=True)
+        return staging_dir
+
+    def download_watcher(self, full_path_download: str) -> Download_watcher:
+        """
+        :param full_path_download: полный путь папки, куда пишет Chrome
+
+        :return: наблюдатель за папкой (создается при первом обращении)
+        """
+        if full_path_download not in self.download_watchers:
+            self.download_watchers[full_path_download] = Download_watcher(full_path_download, self.castom_logger)
+        return self.download_watchers[full_path_download]
+
+    def click_download(self, browser: webdriver, full_path_download: str, file_name: str, partner: str,
+                       expected: dict, on_complete: typing.Optional[typing.Callable[[], None]] = None) -> bool:
+        """
+        Нажимает кнопку выгрузки txt. Chrome пишет файл в промежуточную папку задачи (задается через DevTools
+        перед каждым кликом), в папку задачи файл переносится после проверки.
+        При max_pending_downloads = 1 ждет окончания загрузки,
+        иначе ждет только ее начала и проверяет окончание в фоне (collect_downloads)
+
+        :param browser: экземпляр класса webdriver со страницей партнера
+
+        :param full_path_download: полный путь папки задачи
+
+        :param file_name: название ожидаемого файла
+
+        :param partner: партнер, который вернется в очередь при неудачной загрузке
+
+        :param expected: что запрашивали (measure_type, type_flow, product_cluster_level_text),
+                         скачанный файл сверяется с этим по заголовку
+
+        :param on_complete: что сделать после окончания загрузки (например, записать партнера в state_store)
+
+        :return: False если загрузку нужно повторить сразу
+        """
+        staging_dir = self.staging_dir(full_path_download)
+        self.browser_session.set_download_dir(staging_dir)
+        # Остатки прежней попытки с тем же именем заставили бы Chrome назвать файл "(1)"
+        for stale_name in (file_name, file_name + CHROME_TEMP_SUFFIX):
+            if os.path.isfile(os.path.join(staging_dir, stale_name)):
+                os.remove(os.path.join(staging_dir, stale_name))
+        watcher = self.download_watcher(staging_dir)
+        # По снимку до клика загрузке сопоставляются ее временные файлы 'Unconfirmed NNN.crdownload'
+        baseline = watcher.snapshot()
+        WebDriverWait(browser, 15).until(EC.element_to_be_clickable(
+            (By.ID, self.dict_html_elements['download_button_txt']))).click()
+
+        if self.max_pending_downloads == 1:
+            if not self.wait_download(full_path_download, file_name, expected, baseline):
+                return False
+            if on_complete is not None:
+                on_complete()
+            return True
+
+        # Страницу можно менять только когда Chrome начал загрузку, иначе постбэк ее отменит
+        if not watcher.wait_started(file_name, baseline):
+            return False
+        watcher.track(file_name, baseline=baseline)
+        self.pending_downloads.append({'folder': full_path_download, 'staging_dir': staging_dir,
+                                       'file_name': file_name, 'partner': partner, 'expected': expected,
+                                       'on_complete': on_complete})
+        self.collect_downloads(self.max_pending_downloads - 1)
+        return True
+
+    def collect_downloads(self, max_pending: int):
+        """
+        Обрабатывает закончившиеся загрузки и ждет, пока незавершенных останется не больше max_pending
+
+        :param max_pending: сколько загрузок может остаться незавершенными
+
+        :return:
+        """
+        while True:
+            for staging_dir in {download['staging_dir'] for download in self.pending_downloads}:
+                completed, failed = self.download_watcher(staging_dir).poll()
+                for download in [download for download in self.pending_downloads
+                                 if download['staging_dir'] == staging_dir]:
+                    if download['file_name'] in completed and self.accept_download(
+                            download['folder'], download['file_name'], download['expected'], staging_dir):
+                        if download['on_complete'] is not None:
+                            download['on_complete']()
+                    elif download['file_name'] in completed or download['file_name'] in failed:
+                        if download['partner'] not in self.failed_partners:
+                            self.failed_partners.append(download['partner'])
+                    else:
+                        continue
+                    self.pending_downloads.remove(download)
+            if len(self.pending_downloads) <= max_pending:
+                return
+            self.download_watcher(self.pending_downloads[0]['staging_dir']).sleep_until_event(0.5)
+
+    def iter_partners(self, partner_list: list) -> typing.Iterator[str]:
+        """
+        Очередь партнеров. Партнеры, чья загрузка не удалась в фоне, возвращаются в конец очереди
+        (не больше max_download_attempts раз). Перед окончанием очереди дожидается всех загрузок
+
+        :param partner_list: список партнеров
+
+        :return: партнеры по очереди
+        """
+        partner_queue = collections.deque(partner_list)
+        attempts = collections.Counter()
+        while True:
+            if not partner_queue:
+                self.collect_downloads(0)
+            for partner in self.failed_partners:
+                if attempts[partner] < self.max_download_attempts:
+                    self.castom_logger.info(f"""ПАРТНЕР {partner} ВОЗВРАЩЕН В ОЧЕРЕДЬ""")
+                    partner_queue.append(partner)
+                else:
+                    self.castom_logger.info(f"""ПАРТНЕР {partner} НЕ СКАЧАН ЗА {attempts[partner]} ПОПЫТКИ""")
+            self.failed_partners = []
+            if not partner_queue:
+                return
+            partner = partner_queue.popleft()
+            attempts[partner] += 1
+            yield partner
+
+    def download_index(self, full_path_download: str) -> Download_index:
+        """
+        :param full_path_download: полный путь папки загрузки
+
+        :return: индекс скачанных файлов папки (строится при первом обращении)
+        """
+        if full_path_download not in self.download_indexes:
+            self.download_indexes[full_path_download] = Download_index(full_path_download)
+        return self.download_indexes[full_path_download]
+
+    def _partner_page_has_trade(self, partner: str, partner_form) -> bool:
+        """
+        Аналог check_zero_country для страницы, полученной по HTTP
+
+        :param partner: название партнера
+
+        :param partner_form: состояние формы страницы партнера из ITC_http_exporter
+
+        :return: True если по партнеру есть данные
+        """
+        return self.grid_parser.check_zero_country(self.grid_parser.parse(partner_form.html), partner) > 0
+
+    def downloading_http(self, browser: webdriver, type_flow: str, reporter_name: str, full_path_download: str,
+                         partner_list: list, measure_type: str, product_cluster_level_text: str) -> list:
+        """
+        Скачивает файлы партнеров напрямую по HTTP с куками и состоянием формы браузера
+
+        :param browser: экземпляр класса webdriver с выбранным репортером
+
+        :param type_flow: направление торговли (импорт или экспорт)
+
+        :param reporter_name: имя репортера
+
+        :param full_path_download: полный путь, куда будут скачиваться файлы
+
+        :param partner_list: список партнеров
+
+        :param measure_type: 'Values' или 'Quantities'
+
+        :param product_cluster_level_text: на каком знаке выбираем продукты (или тарифной линии)
+
+        :return: список партнеров, которые не удалось скачать по HTTP и нужно скачать через браузер
+        """
+        try:
+            # Опции страницы выставляем браузером один раз, дальше форма переносится в HTTP сессию
+            self.option_check(browser, type_flow, product_cluster_level_text, measure_type, reporter_name)
+        except (no_element, TimeoutException, StaleElementReferenceException,
+                ElementClickInterceptedException) as e:
+            self.castom_logger.info(f"""HTTP ВЫГРУЗКА НЕДОСТУПНА {e}""")
+            return partner_list
+
+        reporter_name_for_check = reporter_name.replace(',', ' ').replace(' ', '_')
+        # Проверка нулевых партнеров нужна только для 6 знаков Values, как в downloading_trade_value
+        flag_zero_check = measure_type == 'Values' and product_cluster_level_text == 'Product cluster at 6 digits'
+        download_index = self.download_index(full_path_download)
+        expected = {'measure_type': measure_type, 'type_flow': type_flow,
+                    'product_cluster_level_text': product_cluster_level_text}
+        partner_files = []
+        for partner in partner_list:
+            file_name = self.patern_file.format(reporter_name_for_check, partner.replace(',', ' ').replace(' ', '_'))
+            if file_name in download_index:
+                self.castom_logger.info(f"""УЖЕ ЗАГРУЖЕН {file_name} !""")
+                # Запись о партнере могла не попасть в state_store до падения процесса
+                if flag_zero_check:
+                    self.state_store.add_partner(reporter_name, type_flow, partner)
+            else:
+                partner_files.append((partner, os.path.join(full_path_download, file_name)))
+
+        exporter = ITC_http_exporter(self.dict_html_elements, self.castom_logger, self.proxy,
+                                     max_workers=self.http_max_workers)
+        try:
+            exporter.load_browser_state(browser)
+            # Таблица страницы партнера приходит в ответе постбэка, нули проверяются до выгрузки
+            results = exporter.export_partners(partner_files,
+                                               self._partner_page_has_trade if flag_zero_check else None)
+        finally:
+            exporter.close()
+
+        partner_list_browser = []
+        for partner, full_path_file in partner_files:
+            if results[partner] == 'skipped':
+                self.castom_logger.info(f"""ДАННЫХ НЕТ ПО {partner} """)
+                self.state_store.remove_partner(reporter_name, type_flow, partner)
+            elif results[partner] != 'downloaded':
+                partner_list_browser.append(partner)
+            elif not self.accept_download(full_path_download, os.path.basename(full_path_file), expected):
+                partner_list_browser.append(partner)
+            else:
+                self.castom_logger.info(f"""ФАЙЛ {os.path.basename(full_path_file)} ЗАГРУЖЕН ПО HTTP""")
+                if flag_zero_check:
+                    self.state_store.add_partner(reporter_name, type_flow, partner)
+        self.castom_logger.info(f"""HTTP ВЫГРУЗКА: {len(partner_files) - len(partner_list_browser)} ИЗ {len(partner_files)}, """
+                                f"""ЧЕРЕЗ БРАУЗЕР {len(partner_list_browser)}""")
+        return partner_list_browser
+
+    def download_partner_quantities(self, browser: webdriver, type_flow: str, reporter_name: str, partner: str,
+                                    file_name: str, full_path_download: str, full_path_download_qty: str,
+                                    product_cluster_level_text: str) -> bool:
+        """
+        Скачивает Quantities партнера со страницы, открытой для Values: меняется только ts_indicator,
+        файл скачивается в папку Quantities
+
+        :param browser: экземпляр класса webdriver с выбранным партнером
+
+        :param type_flow: направление торговли
+
+        :param reporter_name: имя репортера
+
+        :param partner: имя партнера
+
+        :param file_name: название файла (совпадает для Values и Quantities)
+
+        :param full_path_download: папка загрузки Values
+
+        :param full_path_download_qty: папка загрузки Quantities
+
+        :param product_cluster_level_text: на каком знаке выбираем продукты
+
+        :return: True если файл скачан или уже был, False если загрузка зависла и партнера нужно повторить
+        """
+        if file_name in self.download_index(full_path_download_qty):
+            self.castom_logger.info(f"""УЖЕ ЗАГРУЖЕН Quantities {file_name} !""")
+            return True
+        self.option_check(browser, type_flow, product_cluster_level_text, 'Quantities', reporter_name)
+        self.castom_logger.info(f"""СКАЧИВАЕМ ФАЙЛ Quantities {file_name}""")
+        return self.click_download(browser, full_path_download_qty, file_name, partner,
+                                   {'measure_type': 'Quantities', 'type_flow': type_flow,
+                                    'product_cluster_level_text': product_cluster_level_text})
+
+    def download_partner_values(self, browser: webdriver, type_flow: str, reporter_name: str, partner: str,
+                                full_path_download: str, full_path_download_qty: typing.Optional[str],
+                                product_cluster_level_text: str) -> bool:
+        """
+        Скачивает Values (и при необходимости Quantities) уже выбранного партнера для одного направления торговли
+
+        :param browser: экземпляр класса webdriver с выбранным партнером
+
+        :param type_flow: направление торговли
+
+        :param reporter_name: имя репортера
+
+        :param partner: имя партнера
+
+        :param full_path_download: папка загрузки Values
+
+        :param full_path_download_qty: папка загрузки Quantities или None, если Quantities скачиваются отдельно
+
+        :param product_cluster_level_text: на каком знаке выбираем продукты
+
+        :return: True если по направлению все готово, False если загрузка зависла и партнера нужно повторить
+        """
+        # Для второго направления меняется только trade_type, остальные опции уже выставлены
+        self.option_check(browser, type_flow, product_cluster_level_text, 'Values', reporter_name)
+
+        reporter_name_for_check = reporter_name.replace(',', ' ').replace(' ', '_')
+        partner_text_for_check = partner.replace(',', ' ').replace(' ', '_')
+        file_name = self.patern_file.format(reporter_name_for_check, partner_text_for_check)
+        check_zero_country = self.grid_parser.check_zero_country(self.grid_parser.read(browser), partner)
+        check_downloaad_file = file_name in self.download_index(full_path_download)
+        if check_zero_country == 0:
+            self.castom_logger.info(f"""ДАННЫХ НЕТ ПО {partner} {type_flow}""")
+            # Удаляем не подходящую страну(если делаем парсинг повторно)
+            self.state_store.remove_partner(reporter_name, type_flow, partner)
+            return True
+        if not check_downloaad_file:
+            self.castom_logger.info(f"""СКАЧИВАЕМ ФАЙЛ {file_name}""")
+            # Проверяем скачен ли файл, при зависшей загрузке повторяем партнера
+            if not self.click_download(browser, full_path_download, file_name, partner,
+                                       {'measure_type': 'Values', 'type_flow': type_flow,
+                                        'product_cluster_level_text': product_cluster_level_text},
+                                       lambda: self.state_store.add_partner(reporter_name, type_flow, partner)):
+                return False
+        else:
+            self.castom_logger.info(f"""УЖЕ ЗАГРУЖЕН {file_name} !""")
+            # Запись о партнере могла не попасть в state_store до падения процесса
+            self.state_store.add_partner(reporter_name, type_flow, partner)
+
+        # Quantities с той же страницы партнера, Values при повторе уже будут в индексе
+        if full_path_download_qty is not None:
+            return self.download_partner_quantities(browser, type_flow, reporter_name, partner, file_name,
+                                                    full_path_download, full_path_download_qty,
+                                                    product_cluster_level_text)
+        return True
+
+    def downloading_trade_value(self, browser: webdriver, type_flow: str, reporter_name: str, full_path_download: str,
+                                flag_insert_user: typing.Optional[bool] = False,
+                                full_path_download_qty: typing.Optional[str] = None,
+                                extra_flows: typing.Optional[list] = None):
+        """
+        Скачиваем данные для Value
+
+        :param browser: экземпляр класса webdriver
+
+        :param type_flow: направление торговли (импорт или экспорт)
+
+        :param reporter_name: имя репортера
+
+        :param full_path_download: полный путь, куда будет скачиваться файл
+
+        :param flag_insert_user: флаг отвчающий, будет пользователь запускающий скрипт записан в базу или нет
+                                 (нужно при первом запуске скрипта пользователем)
+
+        :param full_path_download_qty: папка Quantities. Если передана, Quantities партнера с данными
+                                       скачиваются сразу после Values, без второго прохода по партнерам
+
+        :param extra_flows: другие направления торговли, которые скачиваются за тот же проход по партнерам,
+                            список словарей с ключами type_flow, full_path_download, full_path_download_qty
+
+        :return:
+        """
+        # Меняем в зависимости от нужной длины кода
+        product_cluster_level_text = 'Product cluster at 6 digits'
+        flow_jobs = [{'type_flow': type_flow, 'full_path_download': full_path_download,
+                      'full_path_download_qty': full_path_download_qty}] + (extra_flows or [])
+
+        # Страница открывается сразу с нужным репортером и опциями, option_check дальше только проверяет их
+        job_url = self.job_url(reporter_name, type_flow, 'Values', product_cluster_level_text)
+        self.open_trade_map(browser, type_flow, reporter_name, 'Values', flag_insert_user, url=job_url)
+        job_url = self.check_job_url(browser, job_url, reporter_name, type_flow, 'Values', product_cluster_level_text)
+        self.select_reporter(browser, type_flow, reporter_name, job_url)
 
         # Проверка на зеркальные данные и дальнейшая фильтрация этих годов при финальной сборке
-        year_mirror_data = browser.find_element(By.XPATH,
-                                                self.dict_html_elements['year_mirror_xpath']).find_elements(
-            By.TAG_NAME, 'th')[3:15]
-        value_mirror_data = browser.find_element(By.XPATH,
-                                                 self.dict_html_elements['value_mirror_xpath']).find_elements(
-            By.TAG_NAME, 'td')[3:15]
-
-        for year_mirror, value_mirror in zip(year_mirror_data, value_mirror_data):
-            if value_mirror.get_attribute('title') == 'Mirror data':
-                excluded_year = year_mirror.text.split(' in ')[1]
+        for excluded_year, flag_mirror in self.grid_parser.mirror_years(self.grid_parser.read(browser)):
+            if flag_mirror:
                 self.castom_logger.info(f"MIRROR DATA {excluded_year} году для {reporter_name}")
-                self._json_work_file('other', 'json_mirror_data.json', reporter_name, excluded_year)
+                self.state_store.add_mirror_year(reporter_name, excluded_year)
             else:
-                excluded_year = year_mirror.text.split(' in ')[1]
-                self._json_work_file('del_value', 'json_mirror_data.json', reporter_name,
-                                     excluded_year)
+                self.state_store.remove_mirror_year(reporter_name, excluded_year)
 
         parnter_in_bd, flag_partner = self.get_partner_save_point()
-        partner_list = [partner.text for partner in
-                        browser.find_element(By.ID, self.dict_html_elements['country_partner']).find_elements(
-                            By.TAG_NAME, 'option') if partner.text != 'All']
+        partner_list = self.get_partner_list(browser, reporter_name)
         if flag_partner:
             self.castom_logger.info(f"""НАЧИНАЕМ СПИСОК С {parnter_in_bd}""")
             partner_list = partner_list[partner_list.index(parnter_in_bd):]
             self.update_partner_flag()
 
-        for partner in partner_list:
+        if self.flag_http_export:
+            partner_list_browser = set()
+            for flow_job in flow_jobs:
+                partner_list_flow = self.downloading_http(browser, flow_job['type_flow'], reporter_name,
+                                                          flow_job['full_path_download'], partner_list, 'Values',
+                                                          product_cluster_level_text)
+                if flow_job['full_path_download_qty'] is not None:
+                    # Quantities по HTTP только для партнеров с данными, Values которых уже скачаны
+                    partners_with_trade = set(self.state_store.get_partners(reporter_name, flow_job['type_flow']))
+                    partner_list_flow += self.downloading_http(
+                        browser, flow_job['type_flow'], reporter_name, flow_job['full_path_download_qty'],
+                        [partner for partner in partner_list
+                         if partner in partners_with_trade and partner not in partner_list_flow],
+                        'Quantities', product_cluster_level_text)
+                partner_list_browser.update(partner_list_flow)
+            partner_list = [partner for partner in partner_list if partner in partner_list_browser]
+
+        for partner in self.iter_partners(partner_list):
             # Записываем текущего партнера в базу данных
             self.update_current_partner(partner)
+            # Направления, по которым партнер уже готов (при повторе партнера они пропускаются)
+            done_flows = set()
             while True:
+                current_flow = flow_jobs[0]['type_flow']
                 try:
                     browser.find_element(
                         By.XPATH,
                         f"""//select[@id='{self.dict_html_elements['country_partner']}']/option[text()="{partner}"]""").click()
                     self.castom_logger.info(f"""ПАРТНЕР {partner}. РЕПОРТЕРА {reporter_name}""")
-                    # measure_type - подставить в зависимости от типа измерение 'Values', 'Quantities'
-                    self.option_check(browser, type_flow, product_cluster_level_text, 'Values', reporter_name)
-
-                    partner_text_for_check = partner.replace(',', ' ').replace(' ', '_')
-                    file_name = self.patern_file.format(reporter_name_for_check, partner_text_for_check)
-                    upper_border = self.dict_html_elements['world_upper_border'] if partner == 'World' else \
-                        self.dict_html_elements['country_upper_border']
-
-                    check_zero_country = sum([int(i.text.replace(',', '')) for i in
-                                              browser.find_element(By.XPATH, self.dict_html_elements['zero_check']) \
-                                             .find_elements(By.TAG_NAME, 'td') \
-                                                  [
-                                              3:int(browser.find_element(By.ID, upper_border).get_attribute(
-                                                  'colspan')) + 3]
-                                              if i.text.replace(',', '').isdigit()])
-                    check_downloaad_file = os.path.isfile(os.path.join(full_path_download, file_name))
-                    if check_zero_country > 0 and not check_downloaad_file:
-                        self.castom_logger.info(f"""СКАЧИВАЕМ ФАЙЛ {file_name}""")
-                        WebDriverWait(browser, 15).until(EC.element_to_be_clickable(
-                            (By.ID, self.dict_html_elements['download_button_txt']))).click()
-
-                        # Проверяем скачен ли файл
-                        start_time = time.time()
-                        flag_file_download = False
-                        while time.time() - start_time < 180:
-                            if os.path.isfile(os.path.join(full_path_download, file_name)):
-                                self._json_work_file('other', f'{type_flow}_res.json',
-                                                     reporter_name, partner)
-                                self.castom_logger.info(f"""ФАЙЛ {file_name} ЗАГРУЖЕН!""")
-                                flag_file_download = True
-                                break
-                            else:
-                                self.castom_logger.info(f"""ОЖИДАЕМ ЗАГРУЗКУ {file_name}""")
-                                time.sleep(1)
-                        if flag_file_download:
-                            break
-                        else:
+                    flag_retry = False
+                    for flow_job in flow_jobs:
+                        if flow_job['type_flow'] in done_flows:
                             continue
-                    elif check_zero_country == 0:
-                        self.castom_logger.info(f"""ДАННЫХ НЕТ ПО {partner} """)
-                        # Удаляем не подходящую страну(если делаем парсинг повторно)
-                        self._json_work_file('del_value', f'{type_flow}_res.json',
-                                             reporter_name, partner)
-                        break
-                    elif os.path.isfile(os.path.join(full_path_download, file_name)):
-                        self.castom_logger.info(f"""УЖЕ ЗАГРУЖЕН {file_name} !""")
-                        break
+                        current_flow = flow_job['type_flow']
+                        if not self.download_partner_values(browser, current_flow, reporter_name, partner,
+                                                            flow_job['full_path_download'],
+                                                            flow_job['full_path_download_qty'],
+                                                            product_cluster_level_text):
+                            flag_retry = True
+                            break
+                        done_flows.add(current_flow)
+                    if flag_retry:
+                        continue
+                    break
                 except (no_element, TimeoutException, StaleElementReferenceException,
                         ElementClickInterceptedException) as e:
                     self.castom_logger.info(f"""ОШИБКА для {reporter_name} по {partner} {e}""")
-                    browser.get(self.url_trade_map)
-                    self.processing_log_out_exception(browser, type_flow, reporter_name)
+                    # Возвращаемся сразу на страницу текущего партнера
+                    browser.get(self.job_url(reporter_name, current_flow, 'Values', product_cluster_level_text, partner))
+                    self.processing_log_out_exception(browser, current_flow, reporter_name)
+            self.log_page_stats(partner)
 
     def downloading_quantities(self, browser: webdriver, type_flow: str, reporter_name: str, full_path_download: str,
                                partner_list: typing.Optional[list] = None,
@@ -673,58 +1293,28 @@ class ITC_parser:
         # Меняем в зависимости от нужной длины кода
         product_cluster_level_text = 'Product cluster at 6 digits'
 
-        browser.get(self.url_trade_map)
-
-        # Если появляется новостное окно
-        while True:
-            try:
-                WebDriverWait(browser, 7).until(EC.element_to_be_clickable((By.ID,
-                                                                            'ctl00_MenuControl_CheckBox_DoNotShowAgain'))).click()
-                WebDriverWait(browser, 7).until(EC.element_to_be_clickable((By.ID,
-                                                                            'ctl00_MenuControl_button1'))).click()
-                self.castom_logger.info('ЗАКРЫЛИ НОВОСТНОЕ ОКНО')
-            except TimeoutException:
-                self.castom_logger.info('НОВОСТНОЕ ОКНО  ОТСУТСТВУЕТ')
-                break
-
-        try:
-            self.login(browser, flag_insert_user)
-        except TimeoutException as e:
-            self.castom_logger.info(f'АВТОРИЗАЦИЯ БЕЗ ВВОДА Л.П. {e}')
-        while True:
-            if self.check_captcha(browser, type_flow):
-                self.bot.send_message(self.chat_id_user, f"""✅ Капча для <b>{reporter_name} Quantities {type_flow}</b> успешно пройдена""",
-                                      parse_mode='html')
-                break
-            else:
-                self.bot.send_message(self.chat_id_user,
-                                      f"""❌ Капча для <b>{reporter_name} Quantities {type_flow}</b> не пройдена. Введите ее повторно после получения обновленной картинки""",
-                                      parse_mode='html')
+        # Страница открывается сразу с нужным репортером и опциями, option_check дальше только проверяет их
+        job_url = self.job_url(reporter_name, type_flow, 'Quantities', product_cluster_level_text)
+        self.open_trade_map(browser, type_flow, reporter_name, 'Quantities', flag_insert_user, url=job_url)
+        job_url = self.check_job_url(browser, job_url, reporter_name, type_flow, 'Quantities', product_cluster_level_text)
 
-        try:
-            # Выбираем нужного репортера
-            country_reporter = browser.find_element(
-                By.XPATH,
-                f"""//select[@id='{self.dict_html_elements['country_reporter']}']/option[text()="{reporter_name}"]""")
-            country_reporter.click()
-            self.castom_logger.info(f"""РЕПОРТЕР {reporter_name}""")
-        except no_element as e:
-            self.castom_logger.info(f"""ОШИБКА ПРИ ВЫБОРЕ РЕПОРТЕРА {reporter_name} {e}""")
-            browser.get(self.url_trade_map)
-            self.processing_log_out_exception(browser, type_flow, reporter_name)
+        self.select_reporter(browser, type_flow, reporter_name, job_url)
 
         if partner_list:
             self.castom_logger.info(f"""ПОВТОРНАЯ ЗАГРУЗКА {partner_list}""")
         else:
             parnter_in_bd, flag_partner = self.get_partner_save_point()
-            partner_list = self._json_work_file('return_save_point', f'{type_flow}_res.json',
-                                                reporter_name)
+            partner_list = self.state_store.get_partners(reporter_name, type_flow)
             if flag_partner:
                 self.castom_logger.info(f"""НАЧИНАЕМ СПИСОК С {parnter_in_bd}""")
                 partner_list = partner_list[partner_list.index(parnter_in_bd):]
                 self.update_partner_flag()
 
-        for partner in partner_list:
+        if self.flag_http_export:
+            partner_list = self.downloading_http(browser, type_flow, reporter_name, full_path_download,
+                                                 partner_list, 'Quantities', product_cluster_level_text)
+
+        for partner in self.iter_partners(partner_list):
             # Записываем текущего партнера в базу данных
             self.update_current_partner(partner)
             while True:
@@ -739,35 +1329,26 @@ class ITC_parser:
                     partner_text_for_check = partner.replace(',', ' ').replace(' ', '_')
                     file_name = self.patern_file.format(reporter_name_for_check, partner_text_for_check)
 
-                    check_downloaad_file = os.path.isfile(os.path.join(full_path_download, file_name))
+                    check_downloaad_file = file_name in self.download_index(full_path_download)
                     if not check_downloaad_file:
                         self.castom_logger.info(f"""СКАЧИВАЕМ ФАЙЛ {file_name}""")
-                        WebDriverWait(browser, 15).until(EC.element_to_be_clickable(
-                            (By.ID, self.dict_html_elements['download_button_txt']))).click()
-
-                        # Проверяем скачен ли файл
-                        start_time = time.time()
-                        flag_file_download = False
-                        while time.time() - start_time < 180:
-                            if os.path.isfile(os.path.join(full_path_download, file_name)):
-                                self.castom_logger.info(f"""ФАЙЛ {file_name} ЗАГРУЖЕН!""")
-                                flag_file_download = True
-                                break
-                            else:
-                                self.castom_logger.info(f"""ОЖИДАЕМ ЗАГРУЗКУ {file_name}""")
-                                time.sleep(1)
-                        if flag_file_download:
+                        # Проверяем скачен ли файл, при зависшей загрузке повторяем партнера
+                        if self.click_download(browser, full_path_download, file_name, partner,
+                                               {'measure_type': 'Quantities', 'type_flow': type_flow,
+                                                'product_cluster_level_text': product_cluster_level_text}):
                             break
                         else:
                             continue
-                    elif os.path.isfile(os.path.join(full_path_download, file_name)):
+                    elif check_downloaad_file:
                         self.castom_logger.info(f"""УЖЕ ЗАГРУЖЕН {file_name} !""")
                         break
                 except (no_element, TimeoutException, StaleElementReferenceException,
                         ElementClickInterceptedException) as e:
                     self.castom_logger.info(f"""ОШИБКА для {reporter_name} по {partner} {e}""")
-                    browser.get(self.url_trade_map)
+                    # Возвращаемся сразу на страницу текущего партнера
+                    browser.get(self.job_url(reporter_name, type_flow, 'Quantities', product_cluster_level_text, partner))
                     self.processing_log_out_exception(browser, type_flow, reporter_name)
+            self.log_page_stats(partner)
 
     def downloading_tariff_line_value(self, browser: webdriver, type_flow: str, reporter_name: str,
                                       full_path_download: str,
@@ -794,45 +1375,26 @@ class ITC_parser:
         # Меняем в зависимости от нужной длины кода
         product_cluster_level_text = 'Products at the tariff line'
 
-        browser.get(self.url_trade_map)
-        try:
-            self.login(browser, flag_insert_user)
-        except TimeoutException as e:
-            self.castom_logger.info(f'АВТОРИЗАЦИЯ БЕЗ ВВОДА Л.П. {e}')
-        while True:
-            if self.check_captcha(browser, type_flow):
-                self.bot.send_message(self.chat_id_user, f"""✅ Капча для <b>{reporter_name} tariff line Values {type_flow}</b> успешно пройдена""",
-                                      parse_mode='html')
-                break
-            else:
-                self.bot.send_message(self.chat_id_user,
-                                      f"""❌ Капча для <b>{reporter_name} tariff line Values {type_flow}</b> не пройдена. Введите ее повторно после получения обновленной картинки""",
-                                      parse_mode='html')
+        # Страница открывается сразу с нужным репортером и опциями, option_check дальше только проверяет их
+        job_url = self.job_url(reporter_name, type_flow, 'Values', product_cluster_level_text)
+        self.open_trade_map(browser, type_flow, reporter_name, 'tariff line Values', flag_insert_user,
+                            flag_news_window=False, url=job_url)
+        job_url = self.check_job_url(browser, job_url, reporter_name, type_flow, 'Values', product_cluster_level_text)
 
-        try:
-            # Выбираем нужного репортера
-            country_reporter = browser.find_element(
-                By.XPATH,
-                f"""//select[@id='{self.dict_html_elements['country_reporter']}']/option[text()="{reporter_name}"]""")
-            country_reporter.click()
-            self.castom_logger.info(f"""РЕПОРТЕР {reporter_name}""")
-        except no_element as e:
-            self.castom_logger.info(f"""ОШИБКА ПРИ ВЫБОРЕ РЕПОРТЕРА {reporter_name} {e}""")
-            browser.get(self.url_trade_map)
-            self.processing_log_out_exception(browser, type_flow, reporter_name)
+        self.select_reporter(browser, type_flow, reporter_name, job_url)
 
         parnter_in_bd, flag_partner = self.get_partner_save_point()
-        # partner_list = self._json_work_file('return_save_point', f'{type_flow}_res.json',
-        #                                     reporter_name)
-        partner_list = [partner.text for partner in
-                        browser.find_element(By.ID, self.dict_html_elements['country_partner']).find_elements(
-                            By.TAG_NAME, 'option') if partner.text != 'All']
+        partner_list = self.get_partner_list(browser, reporter_name)
         if flag_partner:
             self.castom_logger.info(f"""НАЧИНАЕМ СПИСОК С {parnter_in_bd}""")
             partner_list = partner_list[partner_list.index(parnter_in_bd):]
             self.update_partner_flag()
 
-        for partner in partner_list:
+        if self.flag_http_export:
+            partner_list = self.downloading_http(browser, type_flow, reporter_name, full_path_download,
+                                                 partner_list, 'Values', product_cluster_level_text)
+
+        for partner in self.iter_partners(partner_list):
             # Записываем текущего партнера в базу данных
             self.update_current_partner(partner)
             while True:
@@ -847,35 +1409,26 @@ class ITC_parser:
                     partner_text_for_check = partner.replace(',', ' ').replace(' ', '_')
                     file_name = self.patern_file.format(reporter_name_for_check, partner_text_for_check)
 
-                    check_downloaad_file = os.path.isfile(os.path.join(full_path_download, file_name))
+                    check_downloaad_file = file_name in self.download_index(full_path_download)
                     if not check_downloaad_file:
                         self.castom_logger.info(f"""СКАЧИВАЕМ ФАЙЛ {file_name}""")
-                        WebDriverWait(browser, 15).until(EC.element_to_be_clickable(
-                            (By.ID, self.dict_html_elements['download_button_txt']))).click()
-
-                        # Проверяем скачен ли файл
-                        start_time = time.time()
-                        flag_file_download = False
-                        while time.time() - start_time < 180:
-                            if os.path.isfile(os.path.join(full_path_download, file_name)):
-                                self.castom_logger.info(f"""ФАЙЛ {file_name} ЗАГРУЖЕН!""")
-                                flag_file_download = True
-                                break
-                            else:
-                                self.castom_logger.info(f"""ОЖИДАЕМ ЗАГРУЗКУ {file_name}""")
-                                time.sleep(1)
-                        if flag_file_download:
+                        # Проверяем скачен ли файл, при зависшей загрузке повторяем партнера
+                        if self.click_download(browser, full_path_download, file_name, partner,
+                                               {'measure_type': 'Values', 'type_flow': type_flow,
+                                                'product_cluster_level_text': product_cluster_level_text}):
                             break
                         else:
                             continue
-                    elif os.path.isfile(os.path.join(full_path_download, file_name)):
+                    elif check_downloaad_file:
                         self.castom_logger.info(f"""УЖЕ ЗАГРУЖЕН {file_name} !""")
                         break
                 except (no_element, TimeoutException, StaleElementReferenceException,
                         ElementClickInterceptedException) as e:
                     self.castom_logger.info(f"""ОШИБКА для {reporter_name} по {partner} {e}""")
-                    browser.get(self.url_trade_map)
+                    # Возвращаемся сразу на страницу текущего партнера
+                    browser.get(self.job_url(reporter_name, type_flow, 'Values', product_cluster_level_text, partner))
                     self.processing_log_out_exception(browser, type_flow, reporter_name)
+            self.log_page_stats(partner)
 
     def main(self, reporter_name: str, type_flow: str, qty_or_value: str, partner_list: typing.Optional[list] = None,
              product_cluster: typing.Optional[str] = 'not_tariff', flag_insert_user: typing.Optional[bool] = False):
@@ -884,9 +1437,11 @@ class ITC_parser:
 
         :param reporter_name: репортер с которым сейчас работаем
 
-        :param type_flow: направление торговли (Exports Imports)
+        :param type_flow: направление торговли (Exports Imports или Imports_Exports - оба направления
+                          за один проход по партнерам)
 
-        :param qty_or_value: какая величина сейчас скачивается (Quantities Values)
+        :param qty_or_value: какая величина сейчас скачивается (Quantities, Values или Values_Quantities -
+                             обе величины за один проход по партнерам)
 
         :param partner_list: список партнеров, для исправления ошибок (опционально)
 
@@ -898,53 +1453,81 @@ class ITC_parser:
         :return:
         """
 
-        if product_cluster == 'not_tariff':
-            folder_download = f"""{reporter_name}_{type_flow}_{qty_or_value}"""
-        else:
-            folder_download = f"""{reporter_name}_{type_flow}_{qty_or_value}_Tariff"""
-        if not os.path.exists(folder_download):
-            os.mkdir(folder_download)
-        full_path_download = os.path.join(os.getcwd(), folder_download)
-
-        options = webdriver.ChromeOptions()
-
-        # Для отключения визуального интерфейса (окна браузера)
-        # options.add_argument("--headless=new")
-        # options.add_argument("--disable-gpu")
-
-        # Отключаем настройку, которая сообщает, что брауезр управляется автоматически
-        options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        # Отключает использование расширений автоматизации, чтобы скрыть, что брауезр управляется автоматически
-        options.add_experimental_option("useAutomationExtension", False)
-        # Для того чтобы сайт думал, что перед ним реальный браузер
-        options.add_argument("--disable-blink-features=AutomationControlled")
-        # Свой user-agent, чтобы сделать браузе похожий на свой
-        options.add_argument(
-            "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36")
-        options.add_argument('--proxy-server=%s' % self.proxy)
-
-        # Настройки для указания папки загрузки файлов и отключение окна запроса на сохранение логина и пароля
-        prefs = {
-            "download.default_directory": full_path_download,
-            "download.prompt_for_download": False,
-            "download.directory_upgrade": True,
-            "credentials_enable_service": False,
-            "profile.password_manager_enabled": False
-        }
-        options.add_experimental_option("prefs", prefs)
-
-        # ДЛЯ ПРОВЕРКИ, ЧТО работаем, через прокси
-        # with webdriver.Chrome(options=options) as browser:
-        #     browser.get('https://2ip.ru/')
-        #     time.sleep(35)
-
-        with webdriver.Chrome(options=options) as browser:
-            if qty_or_value == 'Values' and product_cluster == 'not_tariff':
-                self.downloading_trade_value(browser, type_flow, reporter_name, full_path_download,
-                                             flag_insert_user=flag_insert_user)
-            elif qty_or_value == 'Quantities' and product_cluster == 'not_tariff':
-                self.downloading_quantities(browser, type_flow, reporter_name, full_path_download,
-                                            partner_list=partner_list, flag_insert_user=flag_insert_user)
-            elif qty_or_value == 'Values' and product_cluster == 'tariff':
-                self.downloading_tariff_line_value(browser, type_flow, reporter_name, full_path_download,
-                                                   flag_insert_user=flag_insert_user)
+        # Imports_Exports - оба направления за один проход по партнерам (только Values на 6 знаках)
+        flow_list = ['Imports', 'Exports'] if type_flow == 'Imports_Exports' else [type_flow]
+        if len(flow_list) > 1 and (product_cluster != 'not_tariff' or qty_or_value == 'Quantities'):
+            # Quantities и тарифные линии идут по своим спискам партнеров, для них направления скачиваются по очереди
+            for flow in flow_list:
+                self.main(reporter_name, flow, qty_or_value, partner_list, product_cluster, flag_insert_user)
+            return
+
+        # Values_Quantities - обе величины за один проход по партнерам, каждая в свою папку
+        measure_list = ['Values', 'Quantities'] if qty_or_value == 'Values_Quantities' else [qty_or_value]
+        dict_full_path_download = {}
+        for flow in flow_list:
+            for measure in measure_list:
+                if product_cluster == 'not_tariff':
+                    folder_download = f"""{reporter_name}_{flow}_{measure}"""
+                else:
+                    folder_download = f"""{reporter_name}_{flow}_{measure}_Tariff"""
+                if not os.path.exists(folder_download):
+                    os.mkdir(folder_download)
+                full_path_download = os.path.join(os.getcwd(), folder_download)
+                dict_full_path_download[(flow, measure)] = full_path_download
+                # Папка читается один раз в начале задачи, дальше индекс обновляется по мере загрузок
+                self.download_indexes[full_path_download] = Download_index(full_path_download)
+        type_flow = flow_list[0]
+        full_path_download = dict_full_path_download[(type_flow, measure_list[0])]
+        full_path_download_qty = dict_full_path_download.get((type_flow, 'Quantities')) \
+            if qty_or_value == 'Values_Quantities' else None
+        extra_flows = [{'type_flow': flow,
+                        'full_path_download': dict_full_path_download[(flow, 'Values')],
+                        'full_path_download_qty': dict_full_path_download.get((flow, 'Quantities'))}
+                       for flow in flow_list[1:]]
+
+        if self.browser_session is None:
+            self.browser_session = ITC_browser_session(
+                self.proxy, self.castom_logger, self.flag_lean,
+                profile_dir=self.session_store.profile_dir if self.session_store is not None else None)
+        # Папка загрузки задается через DevTools перед каждой загрузкой, поэтому один браузер обслуживает любые задачи
+        browser = self.browser_session.start()
+
+        if qty_or_value in ('Values', 'Values_Quantities') and product_cluster == 'not_tariff':
+            self.downloading_trade_value(browser, type_flow, reporter_name, full_path_download,
+                                         flag_insert_user=flag_insert_user,
+                                         full_path_download_qty=full_path_download_qty,
+                                         extra_flows=extra_flows)
+        elif qty_or_value == 'Quantities' and product_cluster == 'not_tariff':
+            self.downloading_quantities(browser, type_flow, reporter_name, full_path_download,
+                                        partner_list=partner_list, flag_insert_user=flag_insert_user)
+        elif qty_or_value == 'Values' and product_cluster == 'tariff':
+            self.downloading_tariff_line_value(browser, type_flow, reporter_name, full_path_download,
+                                               flag_insert_user=flag_insert_user)
+
+        # Обновляем json файлы и индекс скачанных файлов для ноутбуков
+        self.state_store.export_json()
+        for full_path_download in dict_full_path_download.values():
+            self.download_indexes[full_path_download].save()
+
+    def close_session(self):
+        """
+        Закрывает браузер общей сессии, наблюдателей за папками, хранилище состояния, пул подключений к БД
+        и очередь уведомлений.
+        Вызывается после того, как все задачи выполнены
+
+        :return:
+        """
+        if self.browser_session is not None:
+            if self.session_store is not None and self.browser_session.flag_authorized \
+                    and self.browser_session.is_alive():
+                self.session_store.save_cookies(self.browser_session.browser)
+            self.browser_session.close()
+        for watcher in self.download_watchers.values():
+            watcher.close()
+        self.download_watchers = {}
+        for download_index in self.download_indexes.values():
+            download_index.save()
+        # close останавливает фоновую запись, выгружает json файлы и закрывает SQLite
+        self.state_store.close()
+        self.db.close()
+        self.notify.close()
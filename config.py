@@ -43,3 +43,19 @@ conf_dict = {'authorization_form': 'ctl00_MenuControl_Label_Login',
              'country_drop_down_placeholder': 'ctl00_PageContent_RadComboBox_Country_DropDownPlaceholder',
              'country_drop_down': 'ctl00_PageContent_RadComboBox_Country_DropDown'
              }
+
+# Поля параметра nvpm ссылки Product_SelCountry_TS.aspx (значения через |, 18 полей).
+# positions - номер поля для каждой опции, values - код опции в ссылке по тексту опции на странице.
+# Поля, которых нет в positions, берутся из базовой ссылки url_trade_map без изменений
+nvpm_conf = {'positions': {'reporter': 1,
+                           'partner': 3,
+                           'product_cluster_level': 8,
+                           'trade_type': 9,
+                           'ts_indicator': 13,
+                           'ts_currency': 14},
+             'values': {'product_cluster_level': {'Product cluster at 6 digits': '6',
+                                                  'Products at the tariff line': '8'},
+                        'trade_type': {'Imports': '1', 'Exports': '2'},
+                        'ts_indicator': {'Values': '1', 'Quantities': '2'},
+                        'ts_currency': {'USD': '1'}}
+             }
@@ -0,0 +1,158 @@
+import io
+import time
+import typing
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+
+
+def partition_table(year, schema: typing.Optional[str] = '') -> sql.Composed:
+    """
+    :param year: год
+
+    :param schema: схема партиций ('' - схема по умолчанию)
+
+    :return: имя партиции года (_{year}) для SQL запроса
+    """
+    table = sql.Identifier(f'_{year}')
+    return sql.SQL('{}.{}').format(sql.Identifier(schema), table) if schema else table
+
+
+def _format_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Целые числа, ставшие float из-за пропусков (например, partner_code после left merge),
+    пишутся без ".0", иначе COPY не примет их в integer столбец
+
+    :param chunk: часть датафрейма
+
+    :return: часть датафрейма для записи в CSV
+    """
+    for column in chunk.columns:
+        values = chunk[column]
+        if values.dtype.kind == 'f' and np.all(np.mod(values.dropna(), 1) == 0):
+            chunk = chunk.assign(**{column: values.astype('Int64')})
+    return chunk
+
+
+def copy_frame(cursor, df: pd.DataFrame, positions: np.ndarray, table: sql.Composable,
+               chunk_rows: typing.Optional[int] = 200000) -> int:
+    """
+    Пишет строки датафрейма в таблицу через COPY ... FROM STDIN (CSV из буфера в памяти) частями по chunk_rows строк
+
+    :param cursor: курсор psycopg2
+
+    :param df: датафрейм, столбцы которого совпадают со столбцами таблицы
+
+    :param positions: номера строк df, которые пишутся в таблицу
+
+    :param table: таблица
+
+    :param chunk_rows: сколько строк в одной части
+
+    :return: количество записанных строк
+    """
+    query = sql.SQL('COPY {} ({}) FROM STDIN WITH (FORMAT csv)').format(
+        table, sql.SQL(', ').join(sql.Identifier(column) for column in df.columns))
+    for start in range(0, len(positions), chunk_rows):
+        buffer = io.StringIO()
+        _format_chunk(df.iloc[positions[start:start + chunk_rows]]).to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        cursor.copy_expert(query, buffer)
+    return len(positions)
+
+
+def copy_year_partitions(connection, df: pd.DataFrame, schema: typing.Optional[str] = '',
+                         chunk_rows: typing.Optional[int] = 200000, commit: typing.Optional[bool] = True) -> dict:
+    """
+    Загружает датафрейм в партиции по годам (_{year}) через COPY вместо to_sql. Строки года выбираются по номерам,
+    копии датафрейма на каждый год не создаются. Порядок столбцов берется из датафрейма
+
+    :param connection: подключение psycopg2
+
+    :param df: датафрейм со столбцом year в порядке столбцов таблицы
+
+    :param schema: схема партиций
+
+    :param chunk_rows: сколько строк передается одним COPY
+
+    :param commit: зафиксировать транзакцию после загрузки (False - загрузка в транзакции вызывающего кода)
+
+    :return: год -> количество загруженных строк
+    """
+    rows_by_year = {}
+    total_start = time.perf_counter()
+    try:
+        with connection.cursor() as cursor:
+            for year, positions in df.groupby('year', sort=False).indices.items():
+                start_time = time.perf_counter()
+                rows_by_year[year] = copy_frame(cursor, df, positions, partition_table(year, schema), chunk_rows)
+                elapsed = time.perf_counter() - start_time
+                print(f'{year}, количество строк: {rows_by_year[year]}, {rows_by_year[year] / max(elapsed, 1e-9):,.0f} строк/с')
+        if commit:
+            connection.commit()
+    except Exception:
+        if commit:
+            connection.rollback()
+        raise
+    total_rows = sum(rows_by_year.values())
+    elapsed = time.perf_counter() - total_start
+    print(f'Всего строк: {total_rows} за {elapsed:.1f} с, {total_rows / max(elapsed, 1e-9):,.0f} строк/с')
+    return rows_by_year
+
+
+def reload_reporter(connection, df: pd.DataFrame, table: str, schema: typing.Optional[str] = '',
+                    chunk_rows: typing.Optional[int] = 200000) -> dict:
+    """
+    Заменяет данные репортера одной транзакцией: одним запросом считаются границы годов и количество строк в БД,
+    удаляются года начиная с минимального года датафрейма (более ранние года в БД остаются), датафрейм
+    загружается через COPY и количество строк сверяется с датафреймом. При любой ошибке или расхождении
+    транзакция откатывается, и в БД остаются прежние данные репортера
+
+    :param connection: подключение psycopg2
+
+    :param df: датафрейм одного репортера со столбцами reporter_code и year
+
+    :param table: родительская таблица партиций (tc или tl)
+
+    :param schema: схема таблицы и партиций
+
+    :param chunk_rows: сколько строк передается одним COPY
+
+    :return: год -> количество загруженных строк
+    """
+    reporter_codes = df.reporter_code.unique()
+    if len(reporter_codes) != 1:
+        raise ValueError(f'В датафрейме должен быть один репортер, получено: {reporter_codes.tolist()}')
+    reporter_code = int(reporter_codes[0])
+    min_year = min(int(year) for year in df.year.unique())
+    table = sql.SQL('{}.{}').format(sql.Identifier(schema), sql.Identifier(table)) if schema else sql.Identifier(table)
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL("""SELECT MAX(year) FILTER (WHERE year < %(min_year)s),
+                                             COUNT(*) FILTER (WHERE year >= %(min_year)s),
+                                             COUNT(*)
+                                      FROM {}
+                                      WHERE reporter_code = %(reporter_code)s""").format(table),
+                           {'min_year': min_year, 'reporter_code': reporter_code})
+            kept_year, replaced_rows, total_rows = cursor.fetchone()
+            kept_text = f'года по {kept_year} остаются' if kept_year is not None else 'более ранних годов нет'
+            print(f'Репортер {reporter_code}: строк в БД {total_rows}, заменяется {replaced_rows} '
+                  f'(года с {min_year}), {kept_text}')
+
+            cursor.execute(sql.SQL('DELETE FROM {} WHERE reporter_code = %s AND year >= %s').format(table),
+                           (reporter_code, min_year))
+
+        rows_by_year = copy_year_partitions(connection, df, schema=schema, chunk_rows=chunk_rows, commit=False)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL('SELECT COUNT(*) FROM {} WHERE reporter_code = %s AND year >= %s').format(table),
+                           (reporter_code, min_year))
+            loaded_rows = cursor.fetchone()[0]
+        if loaded_rows != df.shape[0]:
+            raise ValueError(f'В БД {loaded_rows} строк репортера {reporter_code}, в датафрейме {df.shape[0]}')
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return rows_by_year
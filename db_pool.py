@@ -0,0 +1,241 @@
+import logging
+import select
+import threading
+import time
+import typing
+import psycopg2
+from psycopg2 import pool, sql
+
+# Триггер на ce, который будит воркер, когда бот записал ответ на капчу (payload - {chat_id}:{worker_id}).
+# Функция пересоздается при каждом запуске, триггер создается только если его еще нет
+CAPTCHA_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION ce_captcha_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify({channel}, NEW.chat_id::text || ':' || NEW.worker_id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'ce_captcha_notify' AND tgrelid = 'ce'::regclass) THEN
+        CREATE TRIGGER ce_captcha_notify AFTER UPDATE OF captcha_flag ON ce
+            FOR EACH ROW WHEN (NEW.captcha_flag) EXECUTE PROCEDURE ce_captcha_notify();
+    END IF;
+EXCEPTION WHEN duplicate_object THEN
+    -- Триггер одновременно создал другой воркер
+    NULL;
+END
+$$;
+"""
+
+
+class ITC_db:
+
+    def __init__(self, dict_postgres_cred: dict, castom_logger: logging.Logger,
+                 maxconn: typing.Optional[int] = 3, retries: typing.Optional[int] = 5,
+                 flush_interval: typing.Optional[float] = 1.0):
+        """
+        Работа с таблицей ce через небольшой пул подключений с автоматическим переподключением.
+        Записи чекпоинтов копятся в памяти (последнее значение по ключу) и пишутся фоновым потоком,
+        поэтому цикл скачивания не ждет ответа базы
+
+        :param dict_postgres_cred: креды для подключения к базе данных
+
+        :param castom_logger: экзепляр класса logging для записи логов в файл
+
+        :param maxconn: максимальное количество подключений в пуле
+
+        :param retries: сколько раз повторять запрос при потере подключения
+
+        :param flush_interval: как часто фоновый поток записывает накопленные изменения (секунды)
+        """
+        self.castom_logger = castom_logger
+        self.dict_postgres_cred = dict_postgres_cred
+        self.retries = retries
+        self.flush_interval = flush_interval
+        self.pool = pool.ThreadedConnectionPool(1, maxconn,
+                                                user=dict_postgres_cred['user'],
+                                                password=dict_postgres_cred['password'],
+                                                host=dict_postgres_cred['host'],
+                                                port=dict_postgres_cred['port'],
+                                                database=dict_postgres_cred['database'])
+        # ключ -> (запрос, параметры), хранится только последняя запись по ключу
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        # Сериализует запись, чтобы flush из основного потока не обогнал фоновый поток
+        self._flush_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._stop = False
+        # Отдельное подключение в autocommit для LISTEN, в пул не возвращается
+        self._listen_conn = None
+        self._writer = threading.Thread(target=self._writer_loop, name='ce_checkpoint_writer', daemon=True)
+        self._writer.start()
+
+    def execute(self, query: str, params: tuple, fetch: typing.Optional[bool] = False) -> typing.Optional[tuple]:
+        """
+        Выполняет запрос на подключении из пула. При потере подключения оно выбрасывается из пула,
+        а запрос повторяется на новом. Если база недоступна, попытки повторяются с паузой 2, 4, 8... секунд
+
+        :param query: SQL запрос
+
+        :param params: параметры запроса
+
+        :param fetch: вернуть первую строку результата
+
+        :return: первая строка результата при fetch=True
+        """
+        for attempt in range(1, self.retries + 1):
+            conn = None
+            try:
+                # Новое подключение открывается здесь же, поэтому недоступная база тоже повторяется с паузой
+                conn = self.pool.getconn()
+                with conn.cursor() as cur:
+                    cur.execute(query, params)
+                    result = cur.fetchone() if fetch else None
+                conn.commit()
+                self.pool.putconn(conn)
+                return result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError, pool.PoolError) as e:
+                if conn is not None:
+                    self.pool.putconn(conn, close=True)
+                self.castom_logger.info(f'ПОТЕРЯНО ПОДКЛЮЧЕНИЕ К БД ({attempt}/{self.retries}) {e}')
+                if attempt == self.retries:
+                    raise
+                time.sleep(min(2 ** attempt, 30))
+            except Exception:
+                conn.rollback()
+                self.pool.putconn(conn)
+                raise
+
+    def write_later(self, key: str, query: str, params: tuple):
+        """
+        Откладывает запись. Повторная запись с тем же ключом заменяет предыдущую, если та еще не записана
+
+        :param key: ключ записи (например, название столбца ce)
+
+        :param query: SQL запрос
+
+        :param params: параметры запроса
+
+        :return:
+        """
+        with self._pending_lock:
+            self._pending[key] = (query, params)
+        self._wake_up.set()
+
+    def flush(self):
+        """
+        Синхронно записывает все отложенные изменения. Вызывается перед чтением из ce
+
+        :return:
+        """
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for key, (query, params) in pending.items():
+                try:
+                    self.execute(query, params)
+                except psycopg2.Error as e:
+                    # Не теряем запись: вернем ее, если за это время не появилась более новая
+                    with self._pending_lock:
+                        self._pending.setdefault(key, (query, params))
+                    self.castom_logger.info(f'ЗАПИСЬ {key} ОТЛОЖЕНА {e}')
+
+    def _writer_loop(self):
+        while not self._stop:
+            self._wake_up.wait()
+            # Небольшая пауза, чтобы несколько быстрых обновлений склеились в одну запись
+            time.sleep(self.flush_interval)
+            self._wake_up.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.castom_logger.info(f'ОШИБКА ФОНОВОЙ ЗАПИСИ В БД {e}')
+
+    def check_worker_column(self):
+        """
+        Все запросы к ce фильтруют строку по worker_id (в том числе при одном воркере). Если столбца нет,
+        база не обновлена: останавливаемся с понятной ошибкой, а не на первом запросе флага капчи
+
+        :return:
+        """
+        flag_column = self.execute("""SELECT EXISTS (SELECT 1 FROM pg_attribute
+                                                    WHERE attrelid = to_regclass('ce') AND attname = 'worker_id'
+                                                    AND NOT attisdropped)""", None, fetch=True)[0]
+        if not flag_column:
+            raise RuntimeError('В таблице ce нет столбца worker_id, обновите БД (README, раздел "Обновление БД"): '
+                               'ALTER TABLE ce ADD COLUMN worker_id integer NOT NULL DEFAULT 0;')
+
+    def create_captcha_trigger(self, channel: str):
+        """
+        Создает триггер NOTIFY на ce, если его нет. Без прав на создание функций и триггеров
+        парсер работает как раньше: флаг капчи проверяется напрямую по таймауту wait_notify
+
+        :param channel: канал, в который триггер отправляет уведомление
+
+        :return:
+        """
+        try:
+            self.execute(sql.SQL(CAPTCHA_TRIGGER_SQL).format(channel=sql.Literal(channel)), None)
+        except psycopg2.Error as e:
+            self.castom_logger.info(f'ТРИГГЕР {channel} НЕ СОЗДАН, КАПЧА ПРОВЕРЯЕТСЯ ОПРОСОМ {e}')
+
+    def listen(self, channel: str):
+        """
+        Подписывается на канал NOTIFY. Вызывается до того, как событие может произойти,
+        иначе уведомление будет потеряно
+
+        :param channel: имя канала
+
+        :return:
+        """
+        if self._listen_conn is None or self._listen_conn.closed:
+            self._listen_conn = psycopg2.connect(user=self.dict_postgres_cred['user'],
+                                                 password=self.dict_postgres_cred['password'],
+                                                 host=self.dict_postgres_cred['host'],
+                                                 port=self.dict_postgres_cred['port'],
+                                                 database=self.dict_postgres_cred['database'])
+            self._listen_conn.autocommit = True
+        with self._listen_conn.cursor() as cur:
+            cur.execute(f'LISTEN {channel}')
+
+    def wait_notify(self, payload: str, timeout: float) -> bool:
+        """
+        Ждет уведомление с нужным payload на каналах, на которые подписались через listen
+
+        :param payload: ожидаемый payload (уведомления с другим payload пропускаются)
+
+        :param timeout: максимальное время ожидания в секундах
+
+        :return: True если уведомление пришло, False по таймауту или при потере подключения
+        """
+        deadline = time.time() + timeout
+        try:
+            while True:
+                self._listen_conn.poll()
+                while self._listen_conn.notifies:
+                    if self._listen_conn.notifies.pop(0).payload == payload:
+                        return True
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                select.select([self._listen_conn], [], [], remaining)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # Подключение будет открыто заново при следующем listen, а пока вызывающий код проверит флаг сам
+            self.castom_logger.info(f'ПОТЕРЯНО ПОДКЛЮЧЕНИЕ LISTEN {e}')
+            self._listen_conn.close()
+            return False
+
+    def close(self):
+        """
+        Записывает отложенные изменения и закрывает пул
+
+        :return:
+        """
+        self._stop = True
+        self._wake_up.set()
+        self.flush()
+        self.pool.closeall()
+        if self._listen_conn is not None and not self._listen_conn.closed:
+            self._listen_conn.close()
@@ -0,0 +1,183 @@
+import fnmatch
+import hashlib
+import json
+import os
+import typing
+from pathlib import Path
+
+# Файлы, которые не являются скачанными данными: незавершенные загрузки Chrome и HTTP выгрузки
+SKIP_SUFFIXES = ('.crdownload', '.part', '.tmp')
+
+
+class Download_index:
+
+    # Индекс хранится в самой папке загрузки, чтобы переезжать вместе с ней
+    index_file_name = '.download_index.json'
+
+    def __init__(self, folder: str, recursive: typing.Optional[bool] = False):
+        """
+        Индекс скачанных файлов папки: имя -> размер, время изменения и md5 содержимого.
+        Папка читается одним проходом scandir при создании индекса, дальше проверки "файл уже скачан"
+        делаются по памяти, а законченные загрузки добавляются через add.
+        md5 считается только по запросу (hash), чтобы построение индекса не читало каждый файл целиком
+        (сборка в itc_transform и так читает их). Посчитанные хэши сохраняются в .download_index.json
+        и сбрасываются, когда меняется размер или время изменения файла
+
+        :param folder: папка загрузки
+
+        :param recursive: индексировать и вложенные папки (как glob('**/...') в ноутбуках), имена файлов тогда
+                          задаются путем относительно folder через /. Скрытые папки (промежуточная .staging)
+                          пропускаются: в них лежат еще не проверенные загрузки
+        """
+        self.folder = folder
+        self.recursive = recursive
+        self.index_file = os.path.join(folder, self.index_file_name)
+        self.files = {}
+        self._dirty = False
+        self._build()
+
+    def _load_cache(self) -> dict:
+        if not os.path.isfile(self.index_file):
+            return {}
+        try:
+            with open(self.index_file, encoding='utf-8') as fl:
+                return json.load(fl)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def file_hash(full_path_file: str) -> str:
+        """
+        :param full_path_file: полный путь к файлу
+
+        :return: md5 содержимого файла
+        """
+        md5 = hashlib.md5()
+        with open(full_path_file, 'rb') as fl:
+            for chunk in iter(lambda: fl.read(1048576), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    def _build(self):
+        """
+        Один проход по папке, хэши берутся из сохраненного индекса, если размер и время изменения совпадают,
+        иначе остаются не посчитанными
+
+        :return:
+        """
+        cache = self._load_cache()
+        if not os.path.isdir(self.folder):
+            return
+        # Папки на обход: (путь, префикс имени относительно folder)
+        folders = [(self.folder, '')]
+        while folders:
+            folder, prefix = folders.pop()
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if self.recursive and not entry.name.startswith('.'):
+                            folders.append((entry.path, f'{prefix}{entry.name}/'))
+                        continue
+                    if not entry.is_file() or entry.name == self.index_file_name \
+                            or entry.name.endswith(SKIP_SUFFIXES):
+                        continue
+                    name = prefix + entry.name
+                    stat = entry.stat()
+                    cached = cache.get(name)
+                    if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+                        self.files[name] = cached
+                    else:
+                        self.files[name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': None}
+                        self._dirty = True
+        if set(cache) - set(self.files):
+            self._dirty = True
+
+    def __contains__(self, file_name: str) -> bool:
+        return file_name in self.files
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def get(self, file_name: str) -> typing.Optional[dict]:
+        """
+        :param file_name: название файла
+
+        :return: словарь size, mtime, hash (None, пока не посчитан) или None, если файла нет
+        """
+        return self.files.get(file_name)
+
+    def hash(self, file_name: str) -> typing.Optional[str]:
+        """
+        Считает md5 файла при первом запросе и запоминает его в индексе
+
+        :param file_name: название файла (путь относительно папки при recursive)
+
+        :return: md5 содержимого или None, если файла нет в индексе
+        """
+        info = self.files.get(file_name)
+        if info is None:
+            return None
+        if info['hash'] is None:
+            info['hash'] = self.file_hash(os.path.join(self.folder, file_name))
+            self._dirty = True
+        return info['hash']
+
+    def add(self, file_name: str):
+        """
+        Добавляет в индекс файл, загрузка которого закончилась
+
+        :param file_name: название файла (путь относительно папки при recursive)
+
+        :return:
+        """
+        full_path_file = os.path.join(self.folder, file_name)
+        stat = os.stat(full_path_file)
+        self.files[file_name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': None}
+        self._dirty = True
+
+    def remove(self, file_name: str):
+        """
+        Удаляет файл с диска и из индекса
+
+        :param file_name: название файла (путь относительно папки при recursive)
+
+        :return:
+        """
+        full_path_file = os.path.join(self.folder, file_name)
+        if os.path.isfile(full_path_file):
+            os.remove(full_path_file)
+        if self.files.pop(file_name, None) is not None:
+            self._dirty = True
+
+    def names(self, pattern: typing.Optional[str] = '*') -> list:
+        """
+        :param pattern: шаблон имени файла в формате glob (например, Tra*.txt или *(1)*.txt),
+                        проверяется только имя файла без вложенных папок
+
+        :return: отсортированные названия подходящих файлов
+        """
+        return sorted(name for name in self.files if fnmatch.fnmatchcase(name.rsplit('/', 1)[-1], pattern))
+
+    def paths(self, pattern: typing.Optional[str] = '*') -> list:
+        """
+        Замена Path(folder).glob(pattern) для ноутбуков (Path(folder).glob('**/' + pattern) при recursive)
+
+        :param pattern: шаблон имени файла в формате glob
+
+        :return: список Path подходящих файлов
+        """
+        return [Path(self.folder, name) for name in self.names(pattern)]
+
+    def save(self):
+        """
+        Сохраняет индекс, если он менялся
+
+        :return:
+        """
+        if not self._dirty or not os.path.isdir(self.folder):
+            return
+        temp_file = self.index_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as fl:
+            json.dump(self.files, fl, ensure_ascii=False)
+        os.replace(temp_file, self.index_file)
+        self._dirty = False
@@ -0,0 +1,274 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sys
+import time
+import typing
+
+# Флаги inotify из <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Расширение временного файла, который Chrome пишет до окончания загрузки
+CHROME_TEMP_SUFFIX = '.crdownload'
+
+
+class Download_watcher:
+
+    def __init__(self, folder: str, castom_logger: logging.Logger, stall_timeout: typing.Optional[int] = 30,
+                 poll_interval: typing.Optional[float] = 0.5):
+        """
+        Следит за папкой загрузки. На Linux просыпается по событиям inotify, на остальных системах
+        (или если inotify недоступен) опрашивает папку с интервалом poll_interval
+
+        :param folder: папка, в которую Chrome скачивает файлы
+
+        :param castom_logger: экзепляр класса logging для записи логов в файл
+
+        :param stall_timeout: сколько секунд начавшаяся загрузка может не расти, прежде чем считаться зависшей
+                              (до первого байта действует только общий timeout загрузки)
+
+        :param poll_interval: максимальное время сна между проверками папки
+        """
+        self.folder = folder
+        self.castom_logger = castom_logger
+        self.stall_timeout = stall_timeout
+        self.poll_interval = poll_interval
+        self._inotify_fd: typing.Optional[int] = None
+        # Файлы, загрузка которых отслеживается без ожидания: имя -> время начала, прогресс, timeout
+        self.tracked = {}
+        if sys.platform.startswith('linux'):
+            self._init_inotify()
+
+    def _init_inotify(self):
+        """
+        Подключает inotify через libc, при любой ошибке остаемся на опросе папки
+
+        :return:
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1')
+            mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            if libc.inotify_add_watch(fd, os.fsencode(self.folder), mask) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch')
+            self._inotify_fd = fd
+        except (OSError, AttributeError) as e:
+            self.castom_logger.info(f'INOTIFY НЕДОСТУПЕН, ОПРАШИВАЕМ ПАПКУ {e}')
+            self._inotify_fd = None
+
+    def sleep_until_event(self, timeout: float):
+        """
+        Ждет следующего события в папке (или просто спит, если inotify нет)
+
+        :param timeout: максимальное время ожидания
+
+        :return:
+        """
+        if self._inotify_fd is None:
+            time.sleep(timeout)
+            return
+        ready, _, _ = select.select([self._inotify_fd], [], [], timeout)
+        if ready:
+            # Сами события не разбираем, после пробуждения состояние папки проверяется целиком
+            try:
+                while os.read(self._inotify_fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def snapshot(self) -> dict:
+        """
+        :return: словарь имя файла -> размер для всех файлов в папке
+        """
+        try:
+            with os.scandir(self.folder) as entries:
+                return {entry.name: entry.stat().st_size for entry in entries if entry.is_file()}
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def _is_unconfirmed(name: str) -> bool:
+        return name.startswith('Unconfirmed') and name.endswith(CHROME_TEMP_SUFFIX)
+
+    def _claim_unconfirmed(self, files: dict):
+        """
+        Сопоставляет временные файлы 'Unconfirmed NNN.crdownload' загрузкам. До того как Chrome узнает имя файла,
+        он пишет в такой файл, потом переименовывает его в '{file_name}.crdownload'. Загрузке принадлежат
+        только файлы, которых не было в снимке папки до ее клика. Более поздние загрузки разбирают файлы первыми:
+        файлы ранних загрузок уже есть в их снимках
+
+        :param files: снимок папки
+
+        :return:
+        """
+        claimed = set().union(*(state['temp_files'] for state in self.tracked.values()))
+        for state in reversed(list(self.tracked.values())):
+            for name in files:
+                if self._is_unconfirmed(name) and name not in claimed \
+                        and (state['baseline'] is None or name not in state['baseline']):
+                    state['temp_files'].add(name)
+                    claimed.add(name)
+
+    @staticmethod
+    def _temp_size(files: dict, file_name: str, state: dict) -> int:
+        """
+        :param files: снимок папки
+
+        :param file_name: ожидаемое имя файла
+
+        :param state: состояние отслеживаемой загрузки
+
+        :return: размер временных файлов Chrome этой загрузки
+        """
+        return sum(size for name, size in files.items()
+                   if name == file_name + CHROME_TEMP_SUFFIX or name in state['temp_files'])
+
+    @staticmethod
+    def is_complete(files: dict, file_name: str) -> bool:
+        """
+        Файл считается скачанным только когда Chrome переименовал временный файл в итоговый
+
+        :param files: снимок папки
+
+        :param file_name: ожидаемое имя файла
+
+        :return: True если файл полностью записан
+        """
+        return file_name in files and file_name + CHROME_TEMP_SUFFIX not in files
+
+    def _remove_temp(self, file_name: str, state: dict):
+        """
+        Удаляет временные файлы зависшей загрузки, чтобы повторная загрузка не получила имя с (1)
+
+        :param file_name: ожидаемое имя файла
+
+        :param state: состояние отслеживаемой загрузки
+
+        :return:
+        """
+        for name in [file_name + CHROME_TEMP_SUFFIX] + sorted(state['temp_files']):
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+
+    def track(self, file_name: str, timeout: typing.Optional[int] = 180, baseline: typing.Optional[dict] = None):
+        """
+        Начинает отслеживать загрузку файла без ожидания, состояние проверяется через poll
+
+        :param file_name: ожидаемое имя файла
+
+        :param timeout: общее максимальное время загрузки (включая ожидание первого байта)
+
+        :param baseline: снимок папки до клика по кнопке загрузки, по нему загрузке сопоставляются
+                         временные файлы 'Unconfirmed' (None - загрузке принадлежат все незанятые)
+
+        :return:
+        """
+        now = time.time()
+        self.tracked[file_name] = {'start_time': now, 'last_progress_time': now, 'last_temp_size': 0,
+                                   'timeout': timeout, 'temp_files': set(),
+                                   'baseline': set(baseline) if baseline is not None else None}
+
+    def poll(self) -> tuple:
+        """
+        Одна проверка папки для всех отслеживаемых файлов, не блокирует
+
+        :return: (список скачанных файлов, список зависших или не уложившихся в timeout файлов),
+                 оба списка перестают отслеживаться
+        """
+        files = self.snapshot()
+        now = time.time()
+        self._claim_unconfirmed(files)
+        completed, failed = [], []
+        for file_name, state in list(self.tracked.items()):
+            if self.is_complete(files, file_name):
+                self.castom_logger.info(f"""ФАЙЛ {file_name} ЗАГРУЖЕН ЗА {round(now - state['start_time'], 1)} с""")
+                completed.append(file_name)
+                continue
+
+            # Пока сайт формирует отчет, байтов нет, это не зависание: до первого байта действует только timeout
+            temp_size = self._temp_size(files, file_name, state)
+            if temp_size > 0 and temp_size != state['last_temp_size']:
+                state['last_temp_size'] = temp_size
+                state['last_progress_time'] = now
+            elif temp_size > 0 and now - state['last_progress_time'] > self.stall_timeout:
+                self.castom_logger.info(f"""ЗАГРУЗКА {file_name} ЗАВИСЛА НА {temp_size} БАЙТ, ПОВТОРЯЕМ""")
+                self._remove_temp(file_name, state)
+                failed.append(file_name)
+                continue
+            if now - state['start_time'] > state['timeout']:
+                self.castom_logger.info(f"""ФАЙЛ {file_name} НЕ ЗАГРУЖЕН ЗА {state['timeout']} с""")
+                self._remove_temp(file_name, state)
+                failed.append(file_name)
+        for file_name in completed + failed:
+            del self.tracked[file_name]
+        return completed, failed
+
+    def wait_started(self, file_name: str, baseline: dict, timeout: typing.Optional[int] = 30) -> bool:
+        """
+        Ждет, пока Chrome начнет загрузку (появится временный или итоговый файл). После этого страницу
+        можно менять, загрузка продолжится в фоне
+
+        :param file_name: ожидаемое имя файла
+
+        :param baseline: снимок папки до клика по кнопке загрузки
+
+        :param timeout: максимальное время ожидания начала загрузки
+
+        :return: True если загрузка началась
+        """
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            files = self.snapshot()
+            if file_name in files or file_name + CHROME_TEMP_SUFFIX in files \
+                    or any(name not in baseline and name.endswith(CHROME_TEMP_SUFFIX) for name in files):
+                return True
+            self.sleep_until_event(self.poll_interval)
+        self.castom_logger.info(f"""ЗАГРУЗКА {file_name} НЕ НАЧАЛАСЬ ЗА {timeout} с""")
+        return False
+
+    def wait_for(self, file_name: str, timeout: typing.Optional[int] = 180,
+                 baseline: typing.Optional[dict] = None) -> bool:
+        """
+        Ждет, пока файл полностью скачается
+
+        :param file_name: ожидаемое имя файла
+
+        :param timeout: общее максимальное время ожидания
+
+        :param baseline: снимок папки до клика по кнопке загрузки (см. track)
+
+        :return: True если файл скачан, False если загрузка зависла или не уложилась в timeout
+        """
+        self.castom_logger.info(f"""ОЖИДАЕМ ЗАГРУЗКУ {file_name}""")
+        self.track(file_name, timeout, baseline)
+        while True:
+            completed, failed = self.poll()
+            if file_name in completed:
+                return True
+            if file_name in failed:
+                return False
+            self.sleep_until_event(self.poll_interval)
+
+    def close(self):
+        """
+        Закрывает дескриптор inotify
+
+        :return:
+        """
+        if self._inotify_fd is not None:
+            os.close(self._inotify_fd)
+            self._inotify_fd = None
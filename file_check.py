@@ -0,0 +1,91 @@
+import glob
+import os
+import typing
+
+# Сколько строк данных читать в поисках первого кода продукта (первая строка обычно TOTAL)
+MAX_DATA_LINES = 5
+
+# Длина кода продукта для уровня кластера
+CLUSTER_CODE_LENGTH = {'Product cluster at 6 digits': 6}
+
+
+class ITC_file_check:
+
+    def __init__(self, file_encoding: typing.Optional[str] = 'utf-8'):
+        """
+        Проверка скачанного txt файла сразу после загрузки: читаются только заголовок и несколько строк,
+        по ним сверяются измерение (Values или Quantities), направление торговли и уровень кластера
+
+        :param file_encoding: кодировка файлов Trade Map
+        """
+        self.file_encoding = file_encoding
+
+    def read_head(self, full_path_file: str) -> tuple:
+        """
+        :param full_path_file: полный путь к файлу
+
+        :return: столбцы заголовка и первый код продукта, отличный от TOTAL (или None)
+        """
+        with open(full_path_file, encoding=self.file_encoding, errors='replace') as fl:
+            columns = [column.strip().strip('"') for column in fl.readline().rstrip('\r\n').split('\t')]
+            for _ in range(MAX_DATA_LINES):
+                line = fl.readline()
+                if not line:
+                    break
+                product_code = line.split('\t', 1)[0].strip().strip('"')
+                if product_code and product_code != 'TOTAL':
+                    return columns, product_code
+        return columns, None
+
+    def check(self, full_path_file: str, measure_type: str, type_flow: str,
+              product_cluster_level_text: str) -> typing.Optional[str]:
+        """
+        Сверяет файл с запросом
+
+        :param full_path_file: полный путь к файлу
+
+        :param measure_type: 'Values' или 'Quantities'
+
+        :param type_flow: направление торговли ('Imports' или 'Exports')
+
+        :param product_cluster_level_text: на каком знаке выбирались продукты (или тарифной линии)
+
+        :return: описание несоответствия или None, если файл тот, что запрашивали
+        """
+        columns, product_code = self.read_head(full_path_file)
+        if columns[:2] != ['Product code', 'Product label']:
+            return f'НЕ ФАЙЛ TRADE MAP: {columns[:2]}'
+
+        data_columns = [column for column in columns[2:] if ' in ' in column]
+        flag_value = any('-Value in ' in column for column in data_columns)
+        flag_quantity = any('-Quantity in ' in column for column in data_columns)
+        if measure_type == 'Values' and (flag_quantity or not flag_value):
+            return 'ВМЕСТО Values СКАЧАНЫ Quantities'
+        if measure_type == 'Quantities' and not flag_quantity:
+            return 'ВМЕСТО Quantities СКАЧАНЫ Values'
+
+        # Направление проверяем, только если оно есть в названиях столбцов
+        header = ' '.join(data_columns).lower()
+        other_flow = 'export' if type_flow == 'Imports' else 'import'
+        if other_flow in header and type_flow.lower()[:-1] not in header:
+            return f'ВМЕСТО {type_flow} СКАЧАНО ДРУГОЕ НАПРАВЛЕНИЕ'
+
+        if product_code is not None:
+            code_length = CLUSTER_CODE_LENGTH.get(product_cluster_level_text)
+            if code_length is not None and len(product_code) != code_length:
+                return f'КОД {product_code} НЕ СООТВЕТСТВУЕТ {product_cluster_level_text}'
+            if code_length is None and len(product_code) <= 6:
+                return f'КОД {product_code} НЕ ТАРИФНАЯ ЛИНИЯ'
+        return None
+
+    @staticmethod
+    def duplicates(folder: str, file_name: str) -> list:
+        """
+        :param folder: папка загрузки
+
+        :param file_name: название файла
+
+        :return: копии файла, которые Chrome называет "название (1).txt" при повторной загрузке
+        """
+        stem, suffix = os.path.splitext(file_name)
+        return sorted(glob.glob(os.path.join(glob.escape(folder), f'{glob.escape(stem)} (*){suffix}')))
@@ -0,0 +1,113 @@
+import typing
+import lxml.html
+from selenium import webdriver
+from selenium.common.exceptions import NoSuchElementException as no_element
+
+
+class ITC_grid_parser:
+    """
+    Разбор таблицы ctl00_PageContent_MyGridView1 локально через lxml.
+    Таблица забирается из браузера одним запросом, дальше годы, зеркальные данные, итоги и colspan
+    считаются без обращений к WebDriver
+    """
+
+    # Года в шапке и значения в строках таблицы начинаются с 4 ячейки, на странице 12 лет
+    first_data_cell = 3
+    num_years = 12
+
+    def __init__(self, dict_html_elements: dict):
+        """
+        :param dict_html_elements: словарь с тэгами для навигации по сайту
+        """
+        self.dict_html_elements = dict_html_elements
+        self.grid_id = dict_html_elements['year_mirror_xpath'].split('"')[1]
+
+    def fetch_html(self, browser: webdriver) -> str:
+        """
+        Забирает html таблицы одним вызовом execute_script
+
+        :param browser: экземпляр класса webdriver
+
+        :return: outerHTML таблицы
+        """
+        html = browser.execute_script(
+            'var grid = document.getElementById(arguments[0]); return grid ? grid.outerHTML : null;',
+            self.grid_id)
+        if html is None:
+            raise no_element(f'Таблица {self.grid_id} отсутствует на странице')
+        return html
+
+    @staticmethod
+    def _text(element) -> str:
+        return ' '.join(element.text_content().split())
+
+    def _row_cells(self, root, xpath_key: str, tag: str) -> list:
+        rows = root.xpath(self.dict_html_elements[xpath_key])
+        return rows[0].findall(tag) if rows else []
+
+    def parse(self, html: str) -> dict:
+        """
+        Разбирает таблицу (или всю страницу, в которой она есть)
+
+        :param html: html таблицы или страницы
+
+        :return: словарь с ключами
+                 years - список годов в шапке,
+                 mirror - список флагов Mirror data по годам,
+                 totals - значения строки итогов (int или None, если в ячейке не число),
+                 colspan - словарь ключ границы (world_upper_border, country_upper_border) -> colspan или None
+        """
+        root = lxml.html.fromstring(html)
+        year_cells = self._row_cells(root, 'year_mirror_xpath', 'th')[
+                     self.first_data_cell:self.first_data_cell + self.num_years]
+        mirror_cells = self._row_cells(root, 'value_mirror_xpath', 'td')[
+                       self.first_data_cell:self.first_data_cell + self.num_years]
+        total_cells = self._row_cells(root, 'zero_check', 'td')[self.first_data_cell:]
+
+        totals = []
+        for cell in total_cells:
+            text = self._text(cell).replace(',', '')
+            totals.append(int(text) if text.isdigit() else None)
+
+        colspan = {}
+        for border_key in ('world_upper_border', 'country_upper_border'):
+            border = root.xpath(f'//*[@id="{self.dict_html_elements[border_key]}"]')
+            colspan[border_key] = int(border[0].get('colspan')) if border and border[0].get('colspan') else None
+
+        return {'years': [self._text(cell).split(' in ')[1] for cell in year_cells],
+                'mirror': [cell.get('title') == 'Mirror data' for cell in mirror_cells],
+                'totals': totals,
+                'colspan': colspan}
+
+    @staticmethod
+    def check_zero_country(grid: dict, partner: str) -> int:
+        """
+        Сумма итогов по годам партнера, 0 значит данных по партнеру нет
+
+        :param grid: результат parse
+
+        :param partner: текущий партнер, для World граница таблицы другая
+
+        :return: сумма значений
+        """
+        border_key = 'world_upper_border' if partner == 'World' else 'country_upper_border'
+        if grid['colspan'][border_key] is None:
+            raise no_element(f'Граница {border_key} отсутствует в таблице')
+        return sum(value for value in grid['totals'][:grid['colspan'][border_key]] if value is not None)
+
+    def read(self, browser: webdriver) -> dict:
+        """
+        :param browser: экземпляр класса webdriver
+
+        :return: разобранная таблица текущей страницы
+        """
+        return self.parse(self.fetch_html(browser))
+
+    @staticmethod
+    def mirror_years(grid: dict) -> typing.Iterator[tuple]:
+        """
+        :param grid: результат parse
+
+        :return: пары (год, флаг Mirror data)
+        """
+        return zip(grid['years'], grid['mirror'])
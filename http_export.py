@@ -0,0 +1,266 @@
+import logging
+import os
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
+from selenium import webdriver
+from selenium.common.exceptions import NoSuchElementException as no_element
+
+
+class _Form_parser(HTMLParser):
+    """
+    Разбирает состояние ASP.NET формы страницы: скрытые поля (__VIEWSTATE, __EVENTVALIDATION и т.д.),
+    значения выпадающих списков и их опции
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = ''
+        self.action = ''
+        self.fields = {}
+        # id поля (в том числе кнопок-картинок) -> name
+        self.input_names = {}
+        # id выпадающего списка -> name
+        self.select_names = {}
+        # name выпадающего списка -> список (value, text)
+        self.select_options = {}
+        self._select_name = None
+        self._in_option = False
+        self._option_value = None
+        self._option_selected = False
+        self._option_text = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form' and not self.action:
+            self.action = attrs.get('action') or ''
+        elif tag == 'input' and attrs.get('name'):
+            if attrs.get('id'):
+                self.input_names[attrs['id']] = attrs['name']
+            input_type = (attrs.get('type') or 'text').lower()
+            if input_type in ('submit', 'image', 'button', 'reset', 'file'):
+                return
+            if input_type in ('checkbox', 'radio') and 'checked' not in attrs:
+                return
+            self.fields[attrs['name']] = attrs.get('value') or ''
+        elif tag == 'select' and attrs.get('name'):
+            self._select_name = attrs['name']
+            if attrs.get('id'):
+                self.select_names[attrs['id']] = attrs['name']
+            self.select_options[self._select_name] = []
+        elif tag == 'option' and self._select_name is not None:
+            self._finish_option()
+            self._in_option = True
+            self._option_value = attrs.get('value')
+            self._option_selected = 'selected' in attrs
+            self._option_text = []
+
+    def handle_data(self, data):
+        if self._in_option:
+            self._option_text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'option':
+            self._finish_option()
+        elif tag == 'select' and self._select_name is not None:
+            self._finish_option()
+            # Если ни одна опция не выбрана явно, браузер отправляет первую
+            if self._select_name not in self.fields and self.select_options[self._select_name]:
+                self.fields[self._select_name] = self.select_options[self._select_name][0][0]
+            self._select_name = None
+
+    def _finish_option(self):
+        # Закрывающий </option> в html не обязателен, поэтому опция завершается и по следующему тэгу
+        if not self._in_option:
+            return
+        text = ''.join(self._option_text).strip()
+        value = self._option_value if self._option_value is not None else text
+        self.select_options[self._select_name].append((value, text))
+        if self._option_selected:
+            self.fields[self._select_name] = value
+        self._in_option = False
+        self._option_value = None
+        self._option_selected = False
+        self._option_text = []
+
+
+class ITC_http_exporter:
+
+    def __init__(self, dict_html_elements: dict, castom_logger: logging.Logger, proxy: str,
+                 max_workers: typing.Optional[int] = 1, timeout: typing.Optional[int] = 180):
+        """
+        Быстрый путь скачивания: браузер нужен только для логина и капчи, дальше постбэки
+        выбора партнера и выгрузки txt отправляются напрямую по HTTP с куками браузера
+
+        :param dict_html_elements: словарь с тэгами для навигации по сайту
+
+        :param castom_logger: экзепляр класса logging для записи логов в файл
+
+        :param proxy: прокси, тот же что и у браузера
+
+        :param max_workers: сколько партнеров выгружать одновременно
+
+        :param timeout: таймаут одного HTTP запроса
+        """
+        self.dict_html_elements = dict_html_elements
+        self.castom_logger = castom_logger
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if proxy:
+            self.session.proxies = {'http': proxy, 'https': proxy}
+        self.page_url = ''
+        self.form: typing.Optional[_Form_parser] = None
+
+    @staticmethod
+    def parse_form(html: str) -> _Form_parser:
+        """
+        :param html: html страницы
+
+        :return: разобранное состояние формы
+        """
+        form = _Form_parser()
+        form.feed(html)
+        form.close()
+        form.html = html
+        return form
+
+    def load_browser_state(self, browser: webdriver):
+        """
+        Переносит куки, user-agent и состояние формы из браузера, в котором уже пройдены логин и капча
+        и выставлены нужные опции страницы
+
+        :param browser: экземпляр класса webdriver
+
+        :return:
+        """
+        self.session.cookies.clear()
+        for cookie in browser.get_cookies():
+            self.session.cookies.set(cookie['name'], cookie['value'],
+                                     domain=cookie.get('domain', ''), path=cookie.get('path', '/'))
+        self.session.headers['User-Agent'] = browser.execute_script('return navigator.userAgent')
+        self.page_url = browser.current_url
+        self.form = self.parse_form(browser.page_source)
+
+    def partner_options(self) -> list:
+        """
+        :return: список (value, text) опций выпадающего списка партнеров
+        """
+        name = self.form.select_names[self.dict_html_elements['country_partner']]
+        return self.form.select_options[name]
+
+    def _post(self, form: _Form_parser, extra_fields: dict, stream: typing.Optional[bool] = False) \
+            -> requests.Response:
+        """
+        Отправляет постбэк формы
+
+        :param form: состояние формы, от которого делается постбэк
+
+        :param extra_fields: поля, которые меняются относительно состояния формы
+
+        :param stream: не читать тело ответа сразу (для выгрузки файла)
+
+        :return: ответ сервера
+        """
+        data = dict(form.fields)
+        data.update(extra_fields)
+        response = self.session.post(urljoin(self.page_url, form.action or self.page_url), data=data,
+                                     headers={'Referer': self.page_url}, timeout=self.timeout, stream=stream)
+        response.raise_for_status()
+        return response
+
+    def select_partner(self, partner: str) -> typing.Optional[_Form_parser]:
+        """
+        Постбэк выбора партнера, аналог клика по опции в выпадающем списке
+
+        :param partner: название партнера
+
+        :return: состояние формы страницы партнера или None, если партнера нет в списке
+                 или сервер вернул страницу без формы (сессия потеряна)
+        """
+        partner_select = self.form.select_names[self.dict_html_elements['country_partner']]
+        partner_value = next((value for value, text in self.partner_options() if text == partner), None)
+        if partner_value is None:
+            return None
+        response = self._post(self.form, {'__EVENTTARGET': partner_select, '__EVENTARGUMENT': '',
+                                          partner_select: partner_value})
+        partner_form = self.parse_form(response.text)
+        if partner_form.fields.get(partner_select) != partner_value:
+            return None
+        return partner_form
+
+    def download_text(self, partner_form: _Form_parser, full_path_file: str) -> bool:
+        """
+        Постбэк кнопки выгрузки в txt, тело ответа потоком пишется на диск
+
+        :param partner_form: состояние формы страницы партнера
+
+        :param full_path_file: полный путь итогового файла
+
+        :return: True если сервер отдал файл, False если вернулась html страница
+        """
+        button_name = partner_form.input_names[self.dict_html_elements['download_button_txt']]
+        response = self._post(partner_form, {'__EVENTTARGET': '', '__EVENTARGUMENT': '',
+                                             f'{button_name}.x': '10', f'{button_name}.y': '10'},
+                              stream=True)
+        with response:
+            content_type = response.headers.get('Content-Type', '')
+            if 'attachment' not in response.headers.get('Content-Disposition', '') \
+                    and not content_type.startswith('text/plain'):
+                return False
+            temp_file = full_path_file + '.part'
+            with open(temp_file, 'wb') as fl:
+                for chunk in response.iter_content(chunk_size=65536):
+                    fl.write(chunk)
+        os.replace(temp_file, full_path_file)
+        return True
+
+    def export_partner(self, partner: str, full_path_file: str,
+                       check_partner_page: typing.Optional[typing.Callable[[str, _Form_parser], bool]] = None) -> str:
+        """
+        Выбирает партнера и выгружает его файл
+
+        :param partner: название партнера
+
+        :param full_path_file: полный путь итогового файла
+
+        :param check_partner_page: проверка страницы партнера перед выгрузкой (например, что данные не нулевые)
+
+        :return: 'downloaded', 'skipped' (проверка страницы не пройдена) или 'failed'
+        """
+        try:
+            partner_form = self.select_partner(partner)
+            if partner_form is None:
+                return 'failed'
+            if check_partner_page is not None and not check_partner_page(partner, partner_form):
+                return 'skipped'
+            return 'downloaded' if self.download_text(partner_form, full_path_file) else 'failed'
+        except (requests.RequestException, OSError, no_element, IndexError, ValueError) as e:
+            self.castom_logger.info(f"""HTTP ОШИБКА ПО {partner} {e}""")
+            return 'failed'
+
+    def export_partners(self, partner_files: list,
+                        check_partner_page: typing.Optional[typing.Callable[[str, _Form_parser], bool]] = None) -> dict:
+        """
+        Выгружает файлы по списку партнеров, max_workers партнеров одновременно.
+        Постбэк каждого партнера делается от одного и того же состояния формы, поэтому партнеры независимы
+
+        :param partner_files: список пар (партнер, полный путь итогового файла)
+
+        :param check_partner_page: проверка страницы партнера перед выгрузкой
+
+        :return: словарь партнер -> результат export_partner
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(lambda item: self.export_partner(item[0], item[1], check_partner_page),
+                                   partner_files)
+            return {partner: result for (partner, _), result in zip(partner_files, results)}
+
+    def close(self):
+        self.session.close()
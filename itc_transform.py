@@ -0,0 +1,520 @@
+import functools
+import json
+import os
+import sys
+import time
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+from tqdm import tqdm
+from download_index import Download_index
+
+try:
+    import resource
+except ImportError:
+    # На Windows модуля нет, пиковая память тогда не выводится
+    resource = None
+
+# Справочники процесса разбора (коды ТНВЭД, года зеркальных данных и т.д.), в пуле передаются каждому процессу один раз
+_lookups = {}
+
+
+def rep_3(name):
+    return str(name).replace(' ', '_')
+
+
+def peak_rss_mb() -> typing.Optional[float]:
+    """
+    :return: пиковая память процесса в МБ или None, если узнать ее нельзя
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def report_resources(func):
+    """
+    Выводит время работы функции сборки и пиковую память процесса после нее
+
+    :param func: функция сборки
+
+    :return: обернутая функция
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        peak = peak_rss_mb()
+        peak_text = f'{peak:.0f} МБ' if peak is not None else 'неизвестна'
+        print(f"""{func.__name__}: {time.perf_counter() - start_time:.1f} с, пиковая память {peak_text}, строк {len(result)}""")
+        return result
+    return wrapper
+
+
+def concat_frames(frames: typing.Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Объединяет датафреймы файлов одним concat (без копирования растущего датафрейма на каждом файле)
+
+    :param frames: датафреймы файлов (список или генератор)
+
+    :return: общий датафрейм, пустой если файлов нет
+    """
+    frames = list(frames)
+    return pd.concat(frames) if frames else pd.DataFrame()
+
+
+def _init_lookups(lookups: dict):
+    """
+    Инициализатор процесса пула: сохраняет справочники, чтобы не передавать их с каждым файлом
+
+    :param lookups: справочники разбора
+
+    :return:
+    """
+    _lookups.clear()
+    _lookups.update(lookups)
+
+
+def map_files(func: typing.Callable, tasks: list, lookups: dict,
+              num_workers: typing.Optional[int] = 1) -> typing.Iterator:
+    """
+    Разбирает файлы последовательно или в пуле процессов. Результаты возвращаются в порядке tasks,
+    поэтому итог совпадает с последовательной сборкой
+
+    :param func: функция разбора одного файла (уровня модуля, чтобы ее можно было передать в процесс)
+
+    :param tasks: аргументы func для каждого файла
+
+    :param lookups: справочники, которые func берет из _lookups
+
+    :param num_workers: количество процессов (1 - в текущем процессе)
+
+    :return: результаты func по файлам
+    """
+    if num_workers <= 1 or len(tasks) <= 1:
+        _init_lookups(lookups)
+        yield from tqdm(map(func, tasks), total=len(tasks))
+        return
+    # Файлы отдаются пачками, чтобы на каждый файл не тратить отдельный обмен с процессом
+    chunksize = max(1, len(tasks) // (num_workers * 4))
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_lookups, initargs=(lookups,)) as executor:
+        yield from tqdm(executor.map(func, tasks, chunksize=chunksize), total=len(tasks))
+
+
+def map_unique(series: pd.Series, func: typing.Callable) -> pd.Series:
+    """
+    Аналог series.apply(func), но func вызывается один раз на каждое уникальное значение
+    (заголовки столбцов и года повторяются в каждой строке после melt)
+
+    :param series: столбец
+
+    :param func: преобразование одного значения
+
+    :return: преобразованный столбец
+    """
+    if series.empty:
+        # Пустой столбец сохраняет тип, как при apply
+        return series.apply(func)
+    return series.map({value: func(value) for value in series.unique()})
+
+
+def header_year(header: str) -> str:
+    """
+    :param header: заголовок столбца Trade Map (например, "...-Value in 2021")
+
+    :return: год из заголовка
+    """
+    return header.split(' in ')[1]
+
+
+def year_period(year: str) -> datetime:
+    """
+    :param year: год
+
+    :return: первое января года
+    """
+    return datetime.strptime('01-01-' + year, '%d-%m-%Y')
+
+
+def split_file_name(file_name: str, flag_and_in_reporter_name: bool) -> tuple:
+    """
+    Достает репортера и партнера из названия файла Trade Map (..._between_{reporter}_and_{partner}.txt)
+
+    :param file_name: название или путь файла
+
+    :param flag_and_in_reporter_name: в имени репортера есть and (Antigua_and_Barbuda)
+
+    :return: (репортер, партнер)
+    """
+    parts = str(file_name).split('_between_')[1].split('_and_')
+    # Если в названии репортера присутствует _and_ : Antigua_and_Barbuda, иначе репортер без _and_ : Cabo_Verde
+    reporter_parts = 2 if flag_and_in_reporter_name else 1
+    reporter = ' and '.join(parts[:reporter_parts]).replace('_', ' ').replace('  ', ' ')
+    partner = ' and '.join(parts[reporter_parts:]).replace('.txt', '').replace('_', ' ').replace('  ', ' ')
+    return reporter, partner
+
+
+def filter_need_codes(df: pd.DataFrame, need_codes: list) -> pd.DataFrame:
+    """
+    Оставляет группы до 24 включительно, 31 и нужные коды АПК на 6 знаках
+
+    :param df: датафрейм со столбцом Product_code
+
+    :param need_codes: коды ТНВЭД на 6 знаках (dict_need_tnved_code_apk['code_6'])
+
+    :return: отфильтрованный датафрейм
+    """
+    group = df['Product_code'].str[:2].astype(int)
+    return df[(group <= 24) | (group == 31) | (df['Product_code'].str[:6].isin(need_codes))]
+
+
+def read_value_file(full_path_file, reporter: str, partner: str, type_operation: int, need_codes: list,
+                    mirror_years: typing.Optional[list] = None,
+                    flag_tariff: typing.Optional[bool] = False) -> pd.DataFrame:
+    """
+    Очищенный датафрейм TRADE_VALUE одного файла
+
+    :param full_path_file: путь к файлу
+
+    :param reporter: репортер
+
+    :param partner: партнер
+
+    :param type_operation: тип операции (импорт - 1 или экспорт - 2)
+
+    :param need_codes: коды ТНВЭД на 6 знаках, которые нужны кроме групп до 24 и 31
+
+    :param mirror_years: года с зеркальными данными, которые исключаются
+
+    :param flag_tariff: файл тарифных линий (пропуски заполняются до фильтрации)
+
+    :return: датафрейм в формате trade_value_build
+    """
+    temp_df = pd.read_table(full_path_file, dtype={'Product code': 'str'})
+
+    # Получаем нужное количество колонок
+    need_max_year = max([int(i.split(' in ')[-1]) for i in temp_df.columns.tolist() if ' in ' in i])
+    temp_number_columns = None
+    for temp, column in enumerate(temp_df.columns):
+        if f'-Value in {need_max_year}' in column:
+            temp_number_columns = temp + 1
+            break
+    if partner == 'World':
+        temp_df = temp_df.drop(columns=list(temp_df.iloc[:, 2:16].columns)).iloc[:, 0:14]
+    else:
+        temp_df = temp_df.iloc[:, 0:temp_number_columns]
+
+    # Расплавляем датасет
+    temp_df = temp_df.melt(id_vars=['Product code', 'Product label'])
+    temp_df.rename(columns=rep_3, inplace=True)
+
+    # Отсекаем не нужное
+    if flag_tariff:
+        temp_df.fillna(0, inplace=True)
+    temp_df = temp_df.query('value > 0 and Product_code != "TOTAL"')
+    temp_df = filter_need_codes(temp_df, need_codes)
+    if not flag_tariff:
+        temp_df.fillna(0, inplace=True)
+
+    # Добавляем столбцы
+    temp_df = temp_df.assign(reporter_country=reporter, partner_country=partner, trade_flow_code=type_operation,
+                             classification='HS', update_date=datetime.now().strftime('%Y-%m-%d'))
+    temp_df['year_transaction'] = map_unique(temp_df.variable, header_year)
+    if mirror_years is not None:
+        temp_df = temp_df.query('year_transaction not in @mirror_years')
+    temp_df['period'] = map_unique(temp_df.year_transaction, year_period)
+    temp_df['aggregate_level'] = 6
+    temp_df['flag'] = 0
+    temp_df['plus'] = 0
+    temp_df['load_mark'] = 1
+    temp_df['value'] = temp_df.value.mul(1000)
+    return temp_df
+
+
+def _value_task(task: tuple) -> pd.DataFrame:
+    """
+    Разбор одного файла TRADE_VALUE в процессе пула
+
+    :param task: (путь к файлу, тип операции, флаг тарифных линий)
+
+    :return: датафрейм файла
+    """
+    full_path_file, type_operation, flag_tariff = task
+    reporter, partner = split_file_name(full_path_file, _lookups['flag_and_in_reporter_name'])
+    # Если есть зеркальные года, исключаем их
+    mirror_years = _lookups['mirror_data'].get(reporter, []) if _lookups['mirror_data'] is not None else None
+    return read_value_file(full_path_file, reporter, partner, type_operation, _lookups['need_codes'], mirror_years,
+                           flag_tariff)
+
+
+def iter_value_frames(path_values: str, type_operation: int, flag_and_in_reporter_name: bool, need_codes: list,
+                      mirror_data: typing.Optional[dict] = None, pattern: typing.Optional[str] = 'Tra*.txt',
+                      flag_tariff: typing.Optional[bool] = False,
+                      num_workers: typing.Optional[int] = 1) -> typing.Iterator[pd.DataFrame]:
+    """
+    Датафреймы файлов TRADE_VALUE в порядке файлов, чтобы собрать их одним concat
+
+    :param path_values: путь к файлам для TRADE_VALUE
+
+    :param type_operation: тип операции (импорт - 1 или экспорт - 2)
+
+    :param flag_and_in_reporter_name: в имени репортера есть and (Antigua_and_Barbuda)
+
+    :param need_codes: коды ТНВЭД на 6 знаках
+
+    :param mirror_data: репортер -> года с зеркальными данными (json_mirror_data.json), None - не исключать
+
+    :param pattern: шаблон имени файла
+
+    :param flag_tariff: файлы тарифных линий
+
+    :param num_workers: количество процессов разбора
+
+    :return: датафреймы файлов
+    """
+    tasks = [(full_path_file, type_operation, flag_tariff) for full_path_file in Download_index(path_values, recursive=True).paths(pattern)]
+    lookups = {'flag_and_in_reporter_name': flag_and_in_reporter_name, 'need_codes': set(need_codes),
+               'mirror_data': mirror_data}
+    yield from map_files(_value_task, tasks, lookups, num_workers)
+
+
+@report_resources
+def trade_value_build(path_values: str, type_operation: int, flag_and_in_reporter_name: bool, need_codes: list,
+                      df_country_add: pd.DataFrame, dict_partner_code: dict,
+                      mirror_data: typing.Optional[dict] = None, pattern: typing.Optional[str] = 'Tra*.txt',
+                      flag_tariff: typing.Optional[bool] = False,
+                      num_workers: typing.Optional[int] = 1) -> pd.DataFrame:
+    """
+    Собирает все файлы в один датафрейм для переданного направления торговли по переданному пути
+
+    :param path_values: путь к файлам для TRADE_VALUE
+
+    :param type_operation: тип операции (импорт - 1 или экспорт - 2)
+
+    :param flag_and_in_reporter_name: в имени репортера есть and (Antigua_and_Barbuda)
+
+    :param need_codes: коды ТНВЭД на 6 знаках (dict_need_tnved_code_apk['code_6'])
+
+    :param df_country_add: справочник стран add со столбцом test_name
+
+    :param dict_partner_code: название страны -> код
+
+    :param mirror_data: репортер -> года с зеркальными данными, None - не исключать
+
+    :param pattern: шаблон имени файла ('Tra*Bil*.txt' для тарифных линий)
+
+    :param flag_tariff: файлы тарифных линий
+
+    :param num_workers: количество процессов разбора файлов (1 - последовательно)
+
+    :return: очищенный датафрейм с данными по TRADE_VALUE
+    """
+    void_df_value = concat_frames(iter_value_frames(path_values, type_operation, flag_and_in_reporter_name, need_codes,
+                                                mirror_data, pattern, flag_tariff, num_workers))
+
+    # Создаем колонку для мержа
+    void_df_value['test_name'] = void_df_value.partner_country
+    # Удаляем лишнее
+    void_df_value.drop(columns='variable', inplace=True)
+
+    # Мержим наш void_df_value с COUNTRY_ADD
+    df_merge = void_df_value.merge(df_country_add, how='left', on='test_name')
+
+    df_merge.rename(columns={'code': 'partner_code'}, inplace=True)
+    # В зависимости от страны проставляем код
+    df_merge['reporter_code'] = map_unique(df_merge.reporter_country, lambda x: dict_partner_code[x])
+    return df_merge
+
+
+def check_not_download_file(type_flow: str, path_values: str, path_quantities: str, flag_and_in_reporter_name: bool,
+                            dct_itc_and_test_name: dict) -> dict:
+    """
+    Проверяет, все ли файлы по Quantities мы скачали исходя из файлов TRADE_VALUE
+
+    :param type_flow: тип операции (импорт или экспорт)
+
+    :param path_values: путь к файлам для TRADE_VALUE
+
+    :param path_quantities: путь к файлам для Quantities
+
+    :param flag_and_in_reporter_name: в имени репортера есть and (Antigua_and_Barbuda)
+
+    :param dct_itc_and_test_name: название страны для мержа -> название в ITC
+
+    :return: словарь со странами, которые мы не скачали, если такие есть
+    """
+    dct_error_country = {'type_flow': type_flow, 'reporter_name': '', 'list_partner': []}
+
+    # Файлы могут лежать во вложенных папках, поэтому сравниваем только имена файлов
+    quantities = {Path(name).name for name in Download_index(path_quantities, recursive=True).names('Tra*.txt')}
+    for file_name in (Path(name).name for name in Download_index(path_values, recursive=True).names('Tra*.txt')):
+        if file_name in quantities:
+            continue
+        reporter, partner = split_file_name(file_name, flag_and_in_reporter_name)
+        # Заполняем словарь не докаченных файлов
+        dct_error_country['reporter_name'] = dct_itc_and_test_name[reporter]
+        if dct_itc_and_test_name[partner] not in dct_error_country['list_partner']:
+            dct_error_country['list_partner'].append(dct_itc_and_test_name[partner])
+        print(f"{file_name} отсутствуют")
+    return dct_error_country
+
+
+def read_quantity_file(full_path_file, reporter: str, partner: str, need_codes: list,
+                       mirror_years: list) -> typing.Optional[pd.DataFrame]:
+    """
+    Очищенный датафрейм Quantities одного файла
+
+    :param full_path_file: путь к файлу
+
+    :param reporter: репортер
+
+    :param partner: партнер
+
+    :param need_codes: коды ТНВЭД на 6 знаках
+
+    :param mirror_years: года с зеркальными данными, которые исключаются
+
+    :return: датафрейм в формате quantities_build или None, если в файле Values вместо Quantities
+    """
+    temp_df = pd.read_table(full_path_file, dtype={'Product code': 'str'})
+
+    # Если был скачен не тот файл (value вместо quantities)
+    if len([i for i in temp_df.columns.tolist() if '-Value in ' in i]) > 0:
+        return None
+
+    # Считаем нужное кол-во столбцов (максимальный и минимальный года)
+    years = [int(i.split(' in ')[-1]) for i in temp_df.columns.tolist() if ' in ' in i]
+    need_max_year, need_min_year = max(years), min(years)
+    temp_number_columns = None
+    for temp, column in enumerate(temp_df.columns):
+        if f'-Quantity in {need_max_year}' in column:
+            temp_number_columns = temp + 2
+            break
+
+    if partner == 'World':
+        temp_df = temp_df.drop(columns=list(temp_df.iloc[:, 2:28].columns)).iloc[:, 0:26]
+    else:
+        temp_df = temp_df.iloc[:, 0:temp_number_columns]
+
+    # Расплавляем датасет
+    temp_df = temp_df.melt(id_vars=['Product code', 'Product label'])
+    temp_df.rename(columns=rep_3, inplace=True)
+
+    # Отсекаем не нужное
+    temp_df.fillna(0, inplace=True)
+    temp_df = temp_df[(temp_df['value'] != 0) & (temp_df['Product_code'] != "TOTAL")]
+    temp_df = filter_need_codes(temp_df, need_codes)
+
+    temp_df = temp_df.assign(reporter_country=reporter, partner_country=partner)
+
+    # Создаем два датасета, первый для названия измерений, второй для самих измерений
+    temp_df['bool_unit'] = map_unique(temp_df.variable, lambda x: '-Unit' in x)
+    temp_df['bool_quantity'] = map_unique(temp_df.variable, lambda x: '-Unit' not in x)
+    df_unit_tmp = temp_df.loc[temp_df.bool_unit]
+    df_quantity_tmp = temp_df.loc[temp_df.bool_quantity]
+
+    # Формируем лист из "якорей" для опеределения года в датасете с названиями измерений
+    list_unit_from_key = []
+    for variable in list(df_unit_tmp.variable.unique()):
+        if variable.split('-U')[1] not in list_unit_from_key:
+            list_unit_from_key.append(variable.split('-U')[1])
+    # Формируем словарь для последующего преобразования
+    dict_unit = {}
+    for j in list_unit_from_key:
+        if j not in dict_unit:
+            value_sum = int(j.split('.')[1]) if len(j.split('.')) > 1 else 0
+            dict_unit[j] = str(value_sum + need_min_year)
+
+    # Чистим и преобразуем датафрейм с названиями измерений к дальнейшему мержу
+    df_unit_tmp['year_transaction'] = map_unique(df_unit_tmp.variable, lambda x: dict_unit[str(x).split('-U')[1]])
+    df_unit_tmp = df_unit_tmp.query('year_transaction not in @mirror_years')
+    df_unit_tmp.rename(columns={'value': 'units_value'}, inplace=True)
+    df_unit_tmp = df_unit_tmp[['Product_code', 'Product_label', 'units_value', 'reporter_country',
+                               'partner_country', 'year_transaction']]
+
+    # Чистим и преобразуем датафрейм с измерениями к дальнейшему мержу
+    df_quantity_tmp.rename(columns={'variable': 'year_transaction'}, inplace=True)
+    df_quantity_tmp['year_transaction'] = map_unique(df_quantity_tmp.year_transaction, header_year)
+    df_quantity_tmp = df_quantity_tmp.query('year_transaction not in @mirror_years')
+
+    # Мержим датасеты
+    return df_quantity_tmp.merge(df_unit_tmp, on=['Product_code', 'year_transaction', 'reporter_country',
+                                                  'partner_country'], how='left')
+
+
+def _quantity_task(full_path_file) -> typing.Optional[pd.DataFrame]:
+    """
+    Разбор одного файла Quantities в процессе пула
+
+    :param full_path_file: путь к файлу
+
+    :return: датафрейм файла или None, если в файле Values вместо Quantities
+    """
+    reporter, partner = split_file_name(full_path_file, _lookups['flag_and_in_reporter_name'])
+    return read_quantity_file(full_path_file, reporter, partner, _lookups['need_codes'],
+                              _lookups['mirror_data'].get(reporter, []))
+
+
+@report_resources
+def quantities_build(type_operation: str, path_values: str, path_quantities: str, flag_and_in_reporter_name: bool,
+                     need_codes: list, dct_itc_and_test_name: dict,
+                     mirror_data: typing.Optional[dict] = None, num_workers: typing.Optional[int] = 1) -> pd.DataFrame:
+    """
+    Собирает все файлы в один датафрейм для переданного направления торговли по переданному пути.
+    Файлы с Values вместо Quantities удаляются и вместе с не скачанными партнерами пишутся
+    в {type_operation}_error_itc.json для повторной загрузки
+
+    :param type_operation: тип операции (импорт или экспорт)
+
+    :param path_values: путь к файлам для TRADE_VALUE
+
+    :param path_quantities: путь к файлам для Quantities
+
+    :param flag_and_in_reporter_name: в имени репортера есть and (Antigua_and_Barbuda)
+
+    :param need_codes: коды ТНВЭД на 6 знаках (dict_need_tnved_code_apk['code_6'])
+
+    :param dct_itc_and_test_name: название страны для мержа -> название в ITC
+
+    :param mirror_data: репортер -> года с зеркальными данными
+
+    :param num_workers: количество процессов разбора файлов (1 - последовательно)
+
+    :return: очищенный датафрейм с данными по Quantities
+    """
+    mirror_data = mirror_data or {}
+    # Индекс скачанных файлов Quantities
+    quantities_index = Download_index(path_quantities, recursive=True)
+    dct_error = check_not_download_file(type_operation, path_values, path_quantities, flag_and_in_reporter_name,
+                                        dct_itc_and_test_name)
+
+    def iter_frames():
+        names = quantities_index.names('Tra*.txt')
+        paths = [Path(path_quantities, name) for name in names]
+        lookups = {'flag_and_in_reporter_name': flag_and_in_reporter_name, 'need_codes': set(need_codes),
+                   'mirror_data': mirror_data}
+        for name, full_path_file, temp_df in zip(names, paths,
+                                                  map_files(_quantity_task, paths, lookups, num_workers)):
+            if temp_df is None:
+                _, partner = split_file_name(full_path_file, flag_and_in_reporter_name)
+                # Фиксируем партнера в словаре ошибок для дальнейшей обработки
+                print(f'Ошибка в партнере: {partner}')
+                if dct_itc_and_test_name[partner] not in dct_error['list_partner']:
+                    dct_error['list_partner'].append(dct_itc_and_test_name[partner])
+                print(f"Удаляем {full_path_file}")
+                quantities_index.remove(name)
+                continue
+            yield temp_df
+
+    void_df_quantities = concat_frames(iter_frames())
+    quantities_index.save()
+
+    # Сохраняем ошибки в файл
+    with open(f'{type_operation}_error_itc.json', 'w', encoding='utf-8') as file_json:
+        json.dump(dct_error, file_json, indent=4, ensure_ascii=False)
+    return void_df_quantities
+
@@ -1,6 +1,7 @@
 import json
 from class_parser import ITC_parser
-from config import conf_dict
+from worker_pool import ITC_worker_pool
+from config import conf_dict, nvpm_conf
 from logger_file import logger
 import os
 from dotenv import load_dotenv
@@ -25,39 +26,94 @@ if __name__ == '__main__':
     # Exports_error_itc.json - для ошибок в экспорте
     file_fixe_name = 'Imports_error_itc.json'
 
-    parser_ex = ITC_parser(dict_html_elements=conf_dict,
-                           url_trade_map='https://www.trademap.org/Product_SelCountry_TS.aspx?nvpm=1%7c004%7c%7c%7c%7c%7c122076%7c%7c2%7c1%7c1%7c1%7c2%7c1%7c1%7c1%7c1%7c1',
-                           castom_logger=logger('itc_parser_log').create_logger(),
-                           chat_id_user=os.getenv(''),
-                           bot_token=os.getenv(''),
-                           dict_postgres_cred=dict_postgres_cred,
-                           patern_file=os.getenv('PATERN_FILE' if variant_parser == 'not_tariff' else 'PATERN_FILE_TARIFF_LINE'),
-                           proxy="")
+    # Количество одновременно работающих браузеров (1 - последовательный запуск как раньше)
+    num_workers = 1
+
+    # True - браузер только логинится и проходит капчу, файлы выгружаются напрямую по HTTP
+    flag_http_export = False
+
+    # Сколько партнеров выгружать по HTTP одновременно (только при flag_http_export = True)
+    http_max_workers = 4
+
+    # Сколько загрузок может идти одновременно (1 - ждать каждый файл перед переходом к следующему партнеру)
+    max_pending_downloads = 1
+
+    # Папка для сохраненной сессии ITC (профиль Chrome и куки): после перезапуска логин и капча не нужны,
+    # пока сервер принимает сессию. None - логин и капча в каждом новом браузере
+    session_dir = None
+
+    # True - страницы задач открываются ссылкой, собранной по nvpm_conf (позиции полей подобраны по ссылкам сайта,
+    # выбранные страницей опции сверяются, при расхождении парсер возвращается к выпадающим спискам)
+    flag_nvpm_url = False
+
+    # True - браузер без окна, шрифты, картинки и счетчики не загружаются (капча пропускается всегда)
+    flag_lean = False
+
+    def create_parser(worker_id: int = 0) -> ITC_parser:
+        return ITC_parser(dict_html_elements=conf_dict,
+                          url_trade_map='https://www.trademap.org/Product_SelCountry_TS.aspx?nvpm=1%7c004%7c%7c%7c%7c%7c122076%7c%7c2%7c1%7c1%7c1%7c2%7c1%7c1%7c1%7c1%7c1',
+                          castom_logger=logger('itc_parser_log' if worker_id == 0
+                                               else f'itc_parser_log_{worker_id}').create_logger(),
+                          chat_id_user=os.getenv(''),
+                          bot_token=os.getenv(''),
+                          dict_postgres_cred=dict_postgres_cred,
+                          patern_file=os.getenv('PATERN_FILE' if variant_parser == 'not_tariff' else 'PATERN_FILE_TARIFF_LINE'),
+                          proxy="",
+                          worker_id=worker_id,
+                          flag_http_export=flag_http_export,
+                          flag_lean=flag_lean,
+                          nvpm_conf=nvpm_conf if flag_nvpm_url else None,
+                          max_pending_downloads=max_pending_downloads,
+                          session_dir=session_dir,
+                          http_max_workers=http_max_workers)
 
     # 'Imports', 'Exports'
+    # 'Imports_Exports' - оба направления за один проход по партнерам (для Values и Values_Quantities на 6 знаках)
     # 'Values', 'Quantities'
+    # 'Values_Quantities' - Values и Quantities каждого партнера за одно посещение страницы (только для 6 знаков)
     # ["", "", "", "", ""]
     input_user_text = input("""Чтобы скачать Product cluster at 6 digits введите "6"\nЧтобы скачать Products at the tariff line введите "8"\nЧтобы исправить ошибки допущенные при скачивании введите "0":""", )
     if input_user_text == '6':
-        for reporter_name in ["Argentina", "Austria", "Bulgaria", "Brunei Darussalam", "Honduras"]:
-            for type_flow in ['Imports', 'Exports']:
-                for qty_or_value in ['Values', 'Quantities']:
-                    parser_ex.main(reporter_name=reporter_name, type_flow=type_flow, qty_or_value=qty_or_value)
+        if num_workers > 1:
+            pool = ITC_worker_pool(create_parser, num_workers, logger('itc_pool_log').create_logger())
+            pool.run(pool.build_chains(["Argentina", "Austria", "Bulgaria", "Brunei Darussalam", "Honduras"],
+                                       ['Imports', 'Exports'], ['Values', 'Quantities']))
+        else:
+            parser_ex = create_parser()
+            try:
+                for reporter_name in ["Argentina", "Austria", "Bulgaria", "Brunei Darussalam", "Honduras"]:
+                    for type_flow in ['Imports', 'Exports']:
+                        for qty_or_value in ['Values', 'Quantities']:
+                            parser_ex.main(reporter_name=reporter_name, type_flow=type_flow, qty_or_value=qty_or_value)
+            finally:
+                parser_ex.close_session()
 
     elif input_user_text == '8':
-        for reporter_name in []:
-            for type_flow in ['Imports', 'Exports']:
-                for qty_or_value in ['Values']:
-                    parser_ex.main(reporter_name=reporter_name, type_flow=type_flow, qty_or_value=qty_or_value,
-                                   product_cluster=variant_parser)
+        if num_workers > 1:
+            pool = ITC_worker_pool(create_parser, num_workers, logger('itc_pool_log').create_logger())
+            pool.run(pool.build_chains([], ['Imports', 'Exports'], ['Values'], product_cluster=variant_parser))
+        else:
+            parser_ex = create_parser()
+            try:
+                for reporter_name in []:
+                    for type_flow in ['Imports', 'Exports']:
+                        for qty_or_value in ['Values']:
+                            parser_ex.main(reporter_name=reporter_name, type_flow=type_flow, qty_or_value=qty_or_value,
+                                           product_cluster=variant_parser)
+            finally:
+                parser_ex.close_session()
     elif input_user_text == '0':
+        parser_ex = create_parser()
         with open(file_fixe_name, encoding='utf-8') as file:
             dict_error = json.load(file)
 
-        parser_ex.main(reporter_name=dict_error['reporter_name'], type_flow=dict_error['type_flow'],
-                       qty_or_value='Quantities',
-                       product_cluster='not_tariff',
-                       partner_list=dict_error['list_partner'])
+        try:
+            parser_ex.main(reporter_name=dict_error['reporter_name'], type_flow=dict_error['type_flow'],
+                           qty_or_value='Quantities',
+                           product_cluster='not_tariff',
+                           partner_list=dict_error['list_partner'])
+        finally:
+            parser_ex.close_session()
 
 
 
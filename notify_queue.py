@@ -0,0 +1,161 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+import typing
+from concurrent.futures import Future
+import telebot
+from telebot import apihelper
+
+
+class ITC_notify_queue:
+
+    # Капча отправляется вне очереди, остальные сообщения по порядку
+    priority_photo = 0
+    priority_message = 1
+
+    def __init__(self, bot_token: str, castom_logger: logging.Logger,
+                 min_interval: typing.Optional[float] = 1.0, retries: typing.Optional[int] = 5,
+                 api_url: typing.Optional[str] = None):
+        """
+        Очередь уведомлений в Telegram с отправкой из фонового потока. Поток парсинга только кладет
+        сообщение в очередь, повторы, ожидание retry_after при ответе 429 и ограничение частоты
+        (не чаще одного сообщения в min_interval секунд в один чат) выполняются в фоне
+
+        :param bot_token: токен бота
+
+        :param castom_logger: экзепляр класса logging для записи логов в файл
+
+        :param min_interval: минимальный интервал между сообщениями в один чат (секунды)
+
+        :param retries: сколько раз повторять отправку при ошибке
+
+        :param api_url: адрес API в формате telebot (https://host/bot{0}/{1}), например локальный тестовый сервер
+        """
+        if api_url:
+            apihelper.API_URL = api_url
+        self.bot = telebot.TeleBot(bot_token)
+        self.castom_logger = castom_logger
+        self.min_interval = min_interval
+        self.retries = retries
+        self._queue = queue.PriorityQueue()
+        # Номер сообщения сохраняет порядок внутри одного приоритета
+        self._counter = itertools.count()
+        # ключ -> еще не отправленное сообщение, повторное сообщение с тем же ключом заменяет текст
+        self._pending_keys = {}
+        self._lock = threading.Lock()
+        self._last_sent = {}
+        self._sender = threading.Thread(target=self._sender_loop, name='telegram_sender', daemon=True)
+        self._sender.start()
+
+    def send_message(self, chat_id: str, text: str, key: typing.Optional[str] = None, **kwargs):
+        """
+        Кладет сообщение в очередь и сразу возвращает управление
+
+        :param chat_id: id чата
+
+        :param text: текст сообщения
+
+        :param key: ключ склейки: пока сообщение с таким ключом не отправлено, новое его заменяет
+
+        :param kwargs: параметры send_message telebot (например, parse_mode)
+
+        :return:
+        """
+        item = {'method': 'send_message', 'chat_id': chat_id, 'args': (text,), 'kwargs': kwargs,
+                'key': key, 'future': None}
+        with self._lock:
+            if key is not None and key in self._pending_keys:
+                self._pending_keys[key].update(item)
+                return
+            if key is not None:
+                self._pending_keys[key] = item
+        self._queue.put((self.priority_message, next(self._counter), item))
+
+    def send_photo(self, chat_id: str, photo: bytes, **kwargs) -> Future:
+        """
+        Отправляет картинку вне очереди
+
+        :param chat_id: id чата
+
+        :param photo: содержимое картинки
+
+        :param kwargs: параметры send_photo telebot (например, caption)
+
+        :return: Future с отправленным сообщением (нужен file_id картинки). Если Future отменен до начала
+                 отправки, картинка не отправляется
+        """
+        future = Future()
+        item = {'method': 'send_photo', 'chat_id': chat_id, 'args': (photo,), 'kwargs': kwargs,
+                'key': None, 'future': future}
+        self._queue.put((self.priority_photo, next(self._counter), item))
+        return future
+
+    def _wait_rate_limit(self, chat_id: str):
+        pause = self._last_sent.get(chat_id, 0) + self.min_interval - time.time()
+        if pause > 0:
+            time.sleep(pause)
+
+    def _send(self, item: dict):
+        """
+        Отправляет одно сообщение с повторами
+
+        :param item: сообщение из очереди
+
+        :return: ответ telebot
+        """
+        for attempt in range(1, self.retries + 1):
+            self._wait_rate_limit(item['chat_id'])
+            try:
+                return getattr(self.bot, item['method'])(item['chat_id'], *item['args'], **item['kwargs'])
+            except apihelper.ApiTelegramException as e:
+                if e.error_code != 429 and e.error_code < 500 or attempt == self.retries:
+                    raise
+                # Telegram сообщает, сколько ждать до следующего запроса
+                pause = (e.result_json or {}).get('parameters', {}).get('retry_after', 2 ** attempt)
+                self.castom_logger.info(f'TELEGRAM ОГРАНИЧИЛ ОТПРАВКУ, ЖДЕМ {pause} секунд')
+                time.sleep(pause)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                self.castom_logger.info(f'ОШИБКА ОТПРАВКИ В TELEGRAM ({attempt}/{self.retries}) {e}')
+                time.sleep(min(2 ** attempt, 30))
+            finally:
+                self._last_sent[item['chat_id']] = time.time()
+
+    def _sender_loop(self):
+        while True:
+            _, _, item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            with self._lock:
+                if item['key'] is not None:
+                    self._pending_keys.pop(item['key'], None)
+            # Отправитель перестал ждать (например, капча уже устарела)
+            if item['future'] is not None and not item['future'].set_running_or_notify_cancel():
+                self._queue.task_done()
+                continue
+            try:
+                result = self._send(item)
+                if item['future'] is not None:
+                    item['future'].set_result(result)
+            except Exception as e:
+                self.castom_logger.info(f'СООБЩЕНИЕ НЕ ОТПРАВЛЕНО {e}')
+                if item['future'] is not None:
+                    item['future'].set_exception(e)
+            finally:
+                self._queue.task_done()
+
+    def close(self, timeout: typing.Optional[float] = 60):
+        """
+        Дожидается отправки сообщений из очереди и останавливает фоновый поток
+
+        :param timeout: максимальное время ожидания в секундах
+
+        :return:
+        """
+        # Стоп-сигнал с наименьшим приоритетом, поэтому все сообщения до него будут отправлены
+        self._queue.put((self.priority_message + 1, next(self._counter), None))
+        self._sender.join(timeout)
@@ -0,0 +1,59 @@
+import typing
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, quote
+
+
+class ITC_url_builder:
+
+    def __init__(self, url_trade_map: str, nvpm_conf: dict):
+        """
+        Сборка ссылки Product_SelCountry_TS.aspx с нужными опциями в параметре nvpm,
+        чтобы страница с нужной таблицей открывалась одним GET запросом без постбэков выпадающих списков
+
+        :param url_trade_map: базовая ссылка, из нее берутся поля nvpm, которые не меняются
+
+        :param nvpm_conf: позиции полей nvpm и коды опций (nvpm_conf из config.py)
+        """
+        self.url_parts = urlsplit(url_trade_map)
+        query = dict(parse_qsl(self.url_parts.query, keep_blank_values=True))
+        self.base_fields = query.get('nvpm', '').split('|')
+        self.positions = nvpm_conf['positions']
+        self.values = nvpm_conf['values']
+
+    def build(self, reporter_code: typing.Optional[str] = None, partner_code: typing.Optional[str] = None,
+              type_flow: typing.Optional[str] = None, measure_type: typing.Optional[str] = None,
+              product_cluster_level_text: typing.Optional[str] = None,
+              currency: typing.Optional[str] = 'USD') -> str:
+        """
+        :param reporter_code: код репортера (value опции в списке репортеров)
+
+        :param partner_code: код партнера (value опции в списке партнеров)
+
+        :param type_flow: направление торговли 'Imports' или 'Exports'
+
+        :param measure_type: 'Values' или 'Quantities'
+
+        :param product_cluster_level_text: текст опции уровня продуктов
+
+        :param currency: валюта (только для Values)
+
+        :return: ссылка на страницу; опции, которые не переданы или не описаны в nvpm_conf, остаются как в базовой ссылке
+        """
+        options = {'reporter': reporter_code,
+                   'partner': partner_code,
+                   'product_cluster_level': self.values['product_cluster_level'].get(product_cluster_level_text),
+                   'trade_type': self.values['trade_type'].get(type_flow),
+                   'ts_indicator': self.values['ts_indicator'].get(measure_type),
+                   'ts_currency': self.values['ts_currency'].get(currency) if measure_type != 'Quantities' else None}
+        fields = list(self.base_fields)
+        for option, value in options.items():
+            if value is None or option not in self.positions:
+                continue
+            position = self.positions[option]
+            if position >= len(fields):
+                fields.extend([''] * (position - len(fields) + 1))
+            fields[position] = value
+        query = [(key, value) for key, value in parse_qsl(self.url_parts.query, keep_blank_values=True)
+                 if key != 'nvpm']
+        query.append(('nvpm', '|'.join(fields)))
+        query_string = '&'.join(f'{key}={quote(value, safe="")}' for key, value in query)
+        return urlunsplit((self.url_parts.scheme, self.url_parts.netloc, self.url_parts.path, query_string, ''))
@@ -0,0 +1,67 @@
+import json
+import os
+import threading
+import typing
+from datetime import date, timedelta
+
+# Каталог общий для всех воркеров пула
+catalogue_lock = threading.Lock()
+
+
+class Partner_catalogue:
+
+    # Под этим ключом хранится список репортеров [название, value опции] для сборки ссылок nvpm
+    reporters_key = '_reporters'
+
+    def __init__(self, file: typing.Optional[str] = 'partner_catalogue.json',
+                 max_age_days: typing.Optional[int] = 7):
+        """
+        Сохраненный список партнеров каждого репортера. Версия списка - дата, когда он был снят со страницы,
+        по истечении max_age_days список снимается заново
+
+        :param file: json файл каталога
+
+        :param max_age_days: сколько дней список партнеров считается актуальным
+        """
+        self.file = file
+        self.max_age_days = max_age_days
+
+    def _load(self) -> dict:
+        if not os.path.isfile(self.file):
+            return {}
+        with open(self.file, encoding='utf-8') as fl:
+            return json.load(fl)
+
+    def get(self, reporter_name: str) -> typing.Optional[list]:
+        """
+        :param reporter_name: имя репортера
+
+        :return: список пар [название партнера, value опции] или None, если списка нет или он устарел
+        """
+        with catalogue_lock:
+            catalogue = self._load()
+        if reporter_name not in catalogue:
+            return None
+        version = date.fromisoformat(catalogue[reporter_name]['version'])
+        if date.today() - version > timedelta(days=self.max_age_days):
+            return None
+        return catalogue[reporter_name]['partners']
+
+    def save(self, reporter_name: str, partners: list):
+        """
+        Сохраняет список партнеров репортера с сегодняшней версией
+
+        :param reporter_name: имя репортера
+
+        :param partners: список пар [название партнера, value опции]
+
+        :return:
+        """
+        with catalogue_lock:
+            catalogue = self._load()
+            catalogue[reporter_name] = {'version': date.today().isoformat(),
+                                        'partners': [list(partner) for partner in partners]}
+            # Пишем во временный файл и подменяем, чтобы падение во время записи не испортило каталог
+            with open(self.file + '.tmp', 'w', encoding='utf-8') as fl:
+                json.dump(catalogue, fl, indent=4, ensure_ascii=False)
+            os.replace(self.file + '.tmp', self.file)
@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import typing
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+# Воркеры пула - потоки одного процесса, файл куки учетной записи у них общий: чтение, изменение и запись
+# выполняются под одной блокировкой, иначе воркеры затирают изменения друг друга
+_cookie_file_lock = threading.Lock()
+
+
+class ITC_session_store:
+
+    def __init__(self, session_dir: str, account: str, worker_id: int, castom_logger: logging.Logger):
+        """
+        Сохраненная авторизованная сессия учетной записи ITC: профиль Chrome (user-data-dir) воркера
+        и куки учетной записи. После перезапуска парсер сначала пробует эту сессию и только если сервер
+        ее не принял проходит логин и капчу. Возраст сессии и доля удачных восстановлений пишутся в лог
+
+        :param session_dir: папка для профилей и куки
+
+        :param account: логин учетной записи ITC
+
+        :param worker_id: номер воркера (профиль Chrome нельзя открыть двумя браузерами одновременно)
+
+        :param castom_logger: экзепляр класса logging для записи логов в файл
+        """
+        account_dir = os.path.join(session_dir, re.sub(r'[^\w.-]', '_', account or 'default'))
+        os.makedirs(account_dir, exist_ok=True)
+        self.profile_dir = os.path.abspath(os.path.join(account_dir, f'profile_{worker_id}'))
+        self.cookie_file = os.path.join(account_dir, 'cookies.json')
+        self.castom_logger = castom_logger
+
+    def _load(self) -> dict:
+        if not os.path.isfile(self.cookie_file):
+            return {'created_at': None, 'cookies': [], 'attempts': 0, 'hits': 0}
+        with open(self.cookie_file, encoding='utf-8') as fl:
+            return json.load(fl)
+
+    def _write(self, data: dict):
+        # Файл общий для воркеров одной учетной записи, подменяем целиком (у потоков одного процесса свой временный файл)
+        temp_file = f'{self.cookie_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as fl:
+            json.dump(data, fl, indent=4, ensure_ascii=False)
+        os.replace(temp_file, self.cookie_file)
+
+    def restore_cookies(self, browser: webdriver) -> bool:
+        """
+        Кладет сохраненные куки в браузер через DevTools (открывать страницу сайта заранее не нужно)
+
+        :param browser: экземпляр webdriver
+
+        :return: True если были сохраненные куки
+        """
+        with _cookie_file_lock:
+            data = self._load()
+        if not data['cookies']:
+            return False
+        cookies = []
+        for cookie in data['cookies']:
+            cookie = dict(cookie)
+            # Selenium называет срок жизни expiry, DevTools - expires
+            if 'expiry' in cookie:
+                cookie['expires'] = cookie.pop('expiry')
+            cookies.append(cookie)
+        try:
+            browser.execute_cdp_cmd('Network.setCookies', {'cookies': cookies})
+        except WebDriverException as e:
+            self.castom_logger.info(f'НЕ УДАЛОСЬ ВОССТАНОВИТЬ КУКИ {e}')
+            return False
+        return True
+
+    def save_cookies(self, browser: webdriver, flag_new_session: typing.Optional[bool] = False):
+        """
+        Сохраняет куки авторизованного браузера
+
+        :param browser: экземпляр webdriver с пройденными логином и капчей
+
+        :param flag_new_session: сессия только что получена через логин (обнуляет возраст сессии)
+
+        :return:
+        """
+        cookies = browser.get_cookies()
+        with _cookie_file_lock:
+            data = self._load()
+            data['cookies'] = cookies
+            if flag_new_session or data['created_at'] is None:
+                data['created_at'] = time.time()
+            self._write(data)
+
+    def record_reuse(self, flag_hit: bool):
+        """
+        Учитывает попытку восстановления сессии и пишет в лог возраст сессии и долю удачных попыток
+
+        :param flag_hit: сервер принял сохраненную сессию
+
+        :return:
+        """
+        with _cookie_file_lock:
+            data = self._load()
+            data['attempts'] += 1
+            data['hits'] += int(flag_hit)
+            self._write(data)
+        age = f"""{(time.time() - data['created_at']) / 3600:.1f} ч""" if data['created_at'] else 'неизвестен'
+        self.castom_logger.info(f"""{'СЕССИЯ ВОССТАНОВЛЕНА' if flag_hit else 'СОХРАНЕННАЯ СЕССИЯ НЕ ПРИНЯТА'}. """
+                                f"""ВОЗРАСТ СЕССИИ {age}, УДАЧНЫХ ВОССТАНОВЛЕНИЙ {data['hits']} ИЗ {data['attempts']}""")
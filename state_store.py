@@ -0,0 +1,203 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+
+class ITC_state_store:
+
+    def __init__(self, db_file: typing.Optional[str] = 'itc_state.sqlite',
+                 batch_size: typing.Optional[int] = 20, flush_interval: typing.Optional[int] = 30,
+                 flow_list: typing.Optional[list] = None):
+        """
+        Хранилище состояния парсинга в SQLite (режим WAL) вместо перезаписи json файлов на каждого партнера.
+        Изменения копятся в памяти и записываются одной транзакцией на batch_size операций,
+        а накопленное меньше batch_size фоновый поток записывает раз в flush_interval секунд. json файлы остаются как выгрузка для ноутбуков (export_json)
+
+        :param db_file: файл базы SQLite
+
+        :param batch_size: сколько изменений копить до записи
+
+        :param flush_interval: максимальное время в секундах между записями
+
+        :param flow_list: направления торговли, для которых ведутся файлы {type_flow}_res.json
+        """
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flow_list = flow_list or ['Imports', 'Exports']
+        self._pending = []
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.conn = sqlite3.connect(db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS partner_result (reporter TEXT NOT NULL,
+                                                       flow TEXT NOT NULL,
+                                                       partner TEXT NOT NULL,
+                                                       PRIMARY KEY (reporter, flow, partner));
+            CREATE TABLE IF NOT EXISTS mirror_year (reporter TEXT NOT NULL,
+                                                    year TEXT NOT NULL,
+                                                    PRIMARY KEY (reporter, year));
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._import_json()
+        # Без новых изменений проверка интервала в _queue не срабатывает, поэтому остаток пишет фоновый поток
+        self._flusher = threading.Thread(target=self._flusher_loop, name='state_store_flusher', daemon=True)
+        self._flusher.start()
+
+    def _import_json(self):
+        """
+        Однократный перенос уже накопленных json файлов в базу
+
+        :return:
+        """
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+            return
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            for type_flow in self.flow_list:
+                for reporter, partners in self._read_json(f'{type_flow}_res.json').items():
+                    self.conn.executemany('INSERT OR IGNORE INTO partner_result VALUES (?, ?, ?)',
+                                          [(reporter, type_flow, partner) for partner in partners])
+            for reporter, years in self._read_json('json_mirror_data.json').items():
+                self.conn.executemany('INSERT OR IGNORE INTO mirror_year VALUES (?, ?)',
+                                      [(reporter, year) for year in years])
+            self.conn.execute("INSERT OR IGNORE INTO meta VALUES ('json_imported', '1')")
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _read_json(file: str) -> dict:
+        if not os.path.isfile(file):
+            return {}
+        with open(file, encoding='utf-8') as fl:
+            return json.load(fl)
+
+    def _queue(self, query: str, params: tuple):
+        """
+        Откладывает изменение до ближайшей записи
+
+        :param query: SQL запрос
+
+        :param params: параметры запроса
+
+        :return:
+        """
+        with self._lock:
+            self._pending.append((query, params))
+            flag_flush = len(self._pending) >= self.batch_size or time.time() - self._last_flush > self.flush_interval
+        if flag_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Записывает накопленные изменения одной транзакцией в исходном порядке
+
+        :return:
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.time()
+            if not pending:
+                return
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for query, params in pending:
+                    self.conn.execute(query, params)
+                self.conn.execute('COMMIT')
+            except Exception:
+                self.conn.execute('ROLLBACK')
+                self._pending = pending + self._pending
+                raise
+
+    def _flusher_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                # Изменения вернулись в очередь, повторим на следующем интервале
+                continue
+
+    def add_partner(self, reporter_name: str, type_flow: str, partner: str):
+        self._queue('INSERT OR IGNORE INTO partner_result VALUES (?, ?, ?)', (reporter_name, type_flow, partner))
+
+    def remove_partner(self, reporter_name: str, type_flow: str, partner: str):
+        self._queue('DELETE FROM partner_result WHERE reporter = ? AND flow = ? AND partner = ?',
+                    (reporter_name, type_flow, partner))
+
+    def get_partners(self, reporter_name: str, type_flow: str) -> list:
+        """
+        :param reporter_name: имя репортера
+
+        :param type_flow: направление торговли
+
+        :return: партнеры с данными в порядке добавления (аналог {type_flow}_res.json[reporter_name])
+        """
+        self.flush()
+        # Подключение общее с фоновым потоком записи, поэтому чтение тоже под блокировкой
+        with self._lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT partner FROM partner_result WHERE reporter = ? AND flow = ? ORDER BY rowid',
+                (reporter_name, type_flow))]
+
+    def add_mirror_year(self, reporter_name: str, year: str):
+        self._queue('INSERT OR IGNORE INTO mirror_year VALUES (?, ?)', (reporter_name, year))
+
+    def remove_mirror_year(self, reporter_name: str, year: str):
+        self._queue('DELETE FROM mirror_year WHERE reporter = ? AND year = ?', (reporter_name, year))
+
+    def get_mirror_years(self, reporter_name: str) -> list:
+        """
+        :param reporter_name: имя репортера
+
+        :return: года с зеркальными данными
+        """
+        self.flush()
+        with self._lock:
+            return [row[0] for row in self.conn.execute(
+                'SELECT year FROM mirror_year WHERE reporter = ? ORDER BY rowid', (reporter_name,))]
+
+    @staticmethod
+    def _write_json(file: str, js_dict: dict):
+        # Пишем во временный файл и подменяем, чтобы ноутбук никогда не прочитал файл наполовину
+        temp_file = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as fl:
+            json.dump(js_dict, fl, indent=4, ensure_ascii=False)
+        os.replace(temp_file, file)
+
+    def export_json(self):
+        """
+        Выгружает состояние в прежние json файлы ({type_flow}_res.json и json_mirror_data.json)
+
+        :return:
+        """
+        self.flush()
+        # Сначала читаем все под блокировкой, файлы пишем уже без нее
+        with self._lock:
+            dict_flow = {}
+            for type_flow in self.flow_list:
+                js_dict = {}
+                for reporter, partner in self.conn.execute(
+                        'SELECT reporter, partner FROM partner_result WHERE flow = ? ORDER BY rowid', (type_flow,)):
+                    js_dict.setdefault(reporter, []).append(partner)
+                dict_flow[type_flow] = js_dict
+
+            js_mirror = {}
+            for reporter, year in self.conn.execute('SELECT reporter, year FROM mirror_year ORDER BY rowid'):
+                js_mirror.setdefault(reporter, []).append(year)
+        for type_flow, js_dict in dict_flow.items():
+            self._write_json(f'{type_flow}_res.json', js_dict)
+        self._write_json('json_mirror_data.json', js_mirror)
+
+    def close(self):
+        self._stop.set()
+        self._flusher.join()
+        self.export_json()
+        self.conn.close()
@@ -0,0 +1,91 @@
+import json
+import logging
+import pytest
+
+pytest.importorskip('selenium')
+from browser_session import ITC_browser_session
+
+PAGE_URL = 'https://www.trademap.org/Country_SelProductCountry_TS.aspx?nvpm=1'
+LOGO_URL = 'https://www.trademap.org/logo.gif'
+FLAG_URL = 'https://www.trademap.org/flag.gif'
+SCRIPT_URL = 'https://www.trademap.org/script.js'
+ANALYTICS_URL = 'https://www.google-analytics.com/analytics.js'
+
+
+def request_events(request_id: str, url: str, size: int = 0, blocked: bool = False) -> list:
+    """
+    :return: события журнала performance одного запроса в том виде, в каком их отдает chromedriver
+    """
+    events = [{'method': 'Network.requestWillBeSent', 'params': {'requestId': request_id, 'request': {'url': url}}}]
+    if blocked:
+        events.append({'method': 'Network.loadingFailed',
+                       'params': {'requestId': request_id, 'blockedReason': 'inspector'}})
+    else:
+        events += [{'method': 'Network.responseReceived',
+                    'params': {'requestId': request_id, 'response': {'url': url}}},
+                   {'method': 'Network.loadingFinished',
+                    'params': {'requestId': request_id, 'encodedDataLength': size}}]
+    return events
+
+
+class _Switch_to:
+
+    def __init__(self, browser):
+        self.browser = browser
+
+    def new_window(self, type_hint):
+        self.browser.windows.append(f'tab {len(self.browser.windows)}')
+        self.browser.current_window_handle = self.browser.windows[-1]
+
+    def window(self, handle):
+        self.browser.current_window_handle = handle
+
+
+class _Fake_browser:
+
+    def __init__(self, logs: list):
+        # Каждый get_log отдает следующую порцию событий
+        self.logs = logs
+        self.windows = ['main']
+        self.current_window_handle = 'main'
+        self.current_url = PAGE_URL
+        self.switch_to = _Switch_to(self)
+        self.opened = []
+
+    def get_log(self, log_type):
+        events = self.logs.pop(0) if self.logs else []
+        return [{'message': json.dumps({'message': event})} for event in events]
+
+    def get(self, url):
+        self.opened.append((self.current_window_handle, url))
+
+    def close(self):
+        self.windows.remove(self.current_window_handle)
+
+
+def test_page_stats_estimates_saved_bytes_from_unblocked_tab():
+    session = ITC_browser_session('', logging.getLogger('test_browser_session'), flag_lean=True)
+    first_page = (request_events('1', PAGE_URL, 50000) + request_events('2', LOGO_URL, blocked=True)
+                  + request_events('3', ANALYTICS_URL, blocked=True))
+    unblocked_page = (request_events('10', PAGE_URL, 50000) + request_events('11', LOGO_URL, 3000)
+                      + request_events('12', ANALYTICS_URL, 1000) + request_events('13', SCRIPT_URL, 7000))
+    second_page = (request_events('20', PAGE_URL, 40000) + request_events('21', LOGO_URL, blocked=True)
+                   + request_events('22', FLAG_URL, blocked=True))
+    session.browser = _Fake_browser([first_page, unblocked_page, second_page])
+
+    assert session.page_stats() == {'requests': 1, 'bytes': 50000, 'saved_requests': 2, 'saved_bytes': 4000}
+    # Замер сделан в отдельной вкладке, она закрыта, основная вкладка снова текущая
+    assert session.browser.opened == [('tab 1', PAGE_URL)]
+    assert session.browser.windows == ['main'] and session.browser.current_window_handle == 'main'
+    # Незаблокированный script.js в замер не попадает
+    assert session.blocked_sizes == {LOGO_URL: 3000, ANALYTICS_URL: 1000}
+
+    # Замер не повторяется, для ресурса не из замера берется средний размер
+    assert session.page_stats() == {'requests': 1, 'bytes': 40000, 'saved_requests': 2, 'saved_bytes': 5000}
+    assert len(session.browser.opened) == 1
+
+
+def test_page_stats_without_lean_mode():
+    session = ITC_browser_session('', logging.getLogger('test_browser_session'))
+    session.browser = _Fake_browser([])
+    assert session.page_stats() is None
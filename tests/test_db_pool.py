@@ -0,0 +1,202 @@
+import logging
+import os
+import socket
+import threading
+import time
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+from db_pool import ITC_db
+
+# Тестовая база задается переменными TEST_*_PG (как в .env), без них тесты пропускаются.
+# Таблица ce создается тестом, поэтому база должна быть пустой
+TEST_PG_CRED = {'user': os.getenv('TEST_USER_NAME_PG'),
+                'password': os.getenv('TEST_PASSWORD_PG'),
+                'host': os.getenv('TEST_HOST_PG'),
+                'port': os.getenv('TEST_PORT_PG', '5432'),
+                'database': os.getenv('TEST_DATABASE_PG')}
+pytestmark = pytest.mark.skipif(not TEST_PG_CRED['host'], reason='TEST_HOST_PG не задан')
+
+CAPTCHA_CHANNEL = 'ce_captcha'
+
+
+def connect():
+    return psycopg2.connect(**TEST_PG_CRED)
+
+
+@pytest.fixture
+def db():
+    conn = connect()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('ce')")
+        if cur.fetchone()[0] is not None:
+            conn.close()
+            pytest.skip('в тестовой базе уже есть таблица ce')
+        cur.execute("""CREATE TABLE ce (chat_id text, worker_id integer NOT NULL DEFAULT 0,
+                                        captcha_flag boolean DEFAULT False, captcha_text text)""")
+        cur.execute("INSERT INTO ce (chat_id, worker_id) VALUES ('42', 0), ('42', 1)")
+    db = ITC_db(TEST_PG_CRED, logging.getLogger('test_db_pool'), flush_interval=0.1)
+    yield db
+    db.close()
+    with conn.cursor() as cur:
+        cur.execute('DROP TABLE ce')
+        cur.execute('DROP FUNCTION IF EXISTS ce_captcha_notify()')
+    conn.close()
+
+
+def set_captcha_flag(worker_id: int, delay: float) -> threading.Thread:
+    """
+    Обновляет флаг капчи из другого подключения, как это делает бот
+
+    :param worker_id: воркер, для которого введена капча
+
+    :param delay: через сколько секунд обновить флаг
+
+    :return: поток, который обновляет флаг
+    """
+    def update():
+        time.sleep(delay)
+        with connect() as conn, conn.cursor() as cur:
+            cur.execute("""UPDATE ce SET captcha_flag = True, captcha_text = 'abc'
+                           WHERE chat_id = '42' AND worker_id = %s""", (worker_id,))
+        conn.close()
+    thread = threading.Thread(target=update)
+    thread.start()
+    return thread
+
+
+def test_create_captcha_trigger_is_idempotent(db):
+    db.create_captcha_trigger(CAPTCHA_CHANNEL)
+    db.create_captcha_trigger(CAPTCHA_CHANNEL)
+    assert db.execute("""SELECT COUNT(*) FROM pg_trigger
+                         WHERE tgname = 'ce_captcha_notify' AND tgrelid = 'ce'::regclass""", None, fetch=True)[0] == 1
+
+
+def test_notify_wakes_waiting_worker(db):
+    db.create_captcha_trigger(CAPTCHA_CHANNEL)
+    db.listen(CAPTCHA_CHANNEL)
+    updater = set_captcha_flag(0, 0.5)
+    start_time = time.time()
+    assert db.wait_notify('42:0', 20)
+    # Воркер проснулся по уведомлению, а не по таймауту
+    assert time.time() - start_time < 10
+    updater.join()
+    assert db.execute('SELECT captcha_text FROM ce WHERE chat_id = %s AND worker_id = %s', ('42', 0),
+                      fetch=True)[0] == 'abc'
+
+
+def test_notify_for_other_worker_is_skipped(db):
+    db.create_captcha_trigger(CAPTCHA_CHANNEL)
+    db.listen(CAPTCHA_CHANNEL)
+    set_captcha_flag(1, 0).join()
+    assert not db.wait_notify('42:0', 1)
+
+
+class _Pg_proxy:
+
+    def __init__(self):
+        """
+        TCP прокси до тестовой базы. stop закрывает порт и все подключения, как при падении сервера,
+        start снова открывает тот же порт
+        """
+        host, port = TEST_PG_CRED['host'], int(TEST_PG_CRED['port'])
+        # Хост, начинающийся с /, - папка unix сокета, как у libpq
+        self.upstream = (socket.AF_UNIX, os.path.join(host, f'.s.PGSQL.{port}')) if host.startswith('/') \
+            else (socket.AF_INET, (host, port))
+        self.port = 0
+        self.sockets = []
+        self.listener = None
+        self.start()
+
+    def start(self):
+        self.listener = socket.socket()
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', self.port))
+        self.port = self.listener.getsockname()[1]
+        self.listener.listen()
+        threading.Thread(target=self._accept_loop, args=(self.listener,), daemon=True).start()
+
+    def stop(self):
+        # Без shutdown поток, ждущий в accept, продолжил бы принимать подключения
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.listener.close()
+        for sock in self.sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        self.sockets = []
+
+    def _accept_loop(self, listener):
+        while True:
+            try:
+                client, _ = listener.accept()
+            except OSError:
+                return
+            upstream = socket.socket(self.upstream[0])
+            upstream.connect(self.upstream[1])
+            self.sockets += [client, upstream]
+            threading.Thread(target=self._pump, args=(client, upstream), daemon=True).start()
+            threading.Thread(target=self._pump, args=(upstream, client), daemon=True).start()
+
+    @staticmethod
+    def _pump(source, target):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                target.sendall(data)
+        except OSError:
+            pass
+        for sock in (source, target):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def test_execute_retries_while_database_is_down():
+    proxy = _Pg_proxy()
+    db = ITC_db(dict(TEST_PG_CRED, host='127.0.0.1', port=proxy.port), logging.getLogger('test_db_pool'))
+    try:
+        assert db.execute('SELECT 1', None, fetch=True) == (1,)
+        # База недоступна дольше первой паузы (2 секунды): и старое подключение, и новое падают
+        proxy.stop()
+        restart = threading.Timer(3, proxy.start)
+        restart.start()
+        start_time = time.time()
+        assert db.execute('SELECT 2', None, fetch=True) == (2,)
+        assert time.time() - start_time >= 3
+        restart.join()
+    finally:
+        db.close()
+        proxy.stop()
+
+
+def test_check_worker_column_without_migration():
+    conn = connect()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('ce')")
+        if cur.fetchone()[0] is not None:
+            conn.close()
+            pytest.skip('в тестовой базе уже есть таблица ce')
+        cur.execute('CREATE TABLE ce (chat_id text, captcha_flag boolean DEFAULT False, captcha_text text)')
+    db = ITC_db(TEST_PG_CRED, logging.getLogger('test_db_pool'))
+    try:
+        with pytest.raises(RuntimeError, match='ALTER TABLE ce ADD COLUMN worker_id'):
+            db.check_worker_column()
+        with conn.cursor() as cur:
+            cur.execute('ALTER TABLE ce ADD COLUMN worker_id integer NOT NULL DEFAULT 0')
+        db.check_worker_column()
+    finally:
+        db.close()
+        with conn.cursor() as cur:
+            cur.execute('DROP TABLE ce')
+        conn.close()
@@ -0,0 +1,63 @@
+import os
+from pathlib import Path
+from download_index import Download_index
+
+
+def write_file(path, data: bytes = b'x'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fl:
+        fl.write(data)
+
+
+def test_recursive_index_finds_files_in_subfolders(tmp_path):
+    write_file(tmp_path / 'Trade_Map_Argentina.txt')
+    write_file(tmp_path / '2023' / 'Trade_Map_Austria.txt')
+    write_file(tmp_path / '2023' / 'Trade_Map_Austria (1).txt')
+    write_file(tmp_path / '.staging' / 'Trade_Map_Chile.txt')
+    write_file(tmp_path / 'Trade_Map_Brazil.txt.crdownload')
+
+    # Парсер смотрит только в саму папку загрузки
+    assert Download_index(str(tmp_path)).names('Tra*.txt') == ['Trade_Map_Argentina.txt']
+
+    download_index = Download_index(str(tmp_path), recursive=True)
+    assert download_index.names('Tra*.txt') == ['2023/Trade_Map_Austria (1).txt', '2023/Trade_Map_Austria.txt',
+                                                'Trade_Map_Argentina.txt']
+    # Как Path(folder).glob('**/Tra*.txt') без скрытых папок
+    assert sorted(download_index.paths('Tra*.txt')) == sorted(
+        path for path in tmp_path.glob('**/Tra*.txt') if '.staging' not in path.parts)
+
+    for name in download_index.names('*(1)*.txt'):
+        download_index.remove(name)
+    assert not (tmp_path / '2023' / 'Trade_Map_Austria (1).txt').exists()
+    download_index.save()
+    assert Download_index(str(tmp_path), recursive=True).paths('*(1)*.txt') == []
+    assert Download_index(str(tmp_path), recursive=True).get('2023/Trade_Map_Austria.txt')['size'] == 1
+    assert Path(tmp_path, '2023/Trade_Map_Austria.txt').is_file()
+
+
+def test_hash_is_computed_on_demand(tmp_path, monkeypatch):
+    write_file(tmp_path / 'Trade_Map_Argentina.txt', b'abc')
+    hashed = []
+    real_file_hash = Download_index.file_hash
+
+    def counted_file_hash(full_path_file):
+        hashed.append(os.path.basename(full_path_file))
+        return real_file_hash(full_path_file)
+
+    monkeypatch.setattr(Download_index, 'file_hash', staticmethod(counted_file_hash))
+    download_index = Download_index(str(tmp_path))
+    download_index.add('Trade_Map_Argentina.txt')
+    # Построение индекса и add не читают содержимое файлов
+    assert hashed == []
+    assert download_index.get('Trade_Map_Argentina.txt')['hash'] is None
+    assert download_index.hash('Trade_Map_Argentina.txt') == '900150983cd24fb0d6963f7d28e17f72'
+    assert download_index.hash('Trade_Map_Argentina.txt') == '900150983cd24fb0d6963f7d28e17f72'
+    assert hashed == ['Trade_Map_Argentina.txt']
+    download_index.save()
+
+    # Посчитанный хэш берется из сохраненного индекса, пока файл не изменился
+    assert Download_index(str(tmp_path)).hash('Trade_Map_Argentina.txt') == '900150983cd24fb0d6963f7d28e17f72'
+    assert hashed == ['Trade_Map_Argentina.txt']
+    write_file(tmp_path / 'Trade_Map_Argentina.txt', b'abcd')
+    assert Download_index(str(tmp_path)).get('Trade_Map_Argentina.txt')['hash'] is None
+    assert download_index.hash('Atlantis.txt') is None
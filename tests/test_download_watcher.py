@@ -0,0 +1,136 @@
+import logging
+import os
+import sys
+import threading
+import time
+import pytest
+import download_watcher
+from download_watcher import Download_watcher, CHROME_TEMP_SUFFIX
+
+LOGGER = logging.getLogger('test_download_watcher')
+
+
+def write_file(path, data: bytes, mode: str = 'ab'):
+    with open(path, mode) as fl:
+        fl.write(data)
+
+
+def chrome_download(folder, file_name: str, delay: float = 0.2, chunks: int = 3) -> threading.Thread:
+    """
+    Пишет файл так же, как Chrome: сначала {file_name}.crdownload кусками, потом переименование
+
+    :param folder: папка загрузки
+
+    :param file_name: итоговое имя файла
+
+    :param delay: пауза перед каждым куском
+
+    :param chunks: количество кусков
+
+    :return: поток, который пишет файл
+    """
+    def download():
+        temp_path = os.path.join(folder, file_name + CHROME_TEMP_SUFFIX)
+        for _ in range(chunks):
+            time.sleep(delay)
+            write_file(temp_path, b'x' * 1000)
+        os.rename(temp_path, os.path.join(folder, file_name))
+    thread = threading.Thread(target=download)
+    thread.start()
+    return thread
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    watcher = Download_watcher(str(tmp_path), LOGGER, stall_timeout=1, poll_interval=0.1)
+    yield watcher
+    watcher.close()
+
+
+def test_wait_for_completed_download(watcher, tmp_path):
+    baseline = watcher.snapshot()
+    writer = chrome_download(tmp_path, 'Trade_Map.txt')
+    assert watcher.wait_for('Trade_Map.txt', timeout=10, baseline=baseline)
+    writer.join()
+    assert os.path.getsize(tmp_path / 'Trade_Map.txt') == 3000
+    assert watcher.tracked == {}
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify есть только на Linux')
+def test_inotify_wakes_before_poll_interval(tmp_path):
+    watcher = Download_watcher(str(tmp_path), LOGGER, poll_interval=30)
+    assert watcher._inotify_fd is not None
+    threading.Timer(0.3, write_file, (tmp_path / 'Trade_Map.txt', b'x')).start()
+    start_time = time.time()
+    watcher.sleep_until_event(30)
+    assert time.time() - start_time < 5
+    watcher.close()
+
+
+def test_stall_after_first_byte(watcher, tmp_path):
+    temp_path = tmp_path / ('Trade_Map.txt' + CHROME_TEMP_SUFFIX)
+    write_file(temp_path, b'x')
+    start_time = time.time()
+    # Зависшая загрузка обрывается по stall_timeout, а не по общему timeout
+    assert not watcher.wait_for('Trade_Map.txt', timeout=30, baseline={})
+    assert time.time() - start_time < 10
+    # Временный файл удален, чтобы повторная загрузка получила то же имя
+    assert not temp_path.exists()
+
+
+def test_no_stall_before_first_byte(watcher, tmp_path):
+    # Пока сайт формирует отчет, временный файл пустой: это не зависание, действует только timeout
+    write_file(tmp_path / ('Trade_Map.txt' + CHROME_TEMP_SUFFIX), b'')
+    watcher.track('Trade_Map.txt', timeout=2, baseline={})
+    time.sleep(1.5)
+    assert watcher.poll() == ([], [])
+    time.sleep(1)
+    assert watcher.poll() == ([], ['Trade_Map.txt'])
+
+
+def test_parallel_unconfirmed_files_go_to_their_downloads(watcher, tmp_path):
+    first_temp, second_temp = 'Unconfirmed 101.crdownload', 'Unconfirmed 202.crdownload'
+    # Первая загрузка: снимок до клика, потом Chrome создает свой временный файл
+    baseline_first = watcher.snapshot()
+    write_file(tmp_path / first_temp, b'x')
+    watcher.track('Trade_Map_Argentina.txt', timeout=30, baseline=baseline_first)
+    # Вторая загрузка начинается, пока первая еще идет
+    baseline_second = watcher.snapshot()
+    write_file(tmp_path / second_temp, b'x')
+    watcher.track('Trade_Map_Austria.txt', timeout=30, baseline=baseline_second)
+
+    assert watcher.poll() == ([], [])
+    assert watcher.tracked['Trade_Map_Argentina.txt']['temp_files'] == {first_temp}
+    assert watcher.tracked['Trade_Map_Austria.txt']['temp_files'] == {second_temp}
+
+    # Растет только вторая загрузка: зависает первая, и удаляется только ее временный файл
+    deadline = time.time() + 10
+    failed = []
+    while not failed and time.time() < deadline:
+        write_file(tmp_path / second_temp, b'x')
+        failed = watcher.poll()[1]
+        time.sleep(0.2)
+    assert failed == ['Trade_Map_Argentina.txt']
+    assert not (tmp_path / first_temp).exists()
+    assert (tmp_path / second_temp).exists()
+
+    os.rename(tmp_path / second_temp, tmp_path / 'Trade_Map_Austria.txt')
+    assert watcher.poll() == (['Trade_Map_Austria.txt'], [])
+    assert watcher.tracked == {}
+
+
+def test_polling_without_inotify(tmp_path, monkeypatch, caplog):
+    def no_libc(*args, **kwargs):
+        raise OSError('libc недоступна')
+
+    monkeypatch.setattr(download_watcher.ctypes, 'CDLL', no_libc)
+    caplog.set_level(logging.INFO, logger=LOGGER.name)
+    watcher = Download_watcher(str(tmp_path), LOGGER, stall_timeout=1, poll_interval=0.1)
+    assert watcher._inotify_fd is None
+    if sys.platform.startswith('linux'):
+        assert 'INOTIFY НЕДОСТУПЕН' in caplog.text
+    baseline = watcher.snapshot()
+    writer = chrome_download(tmp_path, 'Trade_Map.txt')
+    assert watcher.wait_for('Trade_Map.txt', timeout=10, baseline=baseline)
+    writer.join()
+    watcher.close()
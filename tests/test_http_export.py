@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import pytest
+import http_export
+from http_export import ITC_http_exporter, _Form_parser
+
+PARTNER_SELECT_ID = 'ctl00_NavigationControl_DropDownList_Partner'
+PARTNER_SELECT_NAME = 'ctl00$NavigationControl$DropDownList_Partner'
+BUTTON_ID = 'ctl00_PageContent_GridViewPanelControl_ImageButton_Text'
+BUTTON_NAME = 'ctl00$PageContent$GridViewPanelControl$ImageButton_Text'
+DICT_HTML_ELEMENTS = {'country_partner': PARTNER_SELECT_ID, 'download_button_txt': BUTTON_ID}
+PARTNERS = [('0', 'All'), ('032', 'Argentina'), ('040', 'Austria'), ('096', 'Brunei Darussalam')]
+
+
+def trade_map_page(selected: str = '0', view_state: str = 'state_all') -> str:
+    """
+    :param selected: value выбранного партнера
+
+    :param view_state: значение __VIEWSTATE страницы
+
+    :return: страница в том виде, в каком ее отдает ASP.NET форма Trade Map
+    """
+    options = ''.join(f'<option{" selected" if value == selected else ""} value="{value}">{text}</option>'
+                      for value, text in PARTNERS)
+    return f"""<html><body>
+        <form method="post" action="./Product_SelCountry_TS.aspx?nvpm=1" id="aspnetForm">
+        <input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+        <input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />
+        <input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{view_state}" />
+        <select name="{PARTNER_SELECT_NAME}" id="{PARTNER_SELECT_ID}">{options}</select>
+        <input type="image" name="{BUTTON_NAME}" id="{BUTTON_ID}" src="txt.gif" />
+        </form></body></html>"""
+
+
+class _Trade_map_handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body: bytes, headers: dict):
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        fields = {name: values[0] for name, values in
+                  parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode(),
+                           keep_blank_values=True).items()}
+        self.server.requests.append({'path': self.path, 'cookie': self.headers.get('Cookie'), 'fields': fields})
+        partner_value = fields.get(PARTNER_SELECT_NAME)
+        if fields.get('__EVENTTARGET') == PARTNER_SELECT_NAME:
+            # Потерянная сессия: вместо страницы партнера приходит страница логина без формы
+            if partner_value == '096':
+                self._send(b'<html><body>Login</body></html>', {'Content-Type': 'text/html'})
+                return
+            self._send(trade_map_page(partner_value, f'state_{partner_value}').encode(),
+                       {'Content-Type': 'text/html; charset=utf-8'})
+        elif f'{BUTTON_NAME}.x' in fields:
+            # Для Austria сервер возвращает страницу с ошибкой вместо файла
+            if partner_value == '040':
+                self._send(b'<html><body>Error</body></html>', {'Content-Type': 'text/html'})
+                return
+            self._send(('Product code\tProduct label\n' + 'x' * 200000 + f'\t{partner_value}\n').encode(),
+                       {'Content-Type': 'text/plain',
+                        'Content-Disposition': 'attachment; filename=Trade_Map.txt'})
+        else:
+            self.send_error(400)
+
+
+class _Fake_browser:
+
+    def __init__(self, url: str):
+        self.current_url = url
+        self.page_source = trade_map_page()
+
+    @staticmethod
+    def get_cookies():
+        return [{'name': 'ASP.NET_SessionId', 'value': 'session42', 'domain': '127.0.0.1', 'path': '/'}]
+
+    @staticmethod
+    def execute_script(script):
+        return 'Mozilla/5.0 test'
+
+
+@pytest.fixture
+def trade_map_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Trade_map_handler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def exporter(trade_map_server):
+    exporter = ITC_http_exporter(DICT_HTML_ELEMENTS, logging.getLogger('test_http_export'), '', max_workers=2)
+    exporter.load_browser_state(
+        _Fake_browser(f'http://127.0.0.1:{trade_map_server.server_port}/Product_SelCountry_TS.aspx?nvpm=1'))
+    yield exporter
+    exporter.close()
+
+
+def test_form_parser_reads_hidden_fields_and_selects():
+    form = ITC_http_exporter.parse_form(trade_map_page('040'))
+    assert form.action == './Product_SelCountry_TS.aspx?nvpm=1'
+    assert form.fields['__VIEWSTATE'] == 'state_all'
+    assert form.fields[PARTNER_SELECT_NAME] == '040'
+    assert form.select_names[PARTNER_SELECT_ID] == PARTNER_SELECT_NAME
+    assert form.select_options[PARTNER_SELECT_NAME] == PARTNERS
+    # Кнопка-картинка не отправляется с формой, но ее name нужен для постбэка выгрузки
+    assert BUTTON_NAME not in form.fields
+    assert form.input_names[BUTTON_ID] == BUTTON_NAME
+
+
+def test_form_parser_browser_defaults():
+    form = _Form_parser()
+    form.feed("""<form action="a.aspx">
+        <input type="checkbox" name="unchecked" value="1">
+        <input type="checkbox" name="checked" value="1" checked>
+        <input type="text" name="empty">
+        <select name="no_selected"><option value="a">A<option value="b">B</select>
+        <select name="no_value"><option>First &amp; only</option></select>
+        </form>""")
+    form.close()
+    assert 'unchecked' not in form.fields
+    assert form.fields['checked'] == '1'
+    assert form.fields['empty'] == ''
+    # Без selected браузер отправляет первую опцию, незакрытые <option> завершаются следующим тэгом
+    assert form.fields['no_selected'] == 'a'
+    assert form.select_options['no_selected'] == [('a', 'A'), ('b', 'B')]
+    assert form.fields['no_value'] == 'First & only'
+
+
+def test_select_partner_posts_form_state(exporter, trade_map_server):
+    partner_form = exporter.select_partner('Argentina')
+    assert partner_form is not None
+    assert partner_form.fields[PARTNER_SELECT_NAME] == '032'
+    assert partner_form.fields['__VIEWSTATE'] == 'state_032'
+
+    request = trade_map_server.requests[-1]
+    assert request['path'] == '/Product_SelCountry_TS.aspx?nvpm=1'
+    assert request['cookie'] == 'ASP.NET_SessionId=session42'
+    assert request['fields']['__EVENTTARGET'] == PARTNER_SELECT_NAME
+    assert request['fields']['__VIEWSTATE'] == 'state_all'
+
+
+def test_select_partner_unknown_or_lost_session(exporter, trade_map_server):
+    assert exporter.select_partner('Atlantis') is None
+    assert trade_map_server.requests == []
+    assert exporter.select_partner('Brunei Darussalam') is None
+
+
+def test_download_text_writes_part_then_replaces(exporter, tmp_path, monkeypatch):
+    full_path_file = str(tmp_path / 'Trade_Map_Argentina.txt')
+    replace_calls = []
+    real_replace = os.replace
+
+    def checked_replace(src, dst):
+        # Пока файл не дописан, итогового файла нет, есть только .part
+        assert not os.path.exists(dst)
+        assert os.path.getsize(src) > 200000
+        replace_calls.append((src, dst))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(http_export.os, 'replace', checked_replace)
+    assert exporter.download_text(exporter.select_partner('Argentina'), full_path_file)
+    assert replace_calls == [(full_path_file + '.part', full_path_file)]
+    with open(full_path_file, encoding='utf-8') as fl:
+        assert fl.readline() == 'Product code\tProduct label\n'
+        assert fl.read().endswith('\t032\n')
+    assert os.listdir(tmp_path) == ['Trade_Map_Argentina.txt']
+
+
+def test_download_text_html_response(exporter, tmp_path):
+    full_path_file = str(tmp_path / 'Trade_Map_Austria.txt')
+    assert not exporter.download_text(exporter.select_partner('Austria'), full_path_file)
+    assert os.listdir(tmp_path) == []
+
+
+def test_export_partners(exporter, tmp_path):
+    partner_files = [(partner, str(tmp_path / f'{partner}.txt'))
+                     for partner in ('Argentina', 'Austria', 'Brunei Darussalam', 'Atlantis')]
+    assert exporter.export_partners(partner_files) == {'Argentina': 'downloaded', 'Austria': 'failed',
+                                                      'Brunei Darussalam': 'failed', 'Atlantis': 'failed'}
+    assert exporter.export_partners(partner_files[:1], lambda partner, form: False) == {'Argentina': 'skipped'}
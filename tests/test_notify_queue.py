@@ -0,0 +1,150 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import pytest
+
+pytest.importorskip('telebot')
+from telebot import apihelper
+from notify_queue import ITC_notify_queue
+
+BOT_TOKEN = '123:test'
+
+
+class _Bot_api_handler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        method = url.path.rsplit('/', 1)[-1]
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        server = self.server
+        # Первый запрос можно задержать, чтобы за это время в очереди накопились сообщения
+        if server.hold_first and not server.calls:
+            server.calls.append(None)
+            server.release.wait(10)
+            server.calls.pop()
+        server.calls.append({'time': time.time(), 'method': method, 'chat_id': params.get('chat_id'),
+                             'text': params.get('text', params.get('caption'))})
+        if server.responses_429:
+            server.responses_429 -= 1
+            body, status = {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                            'parameters': {'retry_after': 1}}, 429
+        else:
+            result = {'message_id': len(server.calls), 'date': int(time.time()),
+                      'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'}}
+            if method == 'sendPhoto':
+                result['photo'] = [{'file_id': f'file_{len(server.calls)}', 'file_unique_id': 'u',
+                                    'width': 10, 'height': 10}]
+            else:
+                result['text'] = params.get('text')
+            body, status = {'ok': True, 'result': result}, 200
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+@pytest.fixture
+def bot_api():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Bot_api_handler)
+    server.calls = []
+    server.hold_first = False
+    server.release = threading.Event()
+    server.responses_429 = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    api_url = apihelper.API_URL
+    yield server
+    server.release.set()
+    apihelper.API_URL = api_url
+    server.shutdown()
+    server.server_close()
+
+
+def create_queue(server, min_interval: float = 0.0) -> ITC_notify_queue:
+    return ITC_notify_queue(BOT_TOKEN, logging.getLogger('test_notify_queue'), min_interval=min_interval,
+                            api_url=f'http://127.0.0.1:{server.server_port}/bot{{0}}/{{1}}')
+
+
+def wait_first_request(server):
+    deadline = time.time() + 10
+    while not server.calls and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_photo_goes_before_queued_messages(bot_api):
+    bot_api.hold_first = True
+    notify = create_queue(bot_api)
+    notify.send_message('1', 'first')
+    wait_first_request(bot_api)
+    notify.send_message('1', 'second')
+    notify.send_message('1', 'third')
+    future = notify.send_photo('1', b'png', caption='captcha')
+    bot_api.release.set()
+    assert future.result(timeout=10).photo[-1].file_id.startswith('file_')
+    notify.close()
+    assert [call['text'] for call in bot_api.calls] == ['first', 'captcha', 'second', 'third']
+
+
+def test_messages_with_same_key_are_coalesced(bot_api):
+    bot_api.hold_first = True
+    notify = create_queue(bot_api)
+    notify.send_message('1', 'first')
+    wait_first_request(bot_api)
+    notify.send_message('1', 'news 1', key='news_window')
+    notify.send_message('1', 'other')
+    notify.send_message('1', 'news 2', key='news_window')
+    bot_api.release.set()
+    notify.close()
+    # Склеенное сообщение остается на месте первого, текст берется последний
+    assert [call['text'] for call in bot_api.calls] == ['first', 'news 2', 'other']
+
+
+def test_one_message_per_second_per_chat(bot_api):
+    notify = create_queue(bot_api, min_interval=1.0)
+    for number in range(3):
+        notify.send_message('1', f'chat 1 #{number}')
+    notify.send_message('2', 'chat 2')
+    notify.close()
+    chat_1 = [call['time'] for call in bot_api.calls if call['chat_id'] == '1']
+    assert len(chat_1) == 3
+    assert all(later - earlier >= 0.95 for earlier, later in zip(chat_1, chat_1[1:]))
+    # Второй чат не ждет паузу первого
+    chat_2 = next(call['time'] for call in bot_api.calls if call['chat_id'] == '2')
+    assert chat_2 - chat_1[-1] < 0.5
+
+
+def test_retry_after_on_429(bot_api):
+    bot_api.responses_429 = 1
+    notify = create_queue(bot_api)
+    future = notify.send_photo('1', b'png', caption='captcha')
+    assert future.result(timeout=10).photo[-1].file_id
+    notify.close()
+    assert len(bot_api.calls) == 2
+    assert bot_api.calls[1]['time'] - bot_api.calls[0]['time'] >= 1
+
+
+def test_cancelled_photo_is_not_sent(bot_api):
+    bot_api.hold_first = True
+    notify = create_queue(bot_api)
+    notify.send_message('1', 'first')
+    wait_first_request(bot_api)
+    future = notify.send_photo('1', b'png', caption='stale captcha')
+    with pytest.raises(FutureTimeoutError):
+        future.result(timeout=0.2)
+    assert future.cancel()
+    bot_api.release.set()
+    notify.close()
+    assert [call['text'] for call in bot_api.calls] == ['first']
@@ -0,0 +1,25 @@
+import json
+import sqlite3
+import pytest
+from state_store import ITC_state_store
+
+
+@pytest.fixture
+def state_store(tmp_path, monkeypatch):
+    # json файлы выгружаются в текущую папку, как у ноутбуков
+    monkeypatch.chdir(tmp_path)
+    return ITC_state_store(str(tmp_path / 'itc_state.sqlite'), batch_size=1000, flush_interval=0.01)
+
+
+def test_close_stops_flusher_and_exports_json(state_store, tmp_path):
+    state_store.add_partner('Chile', 'Imports', 'Argentina')
+    state_store.add_mirror_year('Chile', '2021')
+    state_store.close()
+    assert not state_store._flusher.is_alive()
+    with pytest.raises(sqlite3.ProgrammingError):
+        state_store.conn.execute('SELECT 1')
+    with open(tmp_path / 'Imports_res.json', encoding='utf-8') as fl:
+        assert json.load(fl) == {'Chile': ['Argentina']}
+    with open(tmp_path / 'json_mirror_data.json', encoding='utf-8') as fl:
+        assert json.load(fl) == {'Chile': ['2021']}
+
@@ -0,0 +1,107 @@
+import logging
+import queue
+import threading
+import typing
+from class_parser import ITC_parser
+
+
+class ITC_worker_pool:
+
+    def __init__(self, parser_factory: typing.Callable[[int], ITC_parser], num_workers: int,
+                 castom_logger: logging.Logger):
+        """
+        :param parser_factory: функция, которая по номеру воркера создает отдельный экземпляр ITC_parser
+                               (свой браузер, свое подключение к БД и своя строка ce)
+
+        :param num_workers: количество одновременно работающих браузеров
+
+        :param castom_logger: экзепляр класса logging для записи логов пула в файл
+        """
+        self.parser_factory = parser_factory
+        self.num_workers = num_workers
+        self.castom_logger = castom_logger
+        self.failed_chains = []
+        self._failed_lock = threading.Lock()
+
+    @staticmethod
+    def build_chains(reporter_list: list, type_flow_list: list, qty_or_value_list: list,
+                     product_cluster: typing.Optional[str] = 'not_tariff') -> list:
+        """
+        Собирает цепочки задач. Цепочка - это все величины для одной пары репортер/направление,
+        внутри цепочки задачи выполняются строго по порядку, т.к. Quantities читает {type_flow}_res.json,
+        который появляется только после Values. Разные цепочки между собой независимы
+
+        :param reporter_list: список репортеров
+
+        :param type_flow_list: список направлений торговли ('Imports', 'Exports')
+
+        :param qty_or_value_list: список величин ('Values', 'Quantities')
+
+        :param product_cluster: not_tariff или tariff
+
+        :return: список цепочек, каждая цепочка - список словарей с параметрами для ITC_parser.main
+        """
+        # Values всегда идут первыми, независимо от порядка, в котором их передали
+        qty_or_value_list = sorted(qty_or_value_list, key=lambda x: x != 'Values')
+        chains = []
+        for reporter_name in reporter_list:
+            for type_flow in type_flow_list:
+                chains.append([{'reporter_name': reporter_name, 'type_flow': type_flow,
+                                'qty_or_value': qty_or_value, 'product_cluster': product_cluster}
+                               for qty_or_value in qty_or_value_list])
+        return chains
+
+    def _worker(self, worker_id: int, chains_queue: queue.Queue):
+        """
+        Воркер создает свой парсер (и свою сессию браузера) и забирает цепочки из очереди, пока она не опустеет
+
+        :param worker_id: номер воркера
+
+        :param chains_queue: очередь цепочек задач
+
+        :return:
+        """
+        parser = self.parser_factory(worker_id)
+        try:
+            while True:
+                try:
+                    chain = chains_queue.get_nowait()
+                except queue.Empty:
+                    break
+                for job in chain:
+                    try:
+                        self.castom_logger.info(f"""ВОРКЕР {worker_id} ЗАДАЧА {job}""")
+                        parser.main(**job)
+                    except Exception as e:
+                        # Следующие задачи цепочки зависят от текущей, поэтому прерываем всю цепочку
+                        self.castom_logger.exception(f"""ВОРКЕР {worker_id} ОШИБКА В ЗАДАЧЕ {job} {e}""")
+                        with self._failed_lock:
+                            self.failed_chains.append(chain[chain.index(job):])
+                        break
+                chains_queue.task_done()
+        finally:
+            # Браузер воркера живет все время работы воркера и закрывается только в конце
+            parser.close_session()
+
+    def run(self, chains: list) -> list:
+        """
+        Запускает цепочки задач на num_workers браузерах одновременно
+
+        :param chains: список цепочек из build_chains
+
+        :return: список не выполненных (прерванных ошибкой) остатков цепочек
+        """
+        chains_queue = queue.Queue()
+        for chain in chains:
+            chains_queue.put(chain)
+
+        workers = [threading.Thread(target=self._worker, args=(worker_id, chains_queue),
+                                    name=f'itc_worker_{worker_id}')
+                   for worker_id in range(min(self.num_workers, len(chains)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.castom_logger.info(f"""ПУЛ ЗАВЕРШЕН. ЦЕПОЧЕК С ОШИБКОЙ {len(self.failed_chains)}""")
+        return self.failed_chains